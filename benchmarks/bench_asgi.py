@@ -0,0 +1,169 @@
+"""
+ASGI Benchmark
+
+Compares the sync Flask app under gunicorn's sync workers with the ASGI
+app under uvicorn, at equal memory: both servers run the same number of
+worker processes, and the resident memory of each server's processes is
+reported next to its throughput and latency at every concurrency level.
+
+It seeds its rows under a product id of its own, starts each server on a
+local port, and deletes the rows again:
+
+    python -m benchmarks.bench_asgi --workers 1 --concurrency 1 8 32 --seconds 5
+"""
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from service.models import Recommendation, RecommendationType
+
+SOURCE_PID = 999999997
+SERVERS = {
+    "gunicorn sync": ["-m", "gunicorn", "--bind", "127.0.0.1:{port}", "--workers", "{workers}", "service:app"],
+    "uvicorn asgi": [
+        "-m", "uvicorn", "service.asgi:app", "--port", "{port}", "--workers", "{workers}",
+        "--log-level", "warning",
+    ],
+}
+
+
+def seed(count: int):
+    """Inserts count Recommendations for the benchmark's product"""
+    Recommendation.delete_matching(source_pid=SOURCE_PID)
+    Recommendation.create_many(
+        [
+            Recommendation(
+                source_pid=SOURCE_PID,
+                name="benchmark",
+                recommendation_name=f"recommendation {number}",
+                type=RecommendationType.UPSELL,
+                number_of_likes=number,
+                number_of_dislikes=0,
+            )
+            for number in range(count)
+        ]
+    )
+
+
+def start(name: str, port: int, workers: int) -> subprocess.Popen:
+    """Starts a server and waits until it answers its health check"""
+    arguments = [part.format(port=port, workers=workers) for part in SERVERS[name]]
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, *arguments], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{name} did not start on port {port}")
+
+
+def rss(pid: int) -> int:
+    """Returns the resident memory in bytes of a process and all of its children"""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="ascii") as children:
+            total += sum(rss(int(child)) for child in children.read().split())
+    except FileNotFoundError:
+        pass
+    return total
+
+
+def load(port: int, path: str, concurrency: int, seconds: float) -> dict:
+    """Sends requests from concurrency clients for some seconds"""
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while time.monotonic() < deadline:
+            start_time = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException) as error:
+                errors.append(error)
+                connection.close()
+                continue
+            latencies.append(time.perf_counter() - start_time)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        "rps": len(latencies) / seconds,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+        "errors": len(errors),
+    }
+
+
+def run(concurrency_levels, workers: int = 1, seconds: float = 5.0, rows: int = 100, port: int = 8765) -> dict:
+    """Loads each server at every concurrency level
+
+    Returns:
+        dict: {server: {"rss": bytes, "levels": {concurrency: {rps, p50_ms, p99_ms, errors}}}}
+    """
+    path = f"/api/recommendations?source_pid={SOURCE_PID}&limit=20"
+    results = {}
+    seed(rows)
+    try:
+        for name in SERVERS:
+            server = start(name, port, workers)
+            try:
+                levels = {
+                    concurrency: load(port, path, concurrency, seconds)
+                    for concurrency in concurrency_levels
+                }
+                results[name] = {"rss": rss(server.pid), "levels": levels}
+            finally:
+                server.terminate()
+                server.wait(10)
+    finally:
+        Recommendation.delete_matching(source_pid=SOURCE_PID)
+    return results
+
+
+def main():
+    """Prints a table of the throughput, latency and memory of both servers"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    results = run(args.concurrency, args.workers, args.seconds, args.rows, args.port)
+    print(f"{'server':>14} {'MiB':>7} {'clients':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, result in results.items():
+        for concurrency, level in result["levels"].items():
+            print(
+                f"{name:>14} {result['rss'] / 2 ** 20:>7.1f} {concurrency:>8} {level['rps']:>8.1f}"
+                f" {level['p50_ms'] or 0:>8.1f} {level['p99_ms'] or 0:>8.1f} {level['errors']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Endpoint Benchmark
+
+Drives every endpoint of the API with concurrent clients against a server
+started on a local port, and reports the throughput and the p50, p95 and
+p99 latency of each scenario at every concurrency level.
+
+The rows are built with RecommendationFactory and seeded under product ids
+of their own, ROWS_PER_PRODUCT to a product. They are kept between runs, so
+a large volume is only seeded once; --cleanup deletes them. Rows created
+during the run go to one scratch product and are deleted at the end.
+
+The results are written as JSON. Given the JSON of an earlier run as a
+baseline, the run fails when a scenario lost more than the tolerance of its
+throughput, got that much slower at p95 or returned errors it did not
+return before:
+
+    python -m benchmarks.bench_endpoints --rows 10000 --output baseline.json
+    python -m benchmarks.bench_endpoints --rows 10000 --baseline baseline.json --output current.json
+
+The service runs on Postgres only, so the rows go to the database of
+DATABASE_URI like in the other benchmarks.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote_plus
+import orjson
+from sqlalchemy import delete, func, select, text
+from service.models import Recommendation, db, snapshot_table
+from tests.factories import RecommendationFactory
+from benchmarks.bench_asgi import SERVERS, start
+
+BASE_URL = "/api/recommendations"
+# Products of the seeded rows start at BASE_PID, and rows created while running go to SCRATCH_PID
+BASE_PID = 900000000
+SCRATCH_PID = BASE_PID - 1
+ROWS_PER_PRODUCT = 20
+# Distinct rows built by the factory, which the seed repeats across the products
+POOL_SIZE = 1000
+SCENARIOS = [
+    "get",
+    "list",
+    "list_source_pid",
+    "list_name",
+    "list_recommendation_name",
+    "list_type",
+    "list_min_likes",
+    "create",
+    "update",
+    "like",
+    "dislike",
+    "delete",
+]
+# Result fields compared with the baseline, and whether a higher value is better
+GATED = {"rps": True, "p95_ms": False}
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+######################################################################
+# SEEDING
+######################################################################
+def seeded() -> int:
+    """Returns the number of seeded rows in the database"""
+    return db.session.execute(
+        select(func.count()).where(Recommendation.source_pid.between(BASE_PID, BASE_PID + 10 ** 8))
+    ).scalar()
+
+
+def seed(rows: int, batch_size: int = 10000):
+    """Seeds rows Recommendations unless exactly that many are seeded already"""
+    if seeded() == rows:
+        return
+    cleanup()
+    pool = RecommendationFactory.build_batch(POOL_SIZE)
+    rng = random.Random(0)
+    for first in range(0, rows, batch_size):
+        Recommendation.create_many(
+            [
+                Recommendation(
+                    source_pid=BASE_PID + number // ROWS_PER_PRODUCT,
+                    name=pool[number % POOL_SIZE].name,
+                    recommendation_name=pool[number % POOL_SIZE].recommendation_name,
+                    type=pool[number % POOL_SIZE].type,
+                    number_of_likes=rng.randrange(100),
+                    number_of_dislikes=rng.randrange(20),
+                )
+                for number in range(first, min(rows, first + batch_size))
+            ],
+            batch_size=batch_size,
+        )
+    db.session.execute(text("ANALYZE recommendation"))
+    db.session.commit()
+
+
+def cleanup():
+    """Deletes the seeded rows, the scratch product's rows and their snapshots"""
+    seeded_pids = Recommendation.source_pid.between(SCRATCH_PID, BASE_PID + 10 ** 8)
+    db.session.execute(delete(Recommendation).where(seeded_pids))
+    db.session.execute(
+        delete(snapshot_table).where(snapshot_table.c.source_pid.between(SCRATCH_PID, BASE_PID + 10 ** 8))
+    )
+    db.session.commit()
+
+
+######################################################################
+# WORKLOAD
+######################################################################
+class Workload:
+    """Picks the request of every scenario from the seeded rows"""
+
+    def __init__(self, rows: int):
+        self.products = max(1, math.ceil(rows / ROWS_PER_PRODUCT))
+        in_seed = Recommendation.source_pid.between(BASE_PID, BASE_PID + self.products)
+        self.first_id, self.last_id = db.session.execute(
+            select(func.min(Recommendation.rec_id), func.max(Recommendation.rec_id)).where(in_seed)
+        ).one()
+        self.names = db.session.execute(
+            select(Recommendation.name, Recommendation.recommendation_name).where(in_seed).limit(100)
+        ).all()
+        db.session.rollback()
+        self.pool = RecommendationFactory.build_batch(100)
+        # ids of the rows created by the create scenario, which the delete scenario removes
+        self.created = []
+
+    def request(self, scenario: str, rng: random.Random) -> tuple:
+        """Returns the (method, path, body) of a request of a scenario"""
+        return getattr(self, scenario)(rng)
+
+    def rec_id(self, rng) -> int:
+        """Returns the id of a seeded row"""
+        return rng.randint(self.first_id, self.last_id)
+
+    def body(self, rng, source_pid: int) -> bytes:
+        """Returns the JSON of a Recommendation built by the factory"""
+        recommendation = rng.choice(self.pool)
+        return orjson.dumps(
+            {
+                "source_pid": source_pid,
+                "name": recommendation.name,
+                "recommendation_name": recommendation.recommendation_name,
+                "type": recommendation.type.name,
+                "number_of_likes": 0,
+                "number_of_dislikes": 0,
+            }
+        )
+
+    def get(self, rng):
+        """Reads one Recommendation"""
+        return "GET", f"{BASE_URL}/{self.rec_id(rng)}", None
+
+    def list(self, _rng):
+        """Lists the first page without a filter"""
+        return "GET", f"{BASE_URL}?limit=20", None
+
+    def list_source_pid(self, rng):
+        """Lists the Recommendations of a product"""
+        return "GET", f"{BASE_URL}?source_pid={BASE_PID + rng.randrange(self.products)}&limit=20", None
+
+    def list_name(self, rng):
+        """Lists the Recommendations with a name"""
+        return "GET", f"{BASE_URL}?name={quote_plus(rng.choice(self.names).name)}&limit=20", None
+
+    def list_recommendation_name(self, rng):
+        """Lists the Recommendations with a recommendation name"""
+        name = quote_plus(rng.choice(self.names).recommendation_name)
+        return "GET", f"{BASE_URL}?recommendation_name={name}&limit=20", None
+
+    def list_type(self, rng):
+        """Lists the Recommendations of a type"""
+        return "GET", f"{BASE_URL}?type={rng.choice(['UPSELL', 'CROSSSELL', 'ACCESSORY'])}&limit=20", None
+
+    def list_min_likes(self, rng):
+        """Lists the Recommendations with at least some likes"""
+        return "GET", f"{BASE_URL}?min_likes={rng.randrange(100)}&limit=20", None
+
+    def create(self, rng):
+        """Creates a Recommendation on the scratch product"""
+        return "POST", BASE_URL, self.body(rng, SCRATCH_PID)
+
+    def update(self, rng):
+        """Rewrites a seeded row, keeping it on a seeded product"""
+        return "PUT", f"{BASE_URL}/{self.rec_id(rng)}", self.body(rng, BASE_PID + rng.randrange(self.products))
+
+    def like(self, rng):
+        """Likes a seeded row"""
+        return "PUT", f"{BASE_URL}/{self.rec_id(rng)}/like", None
+
+    def dislike(self, rng):
+        """Dislikes a seeded row"""
+        return "PUT", f"{BASE_URL}/{self.rec_id(rng)}/dislike", None
+
+    def delete(self, _rng):
+        """Deletes a created row, or a missing one once they are all gone"""
+        try:
+            rec_id = self.created.pop()
+        except IndexError:
+            rec_id = self.last_id + 10 ** 9
+        return "DELETE", f"{BASE_URL}/{rec_id}", None
+
+
+######################################################################
+# LOAD
+######################################################################
+def percentile(latencies: list, fraction: float):
+    """Returns the nearest-rank percentile in milliseconds of sorted latencies"""
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+
+def load(port: int, workload: Workload, scenario: str, concurrency: int, seconds: float) -> dict:
+    """Sends the requests of a scenario from concurrency clients for some seconds"""
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + seconds
+
+    def client(number):
+        rng = random.Random(number)
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while time.monotonic() < deadline:
+            method, path, body = workload.request(scenario, rng)
+            start_time = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers=JSON_HEADERS if body else {})
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as error:
+                errors.append(error)
+                connection.close()
+                continue
+            latencies.append(time.perf_counter() - start_time)
+            if response.status >= 400:
+                errors.append(response.status)
+            elif response.status == 201:
+                workload.created.append(orjson.loads(data)["rec_id"])
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "errors": len(errors),
+    }
+
+
+# pylint: disable=too-many-arguments
+def run(scenarios, concurrency_levels, rows: int = 10000, seconds: float = 5.0, warmup: float = 1.0,
+        server: str = "gunicorn sync", workers: int = 1, port: int = 8766) -> dict:
+    """Runs every scenario at every concurrency level against a fresh server
+
+    Returns:
+        dict: {"meta": {...}, "scenarios": {scenario: {concurrency: {requests, rps, p50_ms, ...}}}}
+    """
+    seed(rows)
+    workload = Workload(rows)
+    results = {}
+    process = start(server, port, workers)
+    try:
+        for scenario in scenarios:
+            load(port, workload, scenario, 1, warmup)
+            results[scenario] = {
+                str(concurrency): load(port, workload, scenario, concurrency, seconds)
+                for concurrency in concurrency_levels
+            }
+    finally:
+        process.terminate()
+        process.wait(10)
+        Recommendation.delete_matching(source_pid=SCRATCH_PID)
+    meta = {
+        "rows": rows,
+        "server": server,
+        "workers": workers,
+        "seconds": seconds,
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+    return {"meta": meta, "scenarios": results}
+
+
+def git_commit():
+    """Returns the commit of the working tree, or None outside of git"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+######################################################################
+# REGRESSION GATE
+######################################################################
+def compare(baseline: dict, current: dict, tolerance: float = 0.1) -> list:
+    """Returns a description of every regression of current from baseline
+
+    A result regressed when a GATED field is worse than the baseline by more
+    than the tolerance, or when it has errors and the baseline had none.
+    Scenarios and levels missing from either run are not compared.
+    """
+    regressions = []
+    for scenario, levels in current["scenarios"].items():
+        for concurrency, result in levels.items():
+            before = baseline["scenarios"].get(scenario, {}).get(concurrency)
+            if before is None:
+                continue
+            label = f"{scenario} x{concurrency}"
+            for field, higher_is_better in GATED.items():
+                if result[field] is None or not before[field]:
+                    continue
+                change = result[field] / before[field] - 1
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append(f"{label}: {field} {result[field]:.1f}, was {before[field]:.1f} ({change:+.0%})")
+            if result["errors"] and not before["errors"]:
+                regressions.append(f"{label}: {result['errors']} errors, was none")
+    return regressions
+
+
+def print_results(results: dict):
+    """Prints a table of the results of every scenario"""
+    print(f"{'scenario':>26} {'clients':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for scenario, levels in results["scenarios"].items():
+        for concurrency, level in levels.items():
+            print(
+                f"{scenario:>26} {concurrency:>8} {level['rps']:>8.1f} {level['p50_ms'] or 0:>8.1f}"
+                f" {level['p95_ms'] or 0:>8.1f} {level['p99_ms'] or 0:>8.1f} {level['errors']:>7}"
+            )
+
+
+def main():
+    """Runs the benchmark, writes its JSON and fails on regressions from a baseline"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--server", choices=SERVERS, default="gunicorn sync")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--cleanup", action="store_true", help="delete the seeded rows and exit")
+    args = parser.parse_args()
+
+    if args.cleanup:
+        cleanup()
+        return
+    results = run(
+        args.scenarios, args.concurrency, args.rows, args.seconds, args.warmup,
+        args.server, args.workers, args.port,
+    )
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            regressions = compare(json.load(baseline), results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
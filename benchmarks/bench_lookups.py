@@ -0,0 +1,74 @@
+"""
+Lookup Benchmark
+
+Measures the per-call overhead of a find_by_source_pid() lookup when
+the query is rebuilt on every call, as it used to be, and with the
+prebuilt criterion and a bound parameter. The product looked up has no
+rows, so the time is the overhead of building, compiling and sending
+the statement.
+
+    python -m benchmarks.bench_lookups --calls 5000
+"""
+import argparse
+import time
+from sqlalchemy import text
+from service.models import Recommendation, db, statement_stats
+
+MISSING_PID = 999999998
+
+
+def rebuilt(source_pid):
+    """The old lookup: a new Query on every call"""
+    return Recommendation.query.filter(Recommendation.source_pid == source_pid).all()
+
+
+def prebuilt(source_pid):
+    """The new lookup: the module-level criterion with a bound parameter"""
+    return Recommendation.find_by_source_pid(source_pid).all()
+
+
+def measure(function, calls: int) -> dict:
+    """Returns the microseconds per call and the compiled cache counters"""
+    function(MISSING_PID)  # warm up the compiled cache and the connection
+    statement_stats.reset()
+    start = time.perf_counter()
+    for _ in range(calls):
+        function(MISSING_PID)
+    elapsed = time.perf_counter() - start
+    return dict(statement_stats.stats(), us_per_call=elapsed / calls * 1e6)
+
+
+def run(calls: int = 5000) -> dict:
+    """Times both lookups on one connection
+
+    Returns:
+        dict: {"rebuilt": {...}, "prebuilt": {...}, "prepared": count}
+    """
+    results = {
+        "rebuilt": measure(rebuilt, calls),
+        "prebuilt": measure(prebuilt, calls),
+        "prepared": db.session.execute(text("SELECT count(*) FROM pg_prepared_statements")).scalar(),
+    }
+    db.session.rollback()
+    return results
+
+
+def main():
+    """Prints the overhead of both lookups"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=5000)
+    args = parser.parse_args()
+
+    results = run(args.calls)
+    print(f"{'lookup':>10} {'us/call':>9} {'hits':>7} {'misses':>7} {'hit rate':>9}")
+    for name in ("rebuilt", "prebuilt"):
+        result = results[name]
+        print(
+            f"{name:>10} {result['us_per_call']:>9.1f} {result['hits']:>7}"
+            f" {result['misses']:>7} {result['hit_rate']:>9.2%}"
+        )
+    print(f"server-side prepared statements on the connection: {results['prepared']}")
+
+
+if __name__ == "__main__":
+    main()
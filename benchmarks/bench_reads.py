@@ -0,0 +1,106 @@
+"""
+Read Benchmark
+
+Compares reading and serializing a page of Recommendations as ORM
+instances with the Core select_records() path the GET endpoints use,
+by time and by peak memory allocated.
+
+It inserts its rows under a product id of its own and deletes them
+again, so it can run against a development database:
+
+    python -m benchmarks.bench_reads --sizes 1000 10000 100000
+"""
+import argparse
+import time
+import tracemalloc
+from service.models import Recommendation, RecommendationType, db
+
+SOURCE_PID = 999999999
+
+
+def seed(count: int):
+    """Inserts count Recommendations for the benchmark's product"""
+    Recommendation.delete_matching(source_pid=SOURCE_PID)
+    recommendations = [
+        Recommendation(
+            source_pid=SOURCE_PID,
+            name="benchmark",
+            recommendation_name=f"recommendation {number}",
+            type=RecommendationType.CROSSSELL,
+            number_of_likes=number % 97,
+            number_of_dislikes=number % 13,
+        )
+        for number in range(count)
+    ]
+    Recommendation.create_many(recommendations, batch_size=5000)
+
+
+def orm_reads() -> list:
+    """The old path: full ORM instances, then serialize()"""
+    recommendations = Recommendation.find_by_source_pid(SOURCE_PID).order_by(Recommendation.rec_id).all()
+    results = [recommendation.serialize() for recommendation in recommendations]
+    db.session.expunge_all()
+    return results
+
+
+def core_reads() -> list:
+    """The read-only path: Core select of the record columns, then serialize()"""
+    statement = Recommendation.select_records(source_pid=SOURCE_PID).order_by(Recommendation.rec_id)
+    records = Recommendation.records(db.session.execute(statement))
+    return [record.serialize() for record in records]
+
+
+def measure(function, repeat: int) -> tuple:
+    """Returns the fastest time in seconds and the peak of traced allocations in bytes"""
+    timings = []
+    for _ in range(repeat):
+        db.session.rollback()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    db.session.rollback()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def run(sizes, repeat: int = 3) -> dict:
+    """Times both paths for every size
+
+    Returns:
+        dict: {size: {"orm": (seconds, peak bytes), "core": (seconds, peak bytes)}}
+    """
+    results = {}
+    try:
+        for size in sizes:
+            seed(size)
+            assert orm_reads() == core_reads()
+            results[size] = {
+                "orm": measure(orm_reads, repeat),
+                "core": measure(core_reads, repeat),
+            }
+    finally:
+        Recommendation.delete_matching(source_pid=SOURCE_PID)
+    return results
+
+
+def main():
+    """Prints a table of the timings and peak memory"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'orm ms':>10} {'core ms':>10} {'orm MiB':>10} {'core MiB':>10}")
+    for size, timing in run(args.sizes, args.repeat).items():
+        (orm_time, orm_peak), (core_time, core_peak) = timing["orm"], timing["core"]
+        print(
+            f"{size:>8} {orm_time * 1000:>10.1f} {core_time * 1000:>10.1f}"
+            f" {orm_peak / 2 ** 20:>10.1f} {core_peak / 2 ** 20:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
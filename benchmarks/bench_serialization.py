@@ -0,0 +1,95 @@
+"""
+Serialization Benchmark
+
+Compares the two ways the list endpoint turns Recommendations into a
+response body: marshalling with flask-restx and the stdlib encoder, and
+the FAST_JSON path that encodes the serialized rows with orjson.
+
+Run it from the project root with a database available, because
+importing the service connects to DATABASE_URI:
+
+    python -m benchmarks.bench_serialization --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import time
+import orjson
+from flask_restx import marshal
+from service.models import Recommendation, RecommendationType
+from service.routes import rec_model
+
+TYPES = list(RecommendationType)
+
+
+def make_recommendations(count: int) -> list:
+    """Returns unsaved Recommendations that look like real rows"""
+    return [
+        Recommendation(
+            rec_id=rec_id,
+            source_pid=rec_id % 5000,
+            name=f"product {rec_id % 5000}",
+            recommendation_name=f"recommendation {rec_id}",
+            type=TYPES[rec_id % len(TYPES)],
+            number_of_likes=rec_id % 97,
+            number_of_dislikes=rec_id % 13,
+        )
+        for rec_id in range(1, count + 1)
+    ]
+
+
+def marshalled(recommendations: list) -> bytes:
+    """The default path: serialize(), marshal() and the stdlib encoder"""
+    results = [recommendation.serialize() for recommendation in recommendations]
+    return json.dumps(marshal(results, rec_model)).encode()
+
+
+def fast(recommendations: list) -> bytes:
+    """The FAST_JSON path: serialize() and orjson"""
+    return orjson.dumps([recommendation.serialize() for recommendation in recommendations])
+
+
+def best_of(function, recommendations: list, repeat: int) -> float:
+    """Returns the fastest of several runs in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(recommendations)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(sizes, repeat: int = 3) -> dict:
+    """Times both paths for every size
+
+    Returns:
+        dict: {size: {"marshal": seconds, "orjson": seconds}}
+    """
+    results = {}
+    for size in sizes:
+        recommendations = make_recommendations(size)
+        # both paths must produce the same document
+        assert json.loads(marshalled(recommendations)) == orjson.loads(fast(recommendations))
+        results[size] = {
+            "marshal": best_of(marshalled, recommendations, repeat),
+            "orjson": best_of(fast, recommendations, repeat),
+        }
+    return results
+
+
+def main():
+    """Prints a table of the timings"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'marshal ms':>12} {'orjson ms':>12} {'speedup':>8}")
+    for size, timing in run(args.sizes, args.repeat).items():
+        print(
+            f"{size:>8} {timing['marshal'] * 1000:>12.1f} {timing['orjson'] * 1000:>12.1f}"
+            f" {timing['marshal'] / timing['orjson']:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Startup Benchmark
+
+Measures how long a fresh process takes from importing the service to
+serving its first request. Each run is a new interpreter, so the imports
+are cold like in a new worker. The "version check" runs start the way
+workers do now; the "create_all + upgrade" runs also do the DDL every
+worker used to run on startup, db.create_all() and a migration run with
+nothing to apply.
+
+It also times each schema step alone on the up to date database.
+
+    python -m benchmarks.bench_startup --runs 5 --calls 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from service import migrations
+from service.models import db
+
+MODES = ["version check", "create_all + upgrade"]
+SCRIPT = """
+import sys
+import time
+started = time.perf_counter()
+from service import app
+if sys.argv[1] == "create_all + upgrade":
+    from service import migrations
+    from service.models import db
+    db.create_all()
+    migrations.upgrade(db.engine)
+imported = time.perf_counter()
+response = app.test_client().get("/api/recommendations?limit=1")
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print("startup", imported - started, served - started)
+"""
+
+
+def start_once(mode: str) -> tuple:
+    """Returns the (import, first request) seconds of one new process"""
+    env = dict(os.environ, DB_UPGRADE_ON_STARTUP="false")
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT, mode],
+        env=env, capture_output=True, text=True, check=True, timeout=60,
+    ).stdout
+    line = [line for line in output.splitlines() if line.startswith("startup ")][-1]
+    imported, served = line.split()[1:]
+    return float(imported), float(served)
+
+
+def time_step(function, calls: int) -> float:
+    """Returns the milliseconds per call of a schema step"""
+    function()  # warm up the connection pool
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1000
+
+
+def run(runs: int = 5, calls: int = 20) -> dict:
+    """Starts the service runs times both ways and times the schema steps
+
+    Returns:
+        dict: {"startup": {mode: {"import_ms", "first_request_ms"}}, "steps": {step: ms}}
+    """
+    migrations.upgrade(db.engine)
+    startup = {}
+    for mode in MODES:
+        timings = [start_once(mode) for _ in range(runs)]
+        startup[mode] = {
+            "import_ms": statistics.median(imported for imported, _ in timings) * 1000,
+            "first_request_ms": statistics.median(served for _, served in timings) * 1000,
+        }
+    steps = {
+        "version check": time_step(lambda: migrations.pending(db.engine), calls),
+        "upgrade": time_step(lambda: migrations.upgrade(db.engine), calls),
+        "create_all": time_step(db.create_all, calls),
+    }
+    return {"startup": startup, "steps": steps}
+
+
+def main():
+    """Prints the startup times both ways and the cost of each schema step"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=20)
+    args = parser.parse_args()
+
+    results = run(args.runs, args.calls)
+    print(f"{'startup':>20} {'import ms':>10} {'first request ms':>17}")
+    for mode, result in results["startup"].items():
+        print(f"{mode:>20} {result['import_ms']:>10.1f} {result['first_request_ms']:>17.1f}")
+    print(f"{'schema step':>20} {'ms/call':>10}")
+    for step, milliseconds in results["steps"].items():
+        print(f"{step:>20} {milliseconds:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -29,25 +29,21 @@ from compare import expect
 # HTTP Return Codes
 HTTP_200_OK = 200
 HTTP_201_CREATED = 201
-HTTP_204_NO_CONTENT = 204
 
 
 @given("the following recommendations")
 def step_impl(context):
     """Delete all Recommendations and load new ones"""
 
-    # List all of the recommendations and delete them one by one
+    # Delete all of the recommendations, one set-based delete per type
     rest_endpoint = f"{context.base_url}/api/recommendations"
-    context.resp = requests.get(rest_endpoint)
-    expect(context.resp.status_code).to_equal(200)
-    for rec in context.resp.json():
-        context.resp = requests.delete(f"{rest_endpoint}/{rec['rec_id']}")
-        expect(context.resp.status_code).to_equal(204)
-
-    # load the database with new recommendations
-    for row in context.table:
-        payload = {
-            # "rec_id": row["rec_id"],
+    for rec_type in ("CROSSSELL", "UPSELL", "ACCESSORY"):
+        context.resp = requests.delete(rest_endpoint, params={"type": rec_type})
+        expect(context.resp.status_code).to_equal(200)
+
+    # load the database with new recommendations in one request
+    payload = [
+        {
             "source_pid": row["source_pid"],
             "name": row["name"],
             "recommendation_name": row["recommendation_name"],
@@ -55,5 +51,8 @@ def step_impl(context):
             "number_of_likes": row["number_of_likes"],
             "number_of_dislikes": row["number_of_dislikes"],
         }
-        context.resp = requests.post(rest_endpoint, json=payload)
-        expect(context.resp.status_code).to_equal(201)
+        for row in context.table
+    ]
+    context.resp = requests.post(f"{rest_endpoint}/bulk", json=payload)
+    expect(context.resp.status_code).to_equal(201)
+    expect(context.resp.json()["errors"]).to_equal([])
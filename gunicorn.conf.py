@@ -0,0 +1,145 @@
+"""
+Gunicorn configuration
+
+Gunicorn reads this file from the working directory. The app is loaded
+once in the master and forked into the workers, which share its memory
+copy-on-write and start without importing anything. The database engines
+are emptied around the fork so no worker uses a connection the master or
+another worker opened.
+
+The worker class and count follow the CPU limit of the container:
+
+- below 2 CPUs, gthread workers, one per CPU (at least one), each serving
+  GUNICORN_THREADS requests at once while the others wait on Postgres
+- from 2 CPUs on, sync workers, two per CPU plus one
+
+GUNICORN_WORKER_CLASS, WEB_CONCURRENCY and GUNICORN_THREADS override them.
+
+The workers keep their Prometheus metrics in files of a shared directory,
+so a scrape of /metrics in any worker reports the sum of all of them.
+"""
+import contextlib
+import glob
+import math
+import os
+import tempfile
+
+# Where the CPU limit of the container is found
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cpu_limit(cgroup_root: str = CGROUP_ROOT) -> float:
+    """Returns the number of CPUs the process may use
+
+    This is the cgroup (v2 or v1) CPU quota when there is one, or else the
+    number of CPUs the process can be scheduled on.
+    """
+    quota = period = None
+    try:
+        # cgroup v2: "<quota> <period>", or "max <period>" without a limit
+        with open(os.path.join(cgroup_root, "cpu.max"), encoding="ascii") as cpu_max:
+            quota, period = cpu_max.read().split()
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: a quota of -1 means no limit
+            with open(os.path.join(cgroup_root, "cpu", "cpu.cfs_quota_us"), encoding="ascii") as cfs_quota:
+                quota = cfs_quota.read().strip()
+            with open(os.path.join(cgroup_root, "cpu", "cpu.cfs_period_us"), encoding="ascii") as cfs_period:
+                period = cfs_period.read().strip()
+        except OSError:
+            pass
+    cpus = len(os.sched_getaffinity(0))
+    if quota not in (None, "max", "-1") and int(period) > 0:
+        return min(int(quota) / int(period), cpus)
+    return float(cpus)
+
+
+def metrics_dir() -> str:
+    """Returns an empty directory for the workers' Prometheus metrics
+
+    This is PROMETHEUS_MULTIPROC_DIR when it is set, or else a directory of
+    this master in /dev/shm (or the temporary directory). The files of an
+    earlier run are removed so the counters start from zero.
+    """
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        f"recommendations-metrics-{os.getpid()}",
+    )
+    os.makedirs(path, exist_ok=True)
+    remove_metrics(path)
+    return path
+
+
+def remove_metrics(path: str):
+    """Removes the metrics files in a directory"""
+    for name in glob.glob(os.path.join(path, "*.db")):
+        os.remove(name)
+
+
+def worker_settings(cpus: float) -> tuple:
+    """Returns the (worker_class, workers, threads) for a number of CPUs"""
+    worker_class = os.getenv("GUNICORN_WORKER_CLASS") or ("gthread" if cpus < 2 else "sync")
+    if worker_class == "sync":
+        default_workers, default_threads = 2 * math.floor(cpus) + 1, 1
+    else:
+        default_workers, default_threads = max(1, math.floor(cpus)), 4
+    workers = int(os.getenv("WEB_CONCURRENCY") or default_workers)
+    threads = int(os.getenv("GUNICORN_THREADS") or default_threads)
+    return worker_class, workers, threads
+
+
+# prometheus_client reads this when the app is imported, so it is set before preloading
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir()
+
+bind = os.getenv("GUNICORN_BIND") or f"0.0.0.0:{os.getenv('PORT', '8080')}"
+worker_class, workers, threads = worker_settings(cpu_limit())
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("true", "yes", "1")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+# the workers' heartbeat files stay off a possibly slow container filesystem
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+
+def when_ready(server):
+    """Closes the connections the master opened while loading the app
+
+    The master never queries, so it keeps no connections around to be
+    inherited by the workers it forks.
+    """
+    if preload_app:
+        from service.models import dispose_engines  # pylint: disable=import-outside-toplevel
+
+        dispose_engines()
+        server.log.info("Closed the connections opened while preloading")
+
+
+def post_fork(server, worker):
+    """Makes a new worker forget the pooled connections it inherited
+
+    They are left open for their owner; the worker opens its own on first use.
+    """
+    if preload_app:
+        from service.models import dispose_engines  # pylint: disable=import-outside-toplevel
+
+        dispose_engines(close=False)
+        server.log.debug("Worker %s starts with empty connection pools", worker.pid)
+
+
+def child_exit(server, worker):
+    """Drops the in-progress and pool gauges of a worker that exited
+
+    Its counters and histograms stay in the sums.
+    """
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
+    server.log.debug("Removed the live metrics of worker %s", worker.pid)
+
+
+def on_exit(server):
+    """Removes the metrics files, and their directory if nothing else is in it"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    remove_metrics(path)
+    with contextlib.suppress(OSError):
+        os.rmdir(path)
+    server.log.debug("Removed the metrics in %s", path)
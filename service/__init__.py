@@ -33,7 +33,7 @@ api = Api(
     description="This is a Recommendation server.",
     default="recommendations",
     default_label="Recommendation operations",
-    doc="/apidocs",
+    doc="/apidocs" if app.config["API_DOCS"] else False,
     prefix="/api"
 )
 
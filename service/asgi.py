@@ -0,0 +1,657 @@
+"""
+ASGI Entry Point
+
+This module serves the REST API of service.routes with async handlers on
+SQLAlchemy's asyncio engine, so a worker keeps serving other requests
+while it waits on Postgres:
+
+    uvicorn service.asgi:app --host 0.0.0.0 --port 8080
+
+The Flask app is still imported for its configuration, its schema version
+check and swagger.json, and the helpers of service.routes are shared so both
+entry points answer the same way. Requests are counted in /metrics and
+sampled to CAPTURE_DIR like those of the Flask app. Reads all go to the
+primary in this mode; DATABASE_REPLICA_URI is not used.
+"""
+import contextlib
+import logging
+import os
+import time
+from http import HTTPStatus
+import orjson
+from flask_restx import inputs
+from starlette.applications import Starlette
+from starlette.endpoints import HTTPEndpoint
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Match, Mount, Route
+from starlette.staticfiles import StaticFiles
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import HTTPException as WerkzeugHTTPException
+from werkzeug.http import (
+    parse_accept_header,
+    parse_etags,
+    parse_options_header,
+    quote_etag,
+)
+from service import app as flask_app
+from service import async_models
+from service.async_models import sessions
+from service.common import metrics, status
+from service.common.api_spec import CACHE_CONTROL
+from service.common.periodic import PeriodicTask
+from service.common.pool import pool_stats
+from service.models import (
+    SORT_KEYS,
+    DataValidationError,
+    Recommendation,
+    rec_cache,
+    statement_stats,
+)
+from service.routes import (
+    NDJSON,
+    api_spec,
+    buffer_vote,
+    decode_cursor,
+    deserialize_bulk,
+    encode_cursor,
+    find_recommendations,
+    parse_bulk_payload,
+    parse_type,
+    snapshot_refresher,
+    traffic_capture,
+)
+
+logger = logging.getLogger("flask.app")
+
+# query string arguments that select Recommendations, and their types
+FILTER_ARGS = {"name": str, "source_pid": int, "recommendation_name": str, "type": str}
+
+# query string arguments for listing Recommendations
+LIST_ARGS = dict(
+    FILTER_ARGS,
+    min_likes=int,
+    max_likes=int,
+    min_dislikes=int,
+    max_dislikes=int,
+    sort=str,
+    order=str,
+    limit=int,
+    cursor=str,
+    stream=inputs.boolean,
+)
+
+# query string arguments for the best Recommendations of a product
+TOP_ARGS = {"k": int, "type": str}
+
+
+def refresh_metrics():
+    """Copies this worker's pool and cache statistics into the metrics"""
+    metrics.update(pool_stats(app.state.engine.sync_engine), rec_cache.stats())
+
+
+# Per-worker thread that keeps the pool and cache metrics current
+metrics_refresher = PeriodicTask(
+    refresh_metrics,
+    interval=flask_app.config["METRICS_REFRESH_INTERVAL"],
+    name="metrics-refresher",
+)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+######################################################################
+# GET INDEX, HEALTH CHECK, STATISTICS AND THE OPENAPI DOCUMENT
+######################################################################
+async def index(_request):
+    """Index page"""
+    return FileResponse(os.path.join(flask_app.static_folder, "index.html"))
+
+
+async def healthcheck(_request):
+    """Let them know our heart is still beating"""
+    return ORJSONResponse({"status": status.HTTP_200_OK, "message": "OK"})
+
+
+async def stats(request):
+    """Reports the counters of this worker's cache and connection pool"""
+    return ORJSONResponse(
+        {
+            "cache": rec_cache.stats(),
+            "pool": pool_stats(request.app.state.engine.sync_engine),
+            "replicas": [],
+            "statements": statement_stats.stats(),
+        }
+    )
+
+
+async def prometheus_metrics(_request):
+    """Reports the request, pool and cache metrics of every worker to Prometheus"""
+    refresh_metrics()
+    body, content_type = metrics.render()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+async def openapi_document(request):
+    """Returns swagger.json as it was built, gzipped if the client accepts it"""
+    gzipped = "gzip" in parse_accept_header(request.headers.get("Accept-Encoding"))
+    body, etag = api_spec.document(gzipped)
+    headers = {"Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if parse_etags(request.headers.get("If-None-Match")).contains(etag):
+        response = not_modified(etag)
+        response.headers.update(headers)
+        return response
+    headers["ETag"] = quote_etag(etag)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
+
+
+######################################################################
+#  PATH: /recommendations/{id}
+######################################################################
+class RecommendationResource(HTTPEndpoint):
+    """Allows the manipulation of a single Recommendation"""
+
+    async def get(self, request):
+        """Retrieves a single Recommendation based on its id"""
+        rec_id = request.path_params["rec_id"]
+        logger.info("Request for recommendation with id [%s]", rec_id)
+        async with sessions() as session:
+            found = await async_models.find_serialized(session, rec_id)
+        if not found:
+            raise HTTPException(
+                status.HTTP_404_NOT_FOUND,
+                f"Recommendation with id '{rec_id}' was not found.",
+            )
+        recommendation, version = found
+        etag = str(version)
+        if if_none_match(request, etag):
+            return not_modified(etag)
+        return ORJSONResponse(recommendation, headers={"ETag": quote_etag(etag)})
+
+    async def put(self, request):
+        """Updates a Recommendation given its id"""
+        rec_id = request.path_params["rec_id"]
+        logger.info("Update a recommendation with id: %s", rec_id)
+        await request.body()  # read it before the row is locked
+        if_match = parse_etags(request.headers.get("If-Match"))
+        async with sessions() as session:
+            if if_match:
+                # lock the row so nobody can change it between the check and the update
+                current = await async_models.find_for_update(session, rec_id)
+            else:
+                current = await async_models.find_version(session, rec_id)
+            if current is None:
+                raise HTTPException(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Recommendation with id '{rec_id}' does not exist",
+                )
+            if if_match and not if_match.contains(str(current.version)):
+                raise HTTPException(
+                    status.HTTP_412_PRECONDITION_FAILED,
+                    f"Recommendation with id '{rec_id}' was changed by someone else",
+                )
+            recommendation = Recommendation().deserialize(await read_json(request))
+            updated = await async_models.update_record(
+                session, rec_id, recommendation, current.source_pid
+            )
+        return ORJSONResponse(
+            updated.serialize(), headers={"ETag": quote_etag(str(updated.version))}
+        )
+
+    async def delete(self, request):
+        """Deletes a Recommendation based on its id"""
+        rec_id = request.path_params["rec_id"]
+        logger.info("Delete a recommendation with id: %s", rec_id)
+        async with sessions() as session:
+            if await async_models.delete_matching(session, rec_id=rec_id):
+                logger.info("Recommendation with id [%s] was deleted", rec_id)
+        # Delete always returns 204
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  PATH: /recommendations
+######################################################################
+class RecommendationCollection(HTTPEndpoint):
+    """Handles all interactions with collections of Recommendations"""
+
+    async def get(self, request):
+        """Lists the Recommendations one page at a time, or streams them as NDJSON"""
+        logger.info("Request to list all recommendations...")
+        args = parse_args(request, LIST_ARGS, sort="rec_id", order="asc")
+        if args["sort"] not in SORT_KEYS or args["order"] not in ("asc", "desc"):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "sort or order was not valid")
+        statement = find_recommendations(args)
+        if args["stream"] or wants_ndjson(request):
+            return stream_recommendations(statement)
+
+        async with sessions() as session:
+            limit = page_size(args["limit"])
+            descending = args["order"] == "desc"
+            recommendations, last = await async_models.paginate(
+                session,
+                statement,
+                limit,
+                after=decode_cursor(args["cursor"], args["sort"], descending),
+                sort=args["sort"],
+                descending=descending,
+            )
+
+        next_cursor = None if last is None else encode_cursor(last, args["sort"], descending)
+        etag = Recommendation.page_tag(recommendations, next_cursor)
+        if if_none_match(request, etag):
+            return not_modified(etag, weak=True)
+        headers = {"ETag": quote_etag(etag, weak=True)}
+        if next_cursor is not None:
+            next_url = request.url.include_query_params(cursor=next_cursor)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+            headers["X-Next-Cursor"] = next_cursor
+        return ORJSONResponse(
+            [recommendation.serialize() for recommendation in recommendations],
+            headers=headers,
+        )
+
+    async def delete(self, request):
+        """Deletes every Recommendation matching all of the filters given"""
+        logger.info("Request to delete matching recommendations...")
+        args = parse_args(request, FILTER_ARGS)
+        criteria = {key: value for key, value in args.items() if value is not None}
+        if not criteria:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                "At least one filter is required to delete recommendations",
+            )
+        if "type" in criteria:
+            criteria["type"] = parse_type(criteria["type"])
+        async with sessions() as session:
+            deleted = await async_models.delete_matching(session, **criteria)
+        logger.info("%d recommendations matching %s deleted", deleted, criteria)
+        return ORJSONResponse({"deleted": deleted})
+
+    async def post(self, request):
+        """Creates a new Recommendation"""
+        logger.info("Request to Create a Recommendation...")
+        recommendation = Recommendation().deserialize(await read_json(request))
+        async with sessions() as session:
+            created = await async_models.create(session, recommendation)
+        logger.info("Recommendation with new id [%s] saved!", created.rec_id)
+        location_url = request.url_for("recommendation", rec_id=created.rec_id)
+        return ORJSONResponse(
+            created.serialize(),
+            status_code=status.HTTP_201_CREATED,
+            headers={"Location": str(location_url)},
+        )
+
+
+######################################################################
+#  PATH: /recommendations/bulk
+######################################################################
+class BulkRecommendationCollection(HTTPEndpoint):
+    """Handles creating many Recommendations in one request"""
+
+    async def post(self, request):
+        """Creates many Recommendations from a JSON array or NDJSON body"""
+        logger.info("Request to Bulk Create Recommendations...")
+        mimetype, _ = parse_options_header(request.headers.get("Content-Type"))
+        recommendations, errors = deserialize_bulk(
+            parse_bulk_payload(mimetype, await request.body())
+        )
+        if errors and not recommendations:
+            return ORJSONResponse(
+                {"rec_ids": [], "errors": errors},
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        async with sessions() as session:
+            rec_ids = await async_models.create_many(
+                session, recommendations, flask_app.config["BULK_BATCH_SIZE"]
+            )
+        logger.info("%d Recommendations created, %d rejected", len(rec_ids), len(errors))
+        return ORJSONResponse(
+            {"rec_ids": rec_ids, "errors": errors}, status_code=status.HTTP_201_CREATED
+        )
+
+
+######################################################################
+#  PATH: /products/{source_pid}/top
+######################################################################
+class TopRecommendationCollection(HTTPEndpoint):
+    """The best ranked Recommendations of a product"""
+
+    async def get(self, request):
+        """Returns the k highest scored recommendations for a product"""
+        source_pid = request.path_params["source_pid"]
+        logger.info("Request for the top recommendations of product %s", source_pid)
+        args = parse_args(request, TOP_ARGS, k=10)
+        limit = min(args["k"], flask_app.config["MAX_PAGE_SIZE"])
+        if limit < 1:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "k must be a positive number")
+        rec_type = parse_type(args["type"]) if args["type"] else None
+
+        async with sessions() as session:
+            recommendations = await async_models.find_top(session, source_pid, limit, rec_type)
+        etag = Recommendation.page_tag(recommendations)
+        if if_none_match(request, etag):
+            return not_modified(etag, weak=True)
+        return ORJSONResponse(
+            [
+                dict(recommendation.serialize(), score=recommendation.score)
+                for recommendation in recommendations
+            ],
+            headers={"ETag": quote_etag(etag, weak=True)},
+        )
+
+
+######################################################################
+#  PATH: /products/{source_pid}/recommendations
+######################################################################
+class ProductSnapshotResource(HTTPEndpoint):
+    """Every Recommendation of a product in one pre-serialized document"""
+
+    async def get(self, request):
+        """Retrieves every Recommendation of a product"""
+        source_pid = request.path_params["source_pid"]
+        logger.info("Request for the snapshot of product %s", source_pid)
+        async with sessions() as session:
+            document = await async_models.find_snapshot(session, source_pid)
+        return Response(document, media_type="application/json")
+
+
+######################################################################
+#  PATH: /recommendations/{id}/like and /recommendations/{id}/dislike
+######################################################################
+class LikeResource(HTTPEndpoint):
+    """Like actions on a Recommendation"""
+
+    async def put(self, request):
+        """Liking a Recommendation increments its like count"""
+        logger.info("Request to Like a Recommendation")
+        return await vote(request, likes=1)
+
+
+class DislikeResource(HTTPEndpoint):
+    """Dislike actions on a Recommendation"""
+
+    async def put(self, request):
+        """Disliking a Recommendation increments its dislike count"""
+        logger.info("Request to Dislike a Recommendation")
+        return await vote(request, dislikes=1)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+async def vote(request, likes=0, dislikes=0):
+    """Adds a vote to a Recommendation, or to the vote buffer when it is enabled"""
+    rec_id = request.path_params["rec_id"]
+    if flask_app.config["VOTE_BUFFER_ENABLED"]:
+        data, status_code = buffer_vote(rec_id, likes, dislikes)
+        return ORJSONResponse(data, status_code=status_code)
+    async with sessions() as session:
+        recommendation = await async_models.increment(session, rec_id, likes, dislikes)
+    if recommendation is None:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND,
+            f"recommendation with id '{rec_id}' was not found.",
+        )
+    return ORJSONResponse(
+        recommendation.serialize(),
+        headers={"ETag": quote_etag(str(recommendation.version))},
+    )
+
+
+def parse_args(request, types: dict, **defaults) -> dict:
+    """Returns the query string arguments converted to their types
+
+    Arguments that are not given take the default, or None
+    """
+    args = {}
+    for name, kind in types.items():
+        value = request.query_params.get(name)
+        if value is None:
+            args[name] = defaults.get(name)
+            continue
+        try:
+            args[name] = kind(value)
+        except ValueError as error:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"{name}: {error}") from error
+    return args
+
+
+def page_size(limit) -> int:
+    """Returns the size of a page, from the limit argument and the config"""
+    if limit is None:
+        limit = flask_app.config["DEFAULT_PAGE_SIZE"]
+    limit = min(limit, flask_app.config["MAX_PAGE_SIZE"])
+    if limit < 1:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "limit must be a positive number")
+    return limit
+
+
+async def read_json(request):
+    """Returns the JSON body of a request, which must be sent as JSON"""
+    mimetype, _ = parse_options_header(request.headers.get("Content-Type"))
+    if not (
+        mimetype == "application/json"
+        or (mimetype.startswith("application/") and mimetype.endswith("+json"))
+    ):
+        raise HTTPException(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            "Content-Type must be application/json",
+        )
+    try:
+        return orjson.loads(await request.body())
+    except orjson.JSONDecodeError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Invalid JSON: {error}") from error
+
+
+def if_none_match(request, etag: str) -> bool:
+    """Checks if the client already has the entity tag"""
+    return parse_etags(request.headers.get("If-None-Match")).contains_weak(etag)
+
+
+def not_modified(etag: str, weak: bool = False) -> Response:
+    """Returns an empty 304 Not Modified response for an entity tag"""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": quote_etag(etag, weak)}
+    )
+
+
+def wants_ndjson(request) -> bool:
+    """Checks if the client asked for NDJSON in its Accept header"""
+    accept = parse_accept_header(request.headers.get("Accept"), MIMEAccept)
+    return accept.best_match(["application/json", NDJSON]) == NDJSON
+
+
+def stream_recommendations(statement) -> StreamingResponse:
+    """Streams the Recommendations of a query as one JSON document per line"""
+    logger.info("Streaming recommendations as NDJSON")
+    chunk_size = flask_app.config["STREAM_CHUNK_SIZE"]
+
+    async def generate():
+        async with sessions() as session:
+            async for recommendation in async_models.stream(session, statement, chunk_size):
+                yield orjson.dumps(recommendation.serialize(), option=orjson.OPT_APPEND_NEWLINE)
+
+    return StreamingResponse(generate(), media_type=NDJSON)
+
+
+######################################################################
+# Error Handlers
+######################################################################
+def error_response(code: int, message: str, headers: dict = None) -> Response:
+    """Returns an error in the JSON of service.common.error_handlers"""
+    logger.warning(message)
+    return ORJSONResponse(
+        {"status": code, "error": HTTPStatus(code).phrase, "message": message},
+        status_code=code,
+        headers=headers,
+    )
+
+
+async def http_error(_request, error):
+    """Handles the HTTP errors raised by the handlers and the router"""
+    return error_response(error.status_code, error.detail, error.headers)
+
+
+async def shared_http_error(_request, error):
+    """Handles the HTTP errors raised by the helpers shared with service.routes"""
+    return error_response(error.code, error.description)
+
+
+async def request_validation_error(_request, error):
+    """Handles Value Errors from bad data"""
+    return error_response(status.HTTP_400_BAD_REQUEST, str(error))
+
+
+async def internal_server_error(_request, error):
+    """Handles unexpected server error with 500_SERVER_ERROR"""
+    logger.error("Internal server error: %s", error)
+    return error_response(status.HTTP_500_INTERNAL_SERVER_ERROR, str(error))
+
+
+######################################################################
+# MIDDLEWARE
+######################################################################
+class RequestMetricsMiddleware:
+    """Records every request in the metrics, like the request hooks of service.routes
+
+    Requests are labelled with the class or function name of their endpoint,
+    so the two entry points report the same series.
+    """
+
+    def __init__(self, app, routes: list):  # pylint: disable=redefined-outer-name
+        self.app = app
+        self.labels = [(route, resource_label(route)) for route in routes]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        labels = (scope["method"], self.label(scope))
+        started = time.perf_counter()
+        statuses = []
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+            await send(message)
+
+        metrics.IN_PROGRESS.labels(*labels).inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.IN_PROGRESS.labels(*labels).dec()
+            metrics.LATENCY.labels(*labels).observe(time.perf_counter() - started)
+            status_code = statuses[0] if statuses else status.HTTP_500_INTERNAL_SERVER_ERROR
+            metrics.REQUESTS.labels(*labels, status_code).inc()
+
+    def label(self, scope) -> str:
+        """Returns the label of the route a request goes to"""
+        for route, label in self.labels:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return label
+        # requests for unknown URLs share one label so they cannot create new series
+        return "unmatched"
+
+
+def resource_label(route) -> str:
+    """Returns the metrics label of a route: its endpoint's name, or the name of a mount"""
+    endpoint = getattr(route, "endpoint", None)
+    return endpoint.__name__ if endpoint else route.name
+
+
+class TrafficCaptureMiddleware:
+    """Writes the sampled requests to CAPTURE_DIR, like the request hooks of service.routes"""
+
+    def __init__(self, app):  # pylint: disable=redefined-outer-name
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not traffic_capture.sampled():
+            await self.app(scope, receive, send)
+            return
+        arrived, started = time.time(), time.perf_counter()
+        body = bytearray()
+        statuses = []
+
+        async def receive_body():
+            message = await receive()
+            # one byte past max_body is enough to know the body was cut
+            if message["type"] == "http.request" and len(body) <= traffic_capture.max_body:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+            await send(message)
+
+        await self.app(scope, receive_body, send_with_status)
+        traffic_capture.record(
+            arrived,
+            scope["method"],
+            scope["path"],
+            scope["query_string"].decode("latin-1"),
+            Headers(scope=scope).get("content-type"),
+            bytes(body),
+            statuses[0] if statuses else status.HTTP_500_INTERNAL_SERVER_ERROR,
+            time.perf_counter() - started,
+        )
+
+
+######################################################################
+# Application
+######################################################################
+@contextlib.asynccontextmanager
+async def lifespan(application):
+    """Creates the asyncio engine when the server starts and closes it when it stops"""
+    application.state.engine = async_models.init_db(flask_app)
+    # tests refresh the snapshots themselves
+    if not flask_app.testing:
+        snapshot_refresher.start()
+        metrics_refresher.start()
+    logger.info("ASGI service initialized!")
+    yield
+    await application.state.engine.dispose()
+
+
+ROUTES = [
+    Route("/", index),
+    Route("/health", healthcheck),
+    Route("/stats", stats),
+    Route("/metrics", prometheus_metrics),
+    Route("/api/swagger.json", openapi_document),
+    Mount("/static", StaticFiles(directory=flask_app.static_folder), name="static"),
+    Route("/api/recommendations", RecommendationCollection),
+    Route("/api/recommendations/bulk", BulkRecommendationCollection),
+    Route("/api/recommendations/{rec_id:int}", RecommendationResource, name="recommendation"),
+    Route("/api/recommendations/{rec_id:int}/like", LikeResource),
+    Route("/api/recommendations/{rec_id:int}/dislike", DislikeResource),
+    Route("/api/products/{source_pid:int}/top", TopRecommendationCollection),
+    Route("/api/products/{source_pid:int}/recommendations", ProductSnapshotResource),
+]
+
+app = Starlette(
+    routes=ROUTES,
+    middleware=[
+        Middleware(RequestMetricsMiddleware, routes=ROUTES),
+        Middleware(TrafficCaptureMiddleware),
+    ],
+    exception_handlers={
+        HTTPException: http_error,
+        WerkzeugHTTPException: shared_http_error,
+        DataValidationError: request_validation_error,
+        status.HTTP_500_INTERNAL_SERVER_ERROR: internal_server_error,
+    },
+    lifespan=lifespan,
+)
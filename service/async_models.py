@@ -0,0 +1,248 @@
+"""
+Async Models for Recommendation
+
+The queries of service.models run on SQLAlchemy's asyncio engine and
+psycopg's async connections, for the ASGI entry point in service.asgi.
+
+The statements are built by Recommendation, so both entry points read and
+write exactly the same way. Every function takes the AsyncSession to run
+in, and the writes commit through commit_changes() so the cache, the
+change bus and the snapshot queue see them like any other write.
+"""
+import logging
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import DataError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from service.common import pool
+from service.models import (
+    FIND_SNAPSHOT,
+    DataValidationError,
+    Recommendation,
+    RecommendationRecord,
+    change_bus,
+    commit_changes,
+    rec_cache,
+    statement_stats,
+    version_seq,
+)
+
+logger = logging.getLogger("flask.app")
+
+# Sessions on the asyncio engine, bound to it in init_db()
+sessions = async_sessionmaker(expire_on_commit=False)
+
+
+def init_db(app):
+    """Creates the asyncio engine from the configuration of the Flask app
+
+    The schema itself is migrated by the flask db-upgrade command
+
+    Returns:
+        AsyncEngine: the engine the sessions are bound to
+    """
+    logger.info("Initializing the asyncio database engine")
+    options = dict(app.config["SQLALCHEMY_ENGINE_OPTIONS"], poolclass=pool.AsyncTimedQueuePool)
+    engine = create_async_engine(app.config["SQLALCHEMY_DATABASE_URI"], **options)
+    pool.listen(engine.sync_engine, app.config["DB_STATEMENT_TIMEOUT"])
+    statement_stats.listen(engine.sync_engine)
+    sessions.configure(bind=engine)
+    return engine
+
+
+async def commit(session, rec_ids, source_pids):
+    """Commits a write with commit_changes() on the session's connection"""
+    await session.run_sync(
+        lambda sync_session: commit_changes(rec_ids, source_pids, sync_session)
+    )
+
+
+async def records(session, statement) -> list:
+    """Returns the rows of a select_records() as RecommendationRecords"""
+    return Recommendation.records(await session.execute(statement))
+
+
+######################################################################
+# READS
+######################################################################
+
+
+async def find_serialized(session, rec_id):
+    """Returns a serialized Recommendation and its version, from the cache if it can
+
+    See Recommendation.find_serialized()
+    """
+    rec_id = int(rec_id)
+    if not rec_cache.enabled:
+        return await _load_serialized(session, rec_id)
+    cached = rec_cache.get(rec_id)
+    if cached is None:
+        change_bus.start()  # evictions from other workers must arrive first
+        token = rec_cache.token()
+        cached = await _load_serialized(session, rec_id)
+        if cached is None:
+            return None
+        rec_cache.set(rec_id, cached, token)
+    data, version = cached
+    return dict(data), version
+
+
+async def _load_serialized(session, rec_id: int):
+    """Reads a Recommendation and returns it serialized with its version, or None"""
+    found = await records(
+        session, Recommendation.select_records().where(Recommendation.rec_id == rec_id)
+    )
+    if not found:
+        return None
+    return found[0].serialize(), found[0].version
+
+
+async def paginate(session, statement, limit: int, after=None, sort="rec_id", descending=False):
+    """Returns one page of a select_records(), see Recommendation.paginate()"""
+    statement = Recommendation.page_statement(statement, limit, after, sort, descending)
+    return Recommendation.page_of(await records(session, statement), limit, sort)
+
+
+async def stream(session, statement, chunk_size: int = 1000):
+    """Iterates over records in rec_id order through a server-side cursor"""
+    logger.info("Streaming Recommendations in chunks of %d", chunk_size)
+    result = await session.stream(
+        statement.order_by(Recommendation.rec_id).execution_options(yield_per=chunk_size)
+    )
+    async for rows in result.partitions():
+        for row in rows:
+            yield RecommendationRecord(*row)
+
+
+async def find_top(session, source_pid, limit: int = 10, rec_type=None) -> list:
+    """Returns the best ranked RecommendationRecords of a product"""
+    return await records(session, Recommendation.top_statement(source_pid, limit, rec_type))
+
+
+async def find_snapshot(session, source_pid) -> str:
+    """Returns the snapshot document of a product, see Recommendation.find_snapshot()"""
+    document = (await session.execute(FIND_SNAPSHOT, {"source_pid": source_pid})).scalar()
+    if document is None:
+        built = (await session.execute(Recommendation.snapshot_documents([source_pid]))).first()
+        if built is None:
+            return Recommendation.empty_snapshot(source_pid)
+        document = built[1]
+    return document
+
+
+async def find_version(session, rec_id):
+    """Returns the (version, source_pid) of a Recommendation"""
+    return (await session.execute(version_statement(rec_id))).first()
+
+
+async def find_for_update(session, rec_id):
+    """Returns the (version, source_pid) of a Recommendation and locks it until the commit"""
+    return (await session.execute(version_statement(rec_id).with_for_update())).first()
+
+
+def version_statement(rec_id):
+    """Returns the SELECT of find_version()"""
+    return select(Recommendation.version, Recommendation.source_pid).where(
+        Recommendation.rec_id == int(rec_id)
+    )
+
+
+######################################################################
+# WRITES
+######################################################################
+
+
+async def create(session, recommendation: Recommendation) -> RecommendationRecord:
+    """Inserts a deserialized Recommendation and returns its record"""
+    logger.info("Creating %s", recommendation.recommendation_name)
+    statement = (
+        insert(Recommendation)
+        .values(recommendation.row_values())
+        .returning(*Recommendation.record_columns())
+    )
+    try:
+        created = (await records(session, statement))[0]
+    except DataError as error:
+        await session.rollback()
+        raise DataValidationError("Invalid Recommendation: " + str(error.orig)) from error
+    await commit(session, [created.rec_id], [created.source_pid])
+    return created
+
+
+async def create_many(session, recommendations: list, batch_size: int = 1000) -> list:
+    """Inserts Recommendations with multi-row INSERTs, see Recommendation.create_many()"""
+    logger.info("Creating %d Recommendations", len(recommendations))
+    if not recommendations:
+        return []
+    statement = insert(Recommendation.__table__)
+    try:
+        statement_ids = Recommendation.rec_ids_statement(len(recommendations))
+        rec_ids = sorted((await session.execute(statement_ids)).scalars())
+        rows = Recommendation.rows_with_ids(recommendations, rec_ids)
+        for start in range(0, len(rows), batch_size):
+            await session.execute(statement, rows[start:start + batch_size])
+    except DataError as error:
+        await session.rollback()
+        raise DataValidationError("Invalid Recommendation: " + str(error.orig)) from error
+    await commit(
+        session, rec_ids, [recommendation.source_pid for recommendation in recommendations]
+    )
+    return rec_ids
+
+
+async def update_record(session, rec_id, recommendation: Recommendation, moved_from=None):
+    """Writes a deserialized Recommendation over the row with rec_id
+
+    Args:
+        moved_from: the source_pid the row had before, whose snapshot also changes
+
+    Returns:
+        RecommendationRecord: the updated record, or None if it does not exist
+    """
+    logger.info("Saving %s", recommendation.recommendation_name)
+    statement = (
+        update(Recommendation)
+        .where(Recommendation.rec_id == int(rec_id))
+        .values(dict(recommendation.row_values(), version=version_seq.next_value()))
+        .returning(*Recommendation.record_columns())
+    )
+    try:
+        updated = await records(session, statement)
+    except DataError as error:
+        await session.rollback()
+        raise DataValidationError("Invalid Recommendation: " + str(error.orig)) from error
+    if not updated:
+        await session.rollback()
+        return None
+    await commit(session, [rec_id], [updated[0].source_pid, moved_from])
+    return updated[0]
+
+
+async def delete_matching(session, **criteria) -> int:
+    """Removes every Recommendation matching all of the criteria
+
+    Returns:
+        int: the number of Recommendations deleted
+    """
+    logger.info("Deleting Recommendations matching %s", criteria)
+    deleted = (await session.execute(Recommendation.delete_statement(**criteria))).all()
+    await commit(
+        session,
+        [rec_id for rec_id, _ in deleted],
+        [source_pid for _, source_pid in deleted],
+    )
+    return len(deleted)
+
+
+async def increment(session, rec_id, likes: int = 0, dislikes: int = 0):
+    """Atomically adds votes to a Recommendation
+
+    Returns:
+        the updated RecommendationRecord, or None if it does not exist
+    """
+    logger.info("Voting on Recommendation with id %s", rec_id)
+    updated = await records(session, Recommendation.increment_statement(rec_id, likes, dislikes))
+    if not updated:
+        await session.rollback()
+        return None
+    await commit(session, [rec_id], [updated[0].source_pid])
+    return updated[0]
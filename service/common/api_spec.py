@@ -0,0 +1,62 @@
+"""
+API Spec
+
+This module keeps the OpenAPI document of a flask-restx Api serialized
+and gzip compressed, so swagger.json is built once per worker, on the
+first request for it, and then served as it is
+"""
+import gzip
+import hashlib
+import threading
+import orjson
+
+# How long clients and proxies may use swagger.json before revalidating it
+CACHE_CONTROL = "public, max-age=3600"
+
+
+class ApiSpec:
+    """The swagger.json of an Api, built on first use
+
+    The entity tag is a hash of the document, so it is the same in every
+    worker and only changes when a deploy changes the API. The gzipped
+    body is a different representation and gets a tag of its own.
+    """
+
+    def __init__(self, api=None):
+        self.api = api
+        self._lock = threading.Lock()
+        self._document = None
+
+    def configure(self, api):
+        """Sets the Api to document and drops the document built so far"""
+        with self._lock:
+            self.api = api
+            self._document = None
+
+    def document(self, gzipped: bool = False) -> tuple:
+        """Returns the (body, entity tag) of swagger.json, building it on first use
+
+        Args:
+            gzipped (bool): True for the gzip compressed body
+        """
+        document = self._document
+        if document is None:
+            with self._lock:
+                if self._document is None:
+                    self._document = self._build()
+                document = self._document
+        return document[gzipped]
+
+    def _build(self) -> tuple:
+        """Serializes and compresses the schema of the Api
+
+        It is built in a request context of its own, so the document does
+        not depend on the request that happened to ask for it first.
+        """
+        with self.api.app.test_request_context():
+            schema = self.api.__schema__
+        body = orjson.dumps(schema, option=orjson.OPT_NON_STR_KEYS)
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        # mtime=0 keeps the compressed body, like its tag, the same in every worker
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        return (body, etag), (compressed, f"{etag}-gzip")
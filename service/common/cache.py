@@ -0,0 +1,127 @@
+"""
+Cache
+
+This module contains a bounded, thread-safe LRU cache whose entries
+also expire after a time to live
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Least recently used cache with a time to live on every entry
+
+    A reader that misses takes a ``token()`` before loading the value and
+    passes it to ``set()``. If that key was invalidated in the meantime the
+    value is dropped, so a slow reader can never put back stale data.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # generation of the latest invalidation of recently invalidated keys
+        self._invalidated = OrderedDict()
+        self._generation = 0
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def configure(self, maxsize: int, ttl: float):
+        """Changes the size and time to live and empties the cache"""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+            self._forget_invalidations()
+
+    @property
+    def enabled(self) -> bool:
+        """True when values are kept, False for a maxsize of 0"""
+        return self.maxsize > 0
+
+    def get(self, key):
+        """Returns the value cached for a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def token(self) -> int:
+        """Returns a token to pass to set() for a value about to be loaded"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, token: int = None):
+        """Caches a value unless an invalidation happened after the token"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if token is not None and self._invalidated_since(key, token):
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """Removes keys from the cache"""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+                self._invalidated[key] = self._generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.maxsize, 1):
+                _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        """Removes everything from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self._forget_invalidations()
+
+    def _invalidated_since(self, key, token: int) -> bool:
+        """Checks if a key may have been invalidated after the token was taken"""
+        generation = self._invalidated.get(key)
+        if generation is not None:
+            return generation > token
+        # the key may have been invalidated and then forgotten
+        return token < self._floor
+
+    def _forget_invalidations(self):
+        """Treats every outstanding token as stale"""
+        self._generation += 1
+        self._floor = self._generation
+        self._invalidated.clear()
+
+    def stats(self) -> dict:
+        """Returns the counters and current size of the cache"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,158 @@
+"""
+Change Bus
+
+This module tells every worker which Recommendations changed so they
+can evict them from their caches, through Postgres LISTEN/NOTIFY or an
+in-process stand-in
+"""
+import logging
+import os
+import select
+import threading
+from sqlalchemy import text
+
+logger = logging.getLogger("flask.app")
+
+# Postgres drops notifications with a payload of 8000 bytes or more
+MAX_PAYLOAD = 7900
+
+NOTIFY = text(
+    "SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"
+)
+
+
+class ChangeBus:
+    """Publishes the rec_ids changed by a transaction to every subscriber
+
+    Without an engine the bus is an in-process stand-in that hands the
+    rec_ids straight to its subscribers. Once ``configure()`` is given an
+    engine, ``publish()`` queues a ``pg_notify`` in the writer's transaction,
+    so it is only delivered if that commits, and ``start()`` runs a thread
+    that LISTENs on the channel in the current process.
+
+    Subscribers are called with a list of rec_ids, or with None when they
+    may have missed notifications and should forget everything.
+    """
+
+    def __init__(self, channel: str = "recommendation_changes", poll_interval: float = 1.0):
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.engine = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.received = 0
+        self.reconnects = 0
+
+    def configure(self, engine=None, channel: str = None):
+        """Sends notifications through Postgres on an engine, or in process without one"""
+        self.stop()
+        self.engine = engine
+        if channel:
+            self.channel = channel
+
+    def subscribe(self, callback):
+        """Calls a function with the rec_ids of every change"""
+        self._subscribers.append(callback)
+
+    def publish(self, session, rec_ids):
+        """Announces that Recommendations changed in the session's transaction"""
+        if not rec_ids:
+            return
+        if self.engine is None:
+            self._deliver(rec_ids)
+            return
+        session.execute(NOTIFY, {"channel": self.channel, "payloads": encode(rec_ids)})
+
+    def start(self):
+        """Lazily starts the listener thread once in every (forked) process"""
+        if self.engine is None:
+            return
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="change-listener", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stops the listener thread"""
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.poll_interval + 5)
+        self._thread = None
+
+    def _deliver(self, rec_ids):
+        """Hands changed rec_ids (or None for everything) to the subscribers"""
+        for callback in self._subscribers:
+            try:
+                callback(rec_ids)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Change subscriber %r failed", callback)
+
+    def _run(self):
+        """Listens until stopped, reconnecting whenever the connection is lost"""
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Lost the %s listener connection, reconnecting", self.channel)
+                self.reconnects += 1
+                self._stopped.wait(self.poll_interval)
+
+    def _listen(self):
+        """LISTENs on a dedicated connection and delivers what arrives"""
+        raw = self.engine.raw_connection()
+        connection = raw.driver_connection
+        # the listener keeps its connection for good, so it must not hold a pool slot
+        raw.detach()
+        try:
+            connection.autocommit = True
+            connection.execute(f'LISTEN "{self.channel}"')
+            # anything published before LISTEN took effect was missed
+            self._deliver(None)
+            pgconn = connection.pgconn
+            while not self._stopped.is_set():
+                ready, _, _ = select.select([pgconn.socket], [], [], self.poll_interval)
+                if not ready:
+                    continue
+                pgconn.consume_input()
+                notify = pgconn.notifies()
+                while notify is not None:
+                    self.received += 1
+                    self._deliver(decode(notify.extra.decode()))
+                    notify = pgconn.notifies()
+        finally:
+            raw.close()
+
+
+def encode(rec_ids: list) -> list:
+    """Packs rec_ids into comma separated payloads that fit in a notification"""
+    payloads = []
+    current = ""
+    for rec_id in rec_ids:
+        item = str(rec_id)
+        if current and len(current) + len(item) + 1 > MAX_PAYLOAD:
+            payloads.append(current)
+            current = ""
+        current = f"{current},{item}" if current else item
+    payloads.append(current)
+    return payloads
+
+
+def decode(payload: str):
+    """Returns the rec_ids in a payload, or None if it cannot be read"""
+    try:
+        return [int(rec_id) for rec_id in payload.split(",") if rec_id]
+    except ValueError:
+        logger.warning("Malformed change notification %r, forgetting everything", payload)
+        return None
@@ -1,7 +1,9 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
+import click
+from service import app, migrations
+from service.common import traffic_capture
 from service.models import db
 
 
@@ -19,3 +21,54 @@ def db_create():  #
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to apply the pending schema migrations
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    Applies the pending schema migrations. Run it once per deploy,
+    before the new workers start.
+    """
+    applied = migrations.upgrade(db.engine)
+    if applied:
+        click.echo(f"Applied schema versions {', '.join(f'{version:03d}' for version in applied)}")
+    else:
+        click.echo(f"Schema is up to date at version {migrations.latest_version():03d}")
+
+
+######################################################################
+# Command to replay captured requests against a running service
+# Usage:
+#   flask replay captures/ --target http://localhost:8080 --speed 2
+######################################################################
+@app.cli.command("replay")
+@click.argument("captures", nargs=-1, required=True)
+@click.option("--target", default="http://localhost:8080", show_default=True, help="base URL of the service")
+@click.option("--speed", default=1.0, show_default=True, help="pace relative to the capture, 0 for no pauses")
+@click.option("--parallel", default=8, show_default=True, help="requests sent at once")
+@click.option("--read-only", is_flag=True, help="only replay GET and HEAD requests")
+def replay(captures, target, speed, parallel, read_only):
+    """
+    Replays captured requests (files, directories or globs written with
+    CAPTURE_DIR) and compares their latency with the capture.
+    """
+    entries = traffic_capture.read_captures(captures)
+    if read_only:
+        entries = [entry for entry in entries if entry["method"] in traffic_capture.READ_METHODS]
+    summary = traffic_capture.summarize(traffic_capture.replay(entries, target, speed, parallel))
+    click.echo(
+        f"{summary['requests']} requests, {summary['errors']} errors, "
+        f"{summary['status_changed']} with a different status"
+    )
+    click.echo(f"{'ms':>9} {'captured':>9} {'replayed':>9} {'change':>9}")
+    for name in ("p50", "p95", "p99"):
+        captured, replayed = summary["captured"][name], summary["replayed"][name]
+        if captured is None:
+            continue
+        change = f"{replayed / captured - 1:+.0%}" if captured else "-"
+        click.echo(f"{name:>9} {captured:>9.1f} {replayed:>9.1f} {change:>9}")
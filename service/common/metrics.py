@@ -0,0 +1,114 @@
+"""
+Metrics
+
+This module holds the Prometheus metrics of the service. Under gunicorn
+every worker keeps its values in files in PROMETHEUS_MULTIPROC_DIR (set by
+gunicorn.conf.py), and a scrape of any worker adds up those of all of
+them. Without that directory the metrics are the ones of this process.
+"""
+import os
+import threading
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# prometheus_client chooses where values are kept when it is imported, so this is decided once too
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+REQUESTS = Counter(
+    "http_requests", "Requests handled", ["method", "resource", "status"]
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being handled",
+    ["method", "resource"],
+    multiprocess_mode="livesum",
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time taken to handle a request",
+    ["method", "resource"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connections of the database pool by state",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+POOL_CHECKOUTS = Counter("db_pool_checkouts", "Connections taken from the pool")
+POOL_TIMEOUTS = Counter("db_pool_timeouts", "Requests that gave up waiting for a connection")
+POOL_WAIT_MAX = Gauge(
+    "db_pool_wait_max_seconds",
+    "Longest wait for a connection",
+    multiprocess_mode="livemax",
+)
+CACHE_ENTRIES = Gauge(
+    "cache_entries", "Recommendations in the cache", multiprocess_mode="livesum"
+)
+CACHE_EVENTS = Counter(
+    "cache_events", "Cache lookups and removals by outcome", ["event"]
+)
+
+# Pool states reported as connections, and the cache counters reported as events
+POOL_STATES = ("checked_in", "checked_out", "overflow")
+CACHE_COUNTERS = ("hits", "misses", "evictions", "expirations", "invalidations")
+
+_lock = threading.Lock()
+# the last value of every worker counter copied into a Counter, and the process it was read in
+_copied = {}
+_copied_pid = None
+
+
+def render() -> tuple:
+    """Returns the (body, content type) of a scrape
+
+    With PROMETHEUS_MULTIPROC_DIR the metrics of every worker are added up.
+    """
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def update(pool: dict, cache: dict):
+    """Copies the statistics of this worker's pool and cache into the metrics
+
+    The pool and the cache count since the worker started; the Counters are
+    advanced by what was added since the last update.
+    """
+    for state in POOL_STATES:
+        POOL_CONNECTIONS.labels(state).set(pool.get(state, 0))
+    POOL_WAIT_MAX.set(pool.get("wait_max_ms", 0) / 1000)
+    CACHE_ENTRIES.set(cache["size"])
+    with _lock:
+        _forget_other_process()
+        _advance(POOL_CHECKOUTS, "checkouts", pool.get("checkouts", 0))
+        _advance(POOL_TIMEOUTS, "timeouts", pool.get("timeouts", 0))
+        for event in CACHE_COUNTERS:
+            _advance(CACHE_EVENTS.labels(event), event, cache[event])
+
+
+def _forget_other_process():
+    """Starts over in a forked worker, whose values were read by its parent"""
+    global _copied_pid  # pylint: disable=global-statement
+    if _copied_pid != os.getpid():
+        _copied.clear()
+        _copied_pid = os.getpid()
+
+
+def _advance(counter, key: str, value: int):
+    """Adds the growth of a worker counter since it was last copied"""
+    last = _copied.get(key, 0)
+    # a counter that went down was reset, so all of it is new
+    counter.inc(value - last if value >= last else value)
+    _copied[key] = value
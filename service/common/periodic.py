@@ -0,0 +1,59 @@
+"""
+Periodic Task
+
+This module runs a function in the background of every worker at a
+fixed interval
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger("flask.app")
+
+
+class PeriodicTask:
+    """Calls ``func`` every ``interval`` seconds in a daemon thread
+
+    The thread is started lazily by ``start()``, once in every (forked)
+    process, so it also runs in the workers of a preloading server.
+    """
+
+    def __init__(self, func, interval: float, name: str):
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Starts the thread if it is not running in this process yet"""
+        if self.interval <= 0:
+            return
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the thread"""
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.interval + 5)
+        self._thread = None
+
+    def _run(self):
+        """Calls the function on every interval until stopped"""
+        while not self._stopped.wait(self.interval):
+            try:
+                self.func()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Periodic task %s failed", self.name)
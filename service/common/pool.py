@@ -0,0 +1,94 @@
+"""
+Connection Pool
+
+This module contains a connection pool that times how long every
+checkout takes, and the statement timeout applied to checked out
+connections
+"""
+import logging
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger("flask.app")
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that counts checkouts, how long they wait and how many time out"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def stats(self) -> dict:
+        """Returns the size of the pool and the checkout counters"""
+        with self._stats_lock:
+            checkouts = self.checkouts
+            return {
+                "size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "checkouts": checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+class AsyncTimedQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """TimedQueuePool for engines of the asyncio extension"""
+
+
+def pool_stats(engine) -> dict:
+    """Returns the statistics of an engine's pool"""
+    pool = engine.pool
+    if isinstance(pool, TimedQueuePool):
+        return pool.stats()
+    return {"status": pool.status()}
+
+
+def listen(engine, statement_timeout: int):
+    """Sets statement_timeout (in milliseconds) on every connection as it is checked out
+
+    A connection that already has the timeout is left alone, so only the
+    first checkout of every connection costs a round trip.
+    """
+    if statement_timeout <= 0:
+        return
+
+    @event.listens_for(engine, "checkout")
+    def set_statement_timeout(dbapi_connection, connection_record, _connection_proxy):
+        if connection_record.info.get("statement_timeout") == statement_timeout:
+            return
+        # the asyncio adapters' cursors are not context managers
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"SET statement_timeout = {int(statement_timeout)}")
+        finally:
+            cursor.close()
+        # SET is undone by a rollback unless it is committed on its own
+        dbapi_connection.commit()
+        connection_record.info["statement_timeout"] = statement_timeout
+        logger.debug("Set statement_timeout to %d ms", statement_timeout)
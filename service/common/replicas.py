@@ -0,0 +1,165 @@
+"""
+Read Replicas
+
+This module picks a healthy read replica for requests that only read,
+and contains the session that sends their SELECTs to it
+"""
+import itertools
+import logging
+import threading
+import time
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, text
+from sqlalchemy.sql import Select
+from service.common.periodic import PeriodicTask
+
+logger = logging.getLogger("flask.app")
+
+# Seconds a replica is behind; 0 when it has replayed all it received, NULL on a primary
+LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    """The health of one read replica, unknown until it is first checked"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+        self.errors = 0
+
+
+class ReplicaSet:
+    """Read replicas that are taken in turns while they are healthy
+
+    The replicas are checked every ``check_interval`` seconds by a thread
+    of every worker, started with ``start()``, so requests never wait on a
+    check. A replica is skipped until its first check, and while it cannot
+    be reached, is more than ``max_lag`` seconds behind, or has just
+    failed a query.
+    """
+
+    def __init__(self, engines=(), check_interval: float = 5.0, max_lag: float = 10.0):
+        self._lock = threading.Lock()
+        self._checker = None
+        self.configure(engines, check_interval, max_lag)
+
+    def configure(self, engines=(), check_interval: float = 5.0, max_lag: float = 10.0):
+        """Replaces the replicas, stopping the checks of the old ones"""
+        if self._checker is not None:
+            self._checker.stop()
+        with self._lock:
+            self.replicas = [Replica(engine) for engine in engines]
+            self.check_interval = check_interval
+            self.max_lag = max_lag
+            self._turns = itertools.cycle(range(len(self.replicas)))
+            self._checker = PeriodicTask(self.check, interval=check_interval, name="replica-checker")
+        for replica in self.replicas:
+            if not event.contains(replica.engine, "handle_error", self._on_error):
+                event.listen(replica.engine, "handle_error", self._on_error)
+
+    def start(self):
+        """Starts checking the replicas in this worker if it is not doing so yet"""
+        if self.replicas:
+            self._checker.start()
+
+    def choose(self):
+        """Returns the engine of the next healthy replica, or None to use the primary"""
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[next(self._turns)]
+            if replica.healthy:
+                return replica.engine
+        return None
+
+    def check(self):
+        """Checks the health and lag of every replica"""
+        for replica in self.replicas:
+            self._check(replica)
+
+    def mark_down(self, engine):
+        """Skips a replica until its next check"""
+        for replica in self.replicas:
+            if replica.engine is engine:
+                replica.healthy = False
+                replica.errors += 1
+                replica.checked_at = time.monotonic()
+                logger.warning("Read replica %s is down", engine.url)
+
+    def _check(self, replica: Replica) -> bool:
+        """Checks a replica and returns whether it is healthy"""
+        replica.checked_at = time.monotonic()
+        try:
+            with replica.engine.connect() as connection:
+                lag = connection.execute(LAG).scalar()
+        except exc.SQLAlchemyError as error:
+            logger.warning("Read replica %s failed its check: %s", replica.engine.url, error)
+            replica.healthy = False
+            return False
+        replica.lag = float(lag or 0)
+        replica.healthy = replica.lag <= self.max_lag
+        if not replica.healthy:
+            logger.warning("Read replica %s is %.1fs behind", replica.engine.url, replica.lag)
+        return replica.healthy
+
+    def _on_error(self, context):
+        """Takes a replica out of rotation when a connection to it fails"""
+        # without a connection the error happened while connecting
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def stats(self) -> list:
+        """Returns the health of every replica"""
+        return [
+            {
+                "url": replica.engine.url.render_as_string(hide_password=True),
+                "healthy": replica.healthy,
+                "lag": replica.lag,
+                "errors": replica.errors,
+            }
+            for replica in self.replicas
+        ]
+
+
+class RoutingSession(Session):
+    """Session that sends plain SELECTs to the replica chosen for the request
+
+    The replica is taken from ``g.read_replica``. Everything else, and
+    anything while there is no replica, uses the primary. A SELECT that
+    fails on the replica is run once more on the primary, which the rest
+    of the request then uses.
+    """
+
+    def execute(self, statement, *args, **kwargs):
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except (exc.OperationalError, exc.InterfaceError) as error:
+            replica = g.get("read_replica") if has_app_context() else None
+            if replica is None or self._replica_for(statement) is not replica:
+                raise
+            logger.warning("Read on replica %s failed, retrying on the primary: %s", replica.url, error)
+            self.rollback()
+            g.read_replica = None
+            return super().execute(statement, *args, **kwargs)
+
+    def _replica_for(self, statement):
+        """Returns the replica get_bind() sends a statement to, or None"""
+        if (
+            isinstance(statement, Select)
+            and statement._for_update_arg is None  # pylint: disable=protected-access
+            and not self._flushing
+        ):
+            return g.get("read_replica")
+        return None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            replica = self._replica_for(clause)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,52 @@
+"""
+Statement Cache Statistics
+
+This module counts how often SQLAlchemy reuses a compiled statement
+from its cache instead of compiling it again
+"""
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import default
+
+
+class StatementCacheStats:
+    """Counts compiled cache hits and misses of the statements an engine runs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+
+    def listen(self, engine):
+        """Starts counting the statements of an engine"""
+        if not event.contains(engine, "after_cursor_execute", self._after_cursor_execute):
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _after_cursor_execute(self, _conn, _cursor, _statement, _parameters, context, _executemany):
+        """Counts the cache result of one statement"""
+        cache_hit = getattr(context, "cache_hit", None)
+        with self._lock:
+            if cache_hit is default.CACHE_HIT:
+                self.hits += 1
+            elif cache_hit is default.CACHE_MISS:
+                self.misses += 1
+            else:
+                # text(), DDL and statements that cannot be cached
+                self.uncached += 1
+
+    def reset(self):
+        """Sets the counters back to zero"""
+        with self._lock:
+            self.hits = self.misses = self.uncached = 0
+
+    def stats(self) -> dict:
+        """Returns the counters and the hit rate of the cacheable statements"""
+        with self._lock:
+            cacheable = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "uncached": self.uncached,
+                "hit_rate": round(self.hits / cacheable, 4) if cacheable else 0.0,
+            }
@@ -0,0 +1,210 @@
+"""
+Traffic Capture
+
+This module records a sample of the requests a worker serves to rotating
+JSONL files, and replays such captures against a running service to
+reproduce a real load shape. Every line is one request:
+
+    {"ts": 1700000000.123, "method": "GET", "path": "/api/recommendations",
+     "query": "source_pid=3", "content_type": null, "body": null,
+     "status": 200, "duration_ms": 4.2}
+"""
+import glob
+import http.client
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+from urllib.parse import urlsplit
+import orjson
+
+logger = logging.getLogger("flask.app")
+
+# Methods a read-only replay sends
+READ_METHODS = ("GET", "HEAD")
+
+
+class TrafficCapture:
+    """Appends sampled requests to rotating JSONL files
+
+    Every process writes files of its own, ``capture-<pid>.jsonl``, which are
+    opened on the first write so the workers of a preloading server do not
+    share the master's. Each file is rotated at ``max_bytes`` and
+    ``backup_count`` rotated files are kept.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, directory: str = "", sample_rate: float = 0.0, max_bytes: int = 50 * 2 ** 20,
+                 backup_count: int = 5, max_body: int = 64 * 2 ** 10):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_body = max_body
+        self._lock = threading.Lock()
+        self._handler = None
+        self._pid = None
+
+    # pylint: disable=too-many-arguments
+    def configure(self, directory: str, sample_rate: float, max_bytes: int, backup_count: int, max_body: int):
+        """Changes the settings and closes the files written so far"""
+        with self._lock:
+            self._close()
+            self.directory = directory
+            self.sample_rate = sample_rate
+            self.max_bytes = max_bytes
+            self.backup_count = backup_count
+            self.max_body = max_body
+
+    @property
+    def enabled(self) -> bool:
+        """True when requests are captured"""
+        return bool(self.directory) and self.sample_rate > 0
+
+    def sampled(self) -> bool:
+        """Decides if the current request is captured"""
+        return self.enabled and random.random() < self.sample_rate
+
+    # pylint: disable=too-many-arguments
+    def record(self, started: float, method: str, path: str, query: str, content_type, body: bytes,
+               status: int, duration: float):
+        """Writes one captured request
+
+        Args:
+            started (float): the time.time() the request arrived
+            body (bytes): the request body, cut to max_body bytes
+            duration (float): the seconds it took to handle
+        """
+        entry = {
+            "ts": round(started, 6),
+            "method": method,
+            "path": path,
+            "query": query,
+            "content_type": content_type,
+            "body": body[:self.max_body].decode("utf-8", "replace") if body else None,
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+        }
+        if body and len(body) > self.max_body:
+            entry["truncated"] = True
+        line = orjson.dumps(entry).decode("utf-8")
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            self._handler.emit(logging.makeLogRecord({"msg": line}))
+
+    def close(self):
+        """Closes the file of this process"""
+        with self._lock:
+            self._close()
+
+    def _open(self):
+        """Opens the file of this process, forgetting one inherited from a parent"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._pid = os.getpid()
+        self._handler = RotatingFileHandler(
+            os.path.join(self.directory, f"capture-{self._pid}.jsonl"),
+            maxBytes=self.max_bytes,
+            backupCount=self.backup_count,
+            encoding="utf-8",
+        )
+
+    def _close(self):
+        if self._handler is not None and self._pid == os.getpid():
+            self._handler.close()
+        self._handler = None
+        self._pid = None
+
+
+def read_captures(paths) -> list:
+    """Returns the requests of capture files, directories of them or globs, in time order"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "capture-*.jsonl*")))
+        else:
+            files.extend(glob.glob(path) or [path])
+    entries = []
+    for name in sorted(set(files)):
+        with open(name, "rb") as capture:
+            entries.extend(orjson.loads(line) for line in capture if line.strip())
+    return sorted(entries, key=lambda entry: entry["ts"])
+
+
+def replay(entries: list, target: str, speed: float = 1.0, parallel: int = 8) -> list:
+    """Sends captured requests to a service again, keeping their pace
+
+    Args:
+        entries (list): captured requests in time order
+        target (str): base URL of the service, like http://localhost:8080
+        speed (float): 1 for the original pace, 2 for twice as fast,
+            0 to send each request as soon as a client is free
+        parallel (int): the number of clients sending at once
+
+    Returns:
+        list: for every request, a dict with its captured and replayed
+            status and milliseconds, and the error if it could not be sent
+    """
+    url = urlsplit(target)
+    clients = threading.local()
+
+    def send(entry):
+        connection = getattr(clients, "connection", None)
+        if connection is None:
+            connection = clients.connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        path = url.path.rstrip("/") + entry["path"] + (f"?{entry['query']}" if entry["query"] else "")
+        headers = {"Content-Type": entry["content_type"]} if entry.get("content_type") else {}
+        body = entry["body"].encode("utf-8") if entry.get("body") is not None else None
+        result = {"captured_status": entry["status"], "captured_ms": entry["duration_ms"]}
+        start = time.perf_counter()
+        try:
+            connection.request(entry["method"], path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as error:
+            connection.close()
+            return dict(result, status=None, ms=None, error=str(error))
+        return dict(result, status=response.status, ms=(time.perf_counter() - start) * 1000, error=None)
+
+    if not entries:
+        return []
+    logger.info("Replaying %d requests against %s", len(entries), target)
+    first = entries[0]["ts"]
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = []
+        for entry in entries:
+            if speed > 0:
+                delay = (entry["ts"] - first) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(send, entry))
+        return [future.result() for future in futures]
+
+
+def percentiles(values: list) -> dict:
+    """Returns the p50, p95 and p99 of some milliseconds"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    values = sorted(values)
+    return {
+        "p50": statistics.median(values),
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+    }
+
+
+def summarize(results: list) -> dict:
+    """Compares the latency and status of replayed requests with the captured ones"""
+    sent = [result for result in results if result["error"] is None]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(sent),
+        "status_changed": sum(1 for result in sent if result["status"] != result["captured_status"]),
+        "captured": percentiles([result["captured_ms"] for result in sent]),
+        "replayed": percentiles([result["ms"] for result in sent]),
+    }
@@ -0,0 +1,154 @@
+"""
+Vote Buffer
+
+This module contains a write-behind buffer that adds up like and
+dislike votes in memory and writes them out in batches
+"""
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger("flask.app")
+
+
+class VoteBuffer:
+    """Aggregates votes per rec_id and flushes them in batches
+
+    The pending votes are handed to ``flush_func`` as a dictionary of
+    ``{rec_id: (likes, dislikes)}`` every ``interval`` seconds, as soon
+    as ``max_pending`` votes are waiting, and when the process exits.
+
+    The votes of a failed flush are put back and retried with the next
+    one, until ``max_retries`` flushes in a row have failed. Votes that
+    would grow the buffer past ``max_backlog`` are not put back. Either
+    way the votes are dropped and logged, so an outage cannot grow the
+    buffer without bound.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, flush_func, interval: float = 1.0, max_pending: int = 1000,
+                 max_retries: int = 5, max_backlog: int = None):
+        self.flush_func = flush_func
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.max_backlog = max_backlog if max_backlog is not None else 10 * max_pending
+        self._pending = {}
+        self._count = 0
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, rec_id, likes: int = 0, dislikes: int = 0) -> tuple:
+        """Buffers votes for a Recommendation
+
+        Returns:
+            tuple: the (likes, dislikes) now pending for that Recommendation
+        """
+        self._ensure_started()
+        with self._lock:
+            votes = self._pending.setdefault(rec_id, [0, 0])
+            votes[0] += likes
+            votes[1] += dislikes
+            self._count += likes + dislikes
+            full = self._count >= self.max_pending
+            pending = tuple(votes)
+        if full:
+            self._wakeup.set()
+        return pending
+
+    def pending(self, rec_id) -> tuple:
+        """Returns the (likes, dislikes) not yet flushed for a Recommendation"""
+        with self._lock:
+            return tuple(self._pending.get(rec_id, (0, 0)))
+
+    def flush(self) -> int:
+        """Writes out all of the pending votes in one call to flush_func
+
+        Returns:
+            int: the number of Recommendations that were flushed
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._count = 0
+            if not batch:
+                return 0
+            try:
+                self.flush_func({rec_id: tuple(votes) for rec_id, votes in batch.items()})
+            except Exception:  # pylint: disable=broad-except
+                self._failures += 1
+                if self._failures >= self.max_retries:
+                    logger.exception(
+                        "Flushing buffered votes failed %d times, dropping the votes for %d recommendations",
+                        self._failures,
+                        len(batch),
+                    )
+                    self._failures = 0
+                else:
+                    logger.exception("Flushing %d buffered votes failed, will retry", len(batch))
+                    self._restore(batch)
+                return 0
+            self._failures = 0
+            logger.info("Flushed buffered votes for %d recommendations", len(batch))
+            return len(batch)
+
+    def stop(self):
+        """Stops the background thread and flushes anything still pending"""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.interval + 5)
+        self.flush()
+
+    def _restore(self, batch: dict):
+        """Puts the votes of a failed flush back into the buffer, up to max_backlog"""
+        dropped = 0
+        with self._lock:
+            for rec_id, (likes, dislikes) in batch.items():
+                if self._count + likes + dislikes > self.max_backlog:
+                    dropped += 1
+                    continue
+                votes = self._pending.setdefault(rec_id, [0, 0])
+                votes[0] += likes
+                votes[1] += dislikes
+                self._count += likes + dislikes
+        if dropped:
+            logger.error(
+                "Vote buffer is over %d votes, dropping the votes for %d recommendations",
+                self.max_backlog,
+                dropped,
+            )
+
+    def _run(self):
+        """Flushes on every interval until stopped"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _ensure_started(self):
+        """Lazily starts the flush thread once in every (forked) process"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # votes inherited from a parent process are the parent's to flush
+                self._pending = {}
+                self._count = 0
+                atexit.register(self.stop)
+            self._pid = pid
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="vote-buffer", daemon=True
+            )
+            self._thread.start()
@@ -12,5 +12,108 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connections each worker keeps open, and how many more it may open in a burst
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Seconds after which a connection is replaced (-1 keeps them forever)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Test connections before using them so ones dropped by a failover are replaced
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Executions of a statement on a connection before psycopg prepares it on the server
+# ("none" turns prepared statements off, e.g. behind PgBouncer in transaction mode)
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "5")
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+    "connect_args": {
+        "prepare_threshold": None
+        if DB_PREPARE_THRESHOLD.lower() == "none"
+        else int(DB_PREPARE_THRESHOLD)
+    },
+}
+# Apply pending schema migrations when the app starts instead of only checking for
+# them; production runs "flask db-upgrade" once per deploy and leaves this off
+DB_UPGRADE_ON_STARTUP = os.getenv("DB_UPGRADE_ON_STARTUP", "false").lower() == "true"
+# Comma separated read replicas for requests that only read
+DATABASE_REPLICA_URI = os.getenv("DATABASE_REPLICA_URI", "")
+# Seconds to wait for a connection to a replica before giving up on it
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+SQLALCHEMY_BINDS = {
+    f"replica_{number}": {
+        **SQLALCHEMY_ENGINE_OPTIONS,
+        "url": uri.strip(),
+        "connect_args": dict(
+            SQLALCHEMY_ENGINE_OPTIONS["connect_args"], connect_timeout=REPLICA_CONNECT_TIMEOUT
+        ),
+    }
+    for number, uri in enumerate(DATABASE_REPLICA_URI.split(","))
+    if uri.strip()
+}
+# Seconds a client keeps reading from the primary after it writes, to see its own writes
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+# Seconds between health checks of each replica
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "5"))
+# Seconds a replica may be behind the primary before it is skipped
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "10"))
+
+# Milliseconds any single SQL statement may run before it is cancelled (0 turns it off)
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "5000"))
+
+# Page sizes for listing Recommendations
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+# Rows fetched at a time when streaming the collection as NDJSON
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "1000"))
+
+# Serve the Swagger UI at /apidocs; production can turn it off, swagger.json stays
+API_DOCS = os.getenv("API_DOCS", "true").lower() == "true"
+
+# Encode list responses with orjson straight from the rows instead of marshalling them
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() == "true"
+
+# Rows sent in each multi-row INSERT by the bulk create endpoint
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+# Cache of single Recommendations in each worker (0 turns it off)
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "1024"))
+# Seconds a cached Recommendation is served before it is read again
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+# How workers tell each other to evict changed Recommendations:
+# "postgres" for LISTEN/NOTIFY, "local" to only evict within the process
+CACHE_INVALIDATION = os.getenv("CACHE_INVALIDATION", "postgres")
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "recommendation_changes")
+
+# Seconds between background refreshes of the per-product snapshots (0 turns them off)
+SNAPSHOT_REFRESH_INTERVAL = float(os.getenv("SNAPSHOT_REFRESH_INTERVAL", "1.0"))
+# Most queued writes taken by one refresh
+SNAPSHOT_REFRESH_BATCH = int(os.getenv("SNAPSHOT_REFRESH_BATCH", "10000"))
+
+# Buffer like/dislike votes in each worker and write them in batches
+VOTE_BUFFER_ENABLED = os.getenv("VOTE_BUFFER_ENABLED", "false").lower() == "true"
+# Longest time in seconds a buffered vote waits before being written
+VOTE_BUFFER_FLUSH_INTERVAL = float(os.getenv("VOTE_BUFFER_FLUSH_INTERVAL", "1.0"))
+# Number of buffered votes that triggers an early flush
+VOTE_BUFFER_MAX_PENDING = int(os.getenv("VOTE_BUFFER_MAX_PENDING", "1000"))
+# Failed flushes in a row after which the buffered votes are dropped
+VOTE_BUFFER_MAX_RETRIES = int(os.getenv("VOTE_BUFFER_MAX_RETRIES", "5"))
+
+# Seconds between copies of each worker's pool and cache statistics into the metrics
+METRICS_REFRESH_INTERVAL = float(os.getenv("METRICS_REFRESH_INTERVAL", "5.0"))
+
+# Directory each worker writes its sample of the requests to, as JSONL (empty turns it off)
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "")
+# Fraction of the requests that are captured
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "0.01"))
+# Size in bytes at which a capture file is rotated, and how many rotated files are kept
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(50 * 2 ** 20)))
+CAPTURE_BACKUP_COUNT = int(os.getenv("CAPTURE_BACKUP_COUNT", "5"))
+# Longest request body in bytes that is captured, longer ones are cut
+CAPTURE_MAX_BODY = int(os.getenv("CAPTURE_MAX_BODY", str(64 * 2 ** 10)))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
@@ -0,0 +1,205 @@
+"""
+Package: migrations
+
+Versioned schema migrations for the Recommendation service
+
+Every module in this package named ``v<NNN>_<description>.py`` is one
+migration. It declares a ``DESCRIPTION`` and an ``upgrade(connection)``
+function, and ``NNN`` is its schema version. Applied versions are
+recorded in the ``schema_version`` table, so each migration runs once
+against a database no matter how many processes upgrade at the same time.
+
+Each migration runs in a transaction of its own. One may also declare an
+``upgrade_online(connection)`` step, run with autocommit once that
+transaction has committed, for work that must not hold its locks for long
+or cannot run in a transaction at all: backfills that commit in batches
+with backfill() and indexes built with create_index_concurrently(). The
+version is only recorded after both steps, so every step has to be safe
+to run again after an interruption.
+
+Migrations run without the statement_timeout the pool sets for requests,
+so a long index build or backfill batch is never cancelled halfway.
+
+Migrations are applied by ``flask db-upgrade`` before the workers start;
+a worker only compares the recorded versions with its own with pending().
+"""
+import importlib
+import logging
+from contextlib import contextmanager
+import pkgutil
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+logger = logging.getLogger("flask.app")
+
+# Arbitrary key for the advisory lock that serializes concurrent upgrades
+MIGRATION_LOCK_KEY = 2820003
+
+# Rows a backfill() updates per transaction
+BACKFILL_BATCH_SIZE = 10000
+
+CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+)
+"""
+
+
+def available() -> list:
+    """Returns every migration in this package sorted by version
+
+    Returns:
+        list: (version, module) tuples
+    """
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        name = module_info.name
+        if not name.startswith("v"):
+            continue
+        version = int(name[1:].split("_", 1)[0])
+        migrations.append((version, importlib.import_module(f"{__name__}.{name}")))
+    return sorted(migrations, key=lambda migration: migration[0])
+
+
+def latest_version() -> int:
+    """Returns the version the schema has once every migration is applied"""
+    migrations = available()
+    return migrations[-1][0] if migrations else 0
+
+
+def applied_versions(connection) -> set:
+    """Returns the versions already applied to the database"""
+    connection.execute(text(CREATE_VERSION_TABLE))
+    rows = connection.execute(text("SELECT version FROM schema_version"))
+    return {row.version for row in rows}
+
+
+def pending(engine) -> list:
+    """Returns the versions not applied to the database yet
+
+    This is a single SELECT that never changes the schema, cheap enough for
+    every worker to run on startup. A database without a schema_version
+    table has every version pending.
+    """
+    try:
+        with engine.connect() as connection:
+            rows = connection.execute(text("SELECT version FROM schema_version"))
+            done = {row.version for row in rows}
+    except ProgrammingError:
+        done = set()
+    return [version for version, _ in available() if version not in done]
+
+
+def upgrade(engine) -> list:
+    """Applies every pending migration, committing each version on its own
+
+    A session advisory lock, held on a connection of its own for the whole
+    run, keeps concurrent upgrades from applying the same version twice.
+
+    Args:
+        engine: the SQLAlchemy engine of the database to upgrade
+
+    Returns:
+        list: the versions that were applied
+    """
+    applied = []
+    with connect(engine) as lock:
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            done = applied_versions(lock)
+            for version, migration in available():
+                if version in done:
+                    continue
+                logger.info("Applying migration %03d: %s", version, migration.DESCRIPTION)
+                apply(engine, version, migration)
+                applied.append(version)
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    return applied
+
+
+def apply(engine, version: int, migration):
+    """Runs one migration and records its version"""
+    online = getattr(migration, "upgrade_online", None)
+    with engine.begin() as connection:
+        connection.execute(text("SET LOCAL statement_timeout = 0"))
+        migration.upgrade(connection)
+        if online is None:
+            record(connection, version, migration)
+    if online is not None:
+        with connect(engine) as connection:
+            online(connection)
+            record(connection, version, migration)
+
+
+@contextmanager
+def connect(engine):
+    """Yields an autocommit connection of the engine without a statement timeout
+
+    The session default is restored before the connection goes back to the
+    pool, which sets its own timeout again on the next checkout.
+    """
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.execute(text("SET statement_timeout = 0"))
+        try:
+            yield connection
+        finally:
+            connection.execute(text("RESET statement_timeout"))
+            connection.connection.info.pop("statement_timeout", None)
+
+
+def record(connection, version: int, migration):
+    """Records a version as applied"""
+    connection.execute(
+        text(
+            "INSERT INTO schema_version (version, description) "
+            "VALUES (:version, :description)"
+        ),
+        {"version": version, "description": migration.DESCRIPTION},
+    )
+
+
+def backfill(connection, statement: str, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Runs an UPDATE of the recommendation table one range of rec_ids at a time
+
+    Meant for an upgrade_online() step, where every batch commits on its
+    own, so row locks are short and vacuum can reclaim the old row versions
+    as it goes.
+
+    Args:
+        statement (str): the UPDATE, taking its rows with :low < rec_id <= :high
+        batch_size (int): the rec_ids per batch
+
+    Returns:
+        int: the number of rows updated
+    """
+    first, last = connection.execute(text("SELECT min(rec_id), max(rec_id) FROM recommendation")).one()
+    updated = 0
+    if first is None:
+        return updated
+    for low in range(first - 1, last, batch_size):
+        result = connection.execute(text(statement), {"low": low, "high": low + batch_size})
+        updated += result.rowcount
+    return updated
+
+
+def create_index_concurrently(connection, name: str, definition: str):
+    """Builds an index without blocking writes, from an upgrade_online() step
+
+    A build that was interrupted leaves an invalid index behind, which is
+    dropped and built again.
+
+    Args:
+        name (str): the name of the index
+        definition (str): the rest of CREATE INDEX, like "ON recommendation (name)"
+    """
+    invalid = connection.execute(
+        text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+        {"name": name},
+    ).scalar()
+    if invalid:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"))
@@ -0,0 +1,33 @@
+"""
+Migration 001: the recommendation table as first shipped
+"""
+from sqlalchemy import text
+
+DESCRIPTION = "baseline recommendation table"
+
+STATEMENTS = (
+    """
+    DO $$ BEGIN
+        CREATE TYPE recommendationtype AS ENUM ('CROSSSELL', 'UPSELL', 'ACCESSORY');
+    EXCEPTION
+        WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS recommendation (
+        rec_id SERIAL PRIMARY KEY,
+        source_pid INTEGER,
+        name VARCHAR(63),
+        recommendation_name VARCHAR(63),
+        type recommendationtype NOT NULL DEFAULT 'CROSSSELL',
+        number_of_likes INTEGER,
+        number_of_dislikes INTEGER
+    )
+    """,
+)
+
+
+def upgrade(connection):
+    """Creates the recommendation table if it does not exist yet"""
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,23 @@
+"""
+Migration 002: secondary indexes for the find_by_* lookups
+"""
+from service import migrations
+
+DESCRIPTION = "indexes for name, recommendation_name and type"
+
+# source_pid is indexed by migration 003, together with the ranking score
+INDEXES = (
+    ("ix_recommendation_name", "ON recommendation (name)"),
+    ("ix_recommendation_recommendation_name", "ON recommendation (recommendation_name)"),
+    ("ix_recommendation_type_source_pid", "ON recommendation (type, source_pid)"),
+)
+
+
+def upgrade(connection):
+    """Nothing to change in a transaction, the indexes are built online"""
+
+
+def upgrade_online(connection):
+    """Builds the lookup indexes without blocking writes"""
+    for name, definition in INDEXES:
+        migrations.create_index_concurrently(connection, name, definition)
@@ -0,0 +1,46 @@
+"""
+Migration 003: stored ranking score with a per-product index
+"""
+from sqlalchemy import text
+from service import migrations
+
+DESCRIPTION = "wilson score column and (source_pid, score DESC, rec_id) index"
+
+# The lower bound of the Wilson score interval at 95% confidence, as
+# wilson_score() in the models computed it when this migration was written
+SCORE = """
+    CASE WHEN {likes} + {dislikes} = 0 THEN 0.0
+    ELSE ({likes} + 1.96 * 1.96 / 2
+          - 1.96 * sqrt({likes} * {dislikes} / ({likes} + {dislikes}) + 1.96 * 1.96 / 4))
+         / ({likes} + {dislikes} + 1.96 * 1.96)
+    END
+""".format(
+    likes="coalesce(number_of_likes, 0)::double precision",
+    dislikes="coalesce(number_of_dislikes, 0)::double precision",
+)
+
+BACKFILL = f"""
+    UPDATE recommendation SET score = {SCORE}
+    WHERE rec_id > :low AND rec_id <= :high
+    AND (coalesce(number_of_likes, 0) > 0 OR coalesce(number_of_dislikes, 0) > 0)
+"""
+
+
+def upgrade(connection):
+    """Adds the score column, 0 until it is filled in"""
+    connection.execute(
+        text(
+            "ALTER TABLE recommendation "
+            "ADD COLUMN IF NOT EXISTS score DOUBLE PRECISION NOT NULL DEFAULT 0"
+        )
+    )
+
+
+def upgrade_online(connection):
+    """Fills in the score in batches and indexes it per product without blocking writes"""
+    migrations.backfill(connection, BACKFILL)
+    migrations.create_index_concurrently(
+        connection,
+        "ix_recommendation_source_pid_score",
+        "ON recommendation (source_pid, score DESC, rec_id)",
+    )
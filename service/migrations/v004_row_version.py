@@ -0,0 +1,50 @@
+"""
+Migration 004: row version column for ETags and conditional requests
+"""
+from sqlalchemy import text
+from service import migrations
+
+DESCRIPTION = "version column drawn from recommendation_version_seq"
+
+# Without a default in ADD COLUMN the table is not rewritten; the default
+# set afterwards only applies to new rows
+STATEMENTS = (
+    "CREATE SEQUENCE IF NOT EXISTS recommendation_version_seq",
+    "ALTER TABLE recommendation ADD COLUMN IF NOT EXISTS version BIGINT",
+    "ALTER TABLE recommendation ALTER COLUMN version "
+    "SET DEFAULT nextval('recommendation_version_seq')",
+)
+
+BACKFILL = """
+    UPDATE recommendation SET version = nextval('recommendation_version_seq')
+    WHERE rec_id > :low AND rec_id <= :high AND version IS NULL
+"""
+
+# A validated CHECK lets SET NOT NULL skip its own scan of the table under
+# an ACCESS EXCLUSIVE lock; validating it only blocks other schema changes
+NOT_NULL_STATEMENTS = (
+    """
+    DO $$ BEGIN
+        ALTER TABLE recommendation ADD CONSTRAINT recommendation_version_not_null
+            CHECK (version IS NOT NULL) NOT VALID;
+    EXCEPTION
+        WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    "ALTER TABLE recommendation VALIDATE CONSTRAINT recommendation_version_not_null",
+    "ALTER TABLE recommendation ALTER COLUMN version SET NOT NULL",
+    "ALTER TABLE recommendation DROP CONSTRAINT IF EXISTS recommendation_version_not_null",
+)
+
+
+def upgrade(connection):
+    """Adds the version column, empty for the existing rows"""
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
+
+
+def upgrade_online(connection):
+    """Numbers the existing rows in batches, then makes the version required"""
+    migrations.backfill(connection, BACKFILL)
+    for statement in NOT_NULL_STATEMENTS:
+        connection.execute(text(statement))
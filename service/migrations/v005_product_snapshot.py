@@ -0,0 +1,33 @@
+"""
+Migration 005: per-product snapshot of pre-serialized Recommendations
+"""
+from sqlalchemy import text
+
+DESCRIPTION = "recommendation_snapshot table and its refresh queue"
+
+STATEMENTS = (
+    """
+    CREATE TABLE IF NOT EXISTS recommendation_snapshot (
+        source_pid INTEGER PRIMARY KEY,
+        document TEXT NOT NULL,
+        refreshed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS recommendation_snapshot_queue (
+        id BIGSERIAL PRIMARY KEY,
+        source_pid INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_recommendation_snapshot_queue_source_pid "
+    "ON recommendation_snapshot_queue (source_pid)",
+    # every product is queued for its first refresh
+    "INSERT INTO recommendation_snapshot_queue (source_pid) "
+    "SELECT DISTINCT source_pid FROM recommendation WHERE source_pid IS NOT NULL",
+)
+
+
+def upgrade(connection):
+    """Creates the snapshot tables and queues every product for its first refresh"""
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
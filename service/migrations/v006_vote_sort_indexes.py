@@ -0,0 +1,23 @@
+"""
+Migration 006: indexes for listing Recommendations sorted by their votes
+"""
+from service import migrations
+
+DESCRIPTION = "(coalesce(number_of_likes, 0), rec_id) and (coalesce(number_of_dislikes, 0), rec_id) indexes"
+
+# The keys are the expressions the pages are ordered and continued on,
+# which treat the NULL counters of old rows as 0
+INDEXES = (
+    ("ix_recommendation_likes_rec_id", "ON recommendation ((coalesce(number_of_likes, 0)), rec_id)"),
+    ("ix_recommendation_dislikes_rec_id", "ON recommendation ((coalesce(number_of_dislikes, 0)), rec_id)"),
+)
+
+
+def upgrade(connection):
+    """Nothing to change in a transaction, the indexes are built online"""
+
+
+def upgrade_online(connection):
+    """Builds the sort indexes without blocking writes"""
+    for name, definition in INDEXES:
+        migrations.create_index_concurrently(connection, name, definition)
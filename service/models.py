@@ -3,14 +3,86 @@ Models for Recommendation
 
 All of the models are stored in this module
 """
+import hashlib
+import json
 import logging
+import math
 from enum import Enum
+from itertools import chain
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    Float,
+    Integer,
+    Sequence,
+    Text,
+    bindparam,
+    case,
+    cast,
+    column,
+    delete,
+    exists,
+    func,
+    insert,
+    inspect,
+    literal_column,
+    select,
+    tuple_,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError
+from service import migrations
+from service.common.cache import LRUCache
+from service.common import pool
+from service.common.change_bus import ChangeBus
+from service.common.replicas import ReplicaSet, RoutingSession
+from service.common.statement_cache import StatementCacheStats
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+# Read replicas from the SQLALCHEMY_BINDS named replica_<n>, set up in init_db()
+replicas = ReplicaSet()
+
+# Compiled statement cache hits and misses of every engine
+statement_stats = StatementCacheStats()
+
+# Serialized Recommendations by rec_id, sized from the config in init_db()
+rec_cache = LRUCache()
+
+# Tells the other workers which Recommendations to evict from their caches
+change_bus = ChangeBus()
+
+# Every write takes the next number, so versions never repeat across rows
+version_seq = Sequence("recommendation_version_seq")
+
+# One pre-serialized JSON document of the Recommendations of each product
+snapshot_table = db.Table(
+    "recommendation_snapshot",
+    db.Column("source_pid", db.Integer, primary_key=True, autoincrement=False),
+    db.Column("document", db.Text, nullable=False),
+    db.Column(
+        "refreshed_at",
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+    ),
+)
+
+# Products written since their snapshot was last rebuilt. Writers only
+# append to it, so they never wait on each other or on the refresher.
+snapshot_queue = db.Table(
+    "recommendation_snapshot_queue",
+    db.Column("id", db.BigInteger, primary_key=True),
+    db.Column("source_pid", db.Integer, nullable=False, index=True),
+)
+
+# Arbitrary key for the advisory lock that lets one refresher run at a time
+SNAPSHOT_LOCK_KEY = 2820018
 
 
 # Function to initialize the database
@@ -19,6 +91,91 @@ def init_db(app):
     Recommendation.init_db(app)
 
 
+def dispose_engines(close: bool = True):
+    """Empties the connection pools of every engine
+
+    Args:
+        close (bool): False to forget the pooled connections without closing
+            them, which is what a forked worker does with its parent's
+    """
+    with Recommendation.app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+def evict(rec_ids):
+    """Removes changed Recommendations from the cache, or everything for None"""
+    if rec_ids is None:
+        rec_cache.clear()
+    else:
+        rec_cache.invalidate(*rec_ids)
+
+
+def commit_changes(rec_ids, source_pids, session=None):
+    """Commits the session and evicts the changed Recommendations in every worker
+
+    The notification and the products whose snapshots must be rebuilt ride
+    in the same transaction, and this worker evicts its own copies only
+    after the commit so a concurrent read cannot cache the old row again.
+
+    Args:
+        rec_ids: the ids of the Recommendations that changed
+        source_pids: the products those Recommendations belong (or belonged) to
+        session: the session to commit, db.session if not given
+    """
+    session = session or db.session
+    rec_ids = [int(rec_id) for rec_id in rec_ids]
+    change_bus.publish(session, rec_ids)
+    source_pids = {source_pid for source_pid in source_pids if source_pid is not None}
+    if source_pids:
+        session.execute(
+            insert(snapshot_queue),
+            [{"source_pid": source_pid} for source_pid in source_pids],
+        )
+    session.commit()
+    rec_cache.invalidate(*rec_ids)
+
+
+change_bus.subscribe(evict)
+
+
+# Columns the Recommendations can be sorted on
+SORT_KEYS = ("rec_id", "number_of_likes", "number_of_dislikes")
+
+# z for a 95% confidence interval, used by the ranking score
+SCORE_Z = 1.96
+
+# Range of the INTEGER columns
+INT_MIN, INT_MAX = -(2 ** 31), 2 ** 31 - 1
+
+
+def wilson_score(likes, dislikes) -> float:
+    """Returns the lower bound of the Wilson score interval for the votes
+
+    This ranks a Recommendation by how sure we are that people like it,
+    so 90 likes out of 100 outranks 1 like out of 1.
+    """
+    likes, dislikes = int(likes or 0), int(dislikes or 0)
+    total = likes + dislikes
+    if total == 0:
+        return 0.0
+    z_squared = SCORE_Z * SCORE_Z
+    spread = SCORE_Z * math.sqrt(likes * dislikes / total + z_squared / 4)
+    return (likes + z_squared / 2 - spread) / (total + z_squared)
+
+
+def wilson_score_expression(likes, dislikes):
+    """Returns wilson_score() as a SQL expression over the given columns"""
+    likes, dislikes = cast(likes, Float), cast(dislikes, Float)
+    total = likes + dislikes
+    z_squared = SCORE_Z * SCORE_Z
+    spread = SCORE_Z * func.sqrt(likes * dislikes / total + z_squared / 4)
+    return case(
+        (total == 0, 0.0),
+        else_=(likes + z_squared / 2 - spread) / (total + z_squared),
+    )
+
+
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
@@ -31,6 +188,45 @@ class RecommendationType(Enum):
     ACCESSORY = 2
 
 
+class RecommendationRecord:
+    """A read-only Recommendation row without any ORM state
+
+    The read endpoints only serialize what they read, so they use these
+    instead of full Recommendation instances.
+    """
+
+    __slots__ = (
+        "rec_id",
+        "source_pid",
+        "name",
+        "recommendation_name",
+        "type",
+        "number_of_likes",
+        "number_of_dislikes",
+        "score",
+        "version",
+    )
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"<RecommendationRecord {self.recommendation_name} id=[{self.rec_id}]>"
+
+    def serialize(self):
+        """Serializes a Recommendation record into a dictionary"""
+        return {
+            "rec_id": self.rec_id,
+            "source_pid": self.source_pid,
+            "name": self.name,
+            "recommendation_name": self.recommendation_name,
+            "type": self.type.name,
+            "number_of_likes": self.number_of_likes,
+            "number_of_dislikes": self.number_of_dislikes,
+        }
+
+
 class Recommendation(db.Model):
     """
     Class that represents a Recommendation
@@ -41,8 +237,10 @@ class Recommendation(db.Model):
     # Table Schema
     rec_id = db.Column(db.Integer, primary_key=True)  # this is a recommendation ID
     source_pid = db.Column(db.db.Integer)  # this is a product ID
-    name = db.Column(db.String(63))  # this is a product name
-    recommendation_name = db.Column(db.String(63))  # this is a recommendation name
+    name = db.Column(db.String(63), index=True)  # this is a product name
+    recommendation_name = db.Column(
+        db.String(63), index=True
+    )  # this is a recommendation name
     type = db.Column(
         db.Enum(RecommendationType),
         nullable=False,
@@ -50,6 +248,29 @@ class Recommendation(db.Model):
     )
     number_of_likes = db.Column(db.Integer, default=0)
     number_of_dislikes = db.Column(db.Integer, default=0)
+    # this is the wilson_score() of the votes, kept current by every write
+    score = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    # this is bumped from version_seq on every write, for ETags
+    version = db.Column(
+        db.BigInteger,
+        version_seq,
+        nullable=False,
+        server_default=version_seq.next_value(),
+    )
+
+    # Indexes are added to existing databases by service/migrations
+    __table_args__ = (
+        db.Index("ix_recommendation_type_source_pid", "type", "source_pid"),
+        db.Index(
+            "ix_recommendation_source_pid_score",
+            "source_pid",
+            score.desc(),
+            "rec_id",
+        ),
+        # the sort_key() of the vote counters, and rec_id after it
+        db.Index("ix_recommendation_likes_rec_id", func.coalesce(number_of_likes, 0), "rec_id"),
+        db.Index("ix_recommendation_dislikes_rec_id", func.coalesce(number_of_dislikes, 0), "rec_id"),
+    )
 
     def __repr__(self):
         return f"<Recommendation {self.recommendation_name} id=[{self.rec_id}]>"
@@ -60,21 +281,222 @@ class Recommendation(db.Model):
         """
         logger.info("Creating %s", self.recommendation_name)
         self.rec_id = None  # pylint: disable=invalid-name
+        self.score = wilson_score(self.number_of_likes, self.number_of_dislikes)
         db.session.add(self)
-        db.session.commit()
+        db.session.flush()
+        commit_changes([self.rec_id], [self.source_pid])
+
+    @classmethod
+    def create_many(cls, recommendations: list, batch_size: int = 1000) -> list:
+        """
+        Creates many Recommendations with multi-row INSERTs in one transaction
+
+        The rec_ids are drawn from the sequence first and given to the rows
+        in order, so they match the Recommendations whatever order the
+        database inserts the rows in.
+
+        Args:
+            recommendations (list): deserialized Recommendations to insert
+            batch_size (int): the number of rows sent in each INSERT
+
+        Returns:
+            list: the new rec_ids in the same order as the Recommendations
+        """
+        logger.info("Creating %d Recommendations", len(recommendations))
+        if not recommendations:
+            return []
+        statement = insert(cls.__table__)
+        try:
+            rec_ids = sorted(db.session.execute(cls.rec_ids_statement(len(recommendations))).scalars())
+            rows = cls.rows_with_ids(recommendations, rec_ids)
+            for start in range(0, len(rows), batch_size):
+                db.session.execute(statement, rows[start:start + batch_size])
+            commit_changes(
+                rec_ids,
+                [recommendation.source_pid for recommendation in recommendations],
+            )
+        except DataError as error:
+            db.session.rollback()
+            raise DataValidationError(
+                "Invalid Recommendation: " + str(error.orig)
+            ) from error
+        return rec_ids
+
+    @classmethod
+    def rec_ids_statement(cls, count: int):
+        """Returns a SELECT of count new rec_ids from the sequence of the table"""
+        sequence = func.pg_get_serial_sequence(cls.__tablename__, "rec_id")
+        return select(func.nextval(sequence)).select_from(func.generate_series(1, count))
+
+    @staticmethod
+    def rows_with_ids(recommendations: list, rec_ids: list) -> list:
+        """Returns the row_values() of Recommendations with the rec_ids given to them in order"""
+        return [
+            dict(recommendation.row_values(), rec_id=rec_id)
+            for recommendation, rec_id in zip(recommendations, rec_ids)
+        ]
+
+    def row_values(self) -> dict:
+        """Returns the column values a Recommendation is written with, score included"""
+        return {
+            "source_pid": self.source_pid,
+            "name": self.name,
+            "recommendation_name": self.recommendation_name,
+            "type": self.type,
+            "number_of_likes": self.number_of_likes,
+            "number_of_dislikes": self.number_of_dislikes,
+            "score": wilson_score(self.number_of_likes, self.number_of_dislikes),
+        }
 
     def update(self):
         """
         Updates a Recommendation to the database
         """
         logger.info("Saving %s", self.recommendation_name)
-        db.session.commit()
+        self.score = wilson_score(self.number_of_likes, self.number_of_dislikes)
+        self.version = version_seq.next_value()
+        # a Recommendation moved to another product changes both snapshots
+        moved_from = inspect(self).attrs.source_pid.history.deleted
+        commit_changes([self.rec_id], [self.source_pid, *moved_from])
 
     def delete(self):
         """Removes a Recommendation from the data store"""
         logger.info("Deleting %s", self.recommendation_name)
+        rec_id, source_pid = self.rec_id, self.source_pid
         db.session.delete(self)
-        db.session.commit()
+        commit_changes([rec_id], [source_pid])
+
+    @classmethod
+    def like(cls, rec_id):
+        """Atomically increments the like count of a Recommendation
+
+        Returns:
+            the updated RecommendationRecord, or None if it does not exist
+        """
+        logger.info("Liking Recommendation with id %s", rec_id)
+        return cls._increment(rec_id, likes=1)
+
+    @classmethod
+    def dislike(cls, rec_id):
+        """Atomically increments the dislike count of a Recommendation
+
+        Returns:
+            the updated RecommendationRecord, or None if it does not exist
+        """
+        logger.info("Disliking Recommendation with id %s", rec_id)
+        return cls._increment(rec_id, dislikes=1)
+
+    @classmethod
+    def _increment(cls, rec_id, likes=0, dislikes=0):
+        """Adds to the vote counters in a single UPDATE ... RETURNING
+
+        The increment and the new score are computed by the database so
+        concurrent votes can never overwrite each other, and the fresh row
+        comes back in the same round trip.
+        """
+        recommendations = cls.records(
+            db.session.execute(cls.increment_statement(rec_id, likes, dislikes))
+        )
+        if not recommendations:
+            db.session.commit()
+            return None
+        commit_changes([rec_id], [recommendations[0].source_pid])
+        return recommendations[0]
+
+    @classmethod
+    def increment_statement(cls, rec_id, likes: int = 0, dislikes: int = 0):
+        """Returns the UPDATE that adds votes to a Recommendation and returns its record"""
+        return (
+            update(cls)
+            .where(cls.rec_id == int(rec_id))
+            .values(
+                cls._vote_values(
+                    func.coalesce(cls.number_of_likes, 0) + likes,
+                    func.coalesce(cls.number_of_dislikes, 0) + dislikes,
+                )
+            )
+            .returning(*cls.record_columns())
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def apply_votes(cls, votes: dict) -> int:
+        """Adds a batch of buffered votes with one multi-row UPDATE
+
+        Votes are buffered without reading the Recommendation, so the votes
+        for rec_ids that do not exist (any more) are dropped here.
+
+        Args:
+            votes (dict): {rec_id: (likes, dislikes)} to add to each Recommendation
+
+        Returns:
+            int: the number of Recommendations that were updated
+        """
+        logger.info("Applying votes to %d Recommendations", len(votes))
+        deltas = values(
+            column("rec_id", Integer),
+            column("likes", Integer),
+            column("dislikes", Integer),
+            name="deltas",
+        ).data(
+            [(rec_id, likes, dislikes) for rec_id, (likes, dislikes) in votes.items()]
+        )
+        statement = (
+            update(cls)
+            .where(cls.rec_id == deltas.c.rec_id)
+            .values(
+                cls._vote_values(
+                    func.coalesce(cls.number_of_likes, 0) + deltas.c.likes,
+                    func.coalesce(cls.number_of_dislikes, 0) + deltas.c.dislikes,
+                )
+            )
+            .returning(cls.rec_id, cls.source_pid)
+            .execution_options(synchronize_session=False)
+        )
+        updated = db.session.execute(statement).all()
+        commit_changes([rec_id for rec_id, _ in updated], [source_pid for _, source_pid in updated])
+        if len(updated) < len(votes):
+            unknown = set(votes) - {rec_id for rec_id, _ in updated}
+            logger.warning("Dropped the votes for %d unknown Recommendations: %s", len(unknown), sorted(unknown))
+        return len(updated)
+
+    @classmethod
+    def _vote_values(cls, likes, dislikes) -> dict:
+        """Returns the SET clause for new vote counts and their score"""
+        return {
+            cls.number_of_likes: likes,
+            cls.number_of_dislikes: dislikes,
+            cls.score: wilson_score_expression(likes, dislikes),
+            cls.version: version_seq.next_value(),
+        }
+
+    @classmethod
+    def delete_matching(cls, **criteria) -> int:
+        """Removes every Recommendation matching all of the criteria
+
+        Args:
+            criteria: column names and the values they must equal
+
+        Returns:
+            int: the number of Recommendations deleted
+        """
+        logger.info("Deleting Recommendations matching %s", criteria)
+        deleted = db.session.execute(cls.delete_statement(**criteria)).all()
+        commit_changes(
+            [rec_id for rec_id, _ in deleted],
+            [source_pid for _, source_pid in deleted],
+        )
+        return len(deleted)
+
+    @classmethod
+    def delete_statement(cls, **criteria):
+        """Returns the DELETE of the matching Recommendations, returning (rec_id, source_pid)"""
+        return (
+            delete(cls)
+            .filter_by(**criteria)
+            .returning(cls.rec_id, cls.source_pid)
+            .execution_options(synchronize_session=False)
+        )
 
     def serialize(self):
         """Serializes a Recommendation into a dictionary"""
@@ -118,15 +540,78 @@ class Recommendation(db.Model):
             ) from error
         return self
 
+    def validate(self):
+        """
+        Checks that every value fits its column, so a bad one is reported
+        before anything is written instead of failing a whole batch
+        """
+        for name in ("source_pid", "number_of_likes", "number_of_dislikes"):
+            value = getattr(self, name)
+            if value is not None and (
+                not isinstance(value, int) or isinstance(value, bool) or not INT_MIN <= value <= INT_MAX
+            ):
+                raise DataValidationError(f"Invalid Recommendation: {name} must be a 32-bit integer")
+        for name in ("name", "recommendation_name"):
+            value = getattr(self, name)
+            length = self.__table__.c[name].type.length
+            if value is not None and (not isinstance(value, str) or len(value) > length):
+                raise DataValidationError(
+                    f"Invalid Recommendation: {name} must be a string of at most {length} characters"
+                )
+        return self
+
     @classmethod
     def init_db(cls, app):
         """Initializes the database session"""
         logger.info("Initializing database")
         cls.app = app
+        rec_cache.configure(app.config["CACHE_SIZE"], app.config["CACHE_TTL"])
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {}).setdefault(
+            "poolclass", pool.TimedQueuePool
+        )
+        for bind in app.config.setdefault("SQLALCHEMY_BINDS", {}).values():
+            bind.setdefault("poolclass", pool.TimedQueuePool)
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        replica_engines = [
+            engine
+            for key, engine in db.engines.items()
+            if key is not None and key.startswith("replica_")
+        ]
+        for engine in [db.engine, *replica_engines]:
+            pool.listen(engine, app.config["DB_STATEMENT_TIMEOUT"])
+            statement_stats.listen(engine)
+        replicas.configure(
+            replica_engines,
+            app.config["REPLICA_CHECK_INTERVAL"],
+            app.config["REPLICA_MAX_LAG"],
+        )
+        cls.check_schema(app)
+        if app.config["CACHE_INVALIDATION"] == "postgres":
+            change_bus.configure(db.engine, app.config["CACHE_INVALIDATION_CHANNEL"])
+        else:
+            change_bus.configure()
+
+    @classmethod
+    def check_schema(cls, app):
+        """Makes sure the schema is at the version of this code
+
+        The schema is created and migrated by "flask db-upgrade", so a worker
+        only runs one SELECT on startup. With DB_UPGRADE_ON_STARTUP it applies
+        the pending migrations itself, which is meant for development and tests.
+        A schema that is behind is only logged: the db-upgrade command loads
+        the app too and must still be able to start.
+        """
+        pending = migrations.pending(db.engine)
+        if not pending:
+            return
+        if app.config["DB_UPGRADE_ON_STARTUP"]:
+            migrations.upgrade(db.engine)
+        else:
+            logger.error(
+                "Schema versions %s are not applied, run: flask db-upgrade", pending
+            )
 
     @classmethod
     def all(cls):
@@ -134,12 +619,361 @@ class Recommendation(db.Model):
         logger.info("Processing all Recommendations")
         return cls.query.all()
 
+    @classmethod
+    def sort_key(cls, sort: str = "rec_id"):
+        """Returns the column expression Recommendations are sorted on
+
+        Args:
+            sort (string): one of SORT_KEYS
+        """
+        if sort == "rec_id":
+            return cls.rec_id
+        if sort not in SORT_KEYS:
+            raise DataValidationError(f"Invalid sort key: {sort}")
+        # counters may be NULL in old rows, which would break the row comparison
+        return func.coalesce(getattr(cls, sort), 0)
+
+    ######################################################################
+    # READ-ONLY QUERIES
+    #
+    # These run Core SELECTs of just the columns of a RecommendationRecord
+    # and return records, so no ORM instances are built for the reads
+    ######################################################################
+
+    @classmethod
+    def select_records(cls, **criteria):
+        """Returns a SELECT of the records matching all of the criteria
+
+        Takes the same criteria as find_by_criteria()
+        """
+        logger.info("Processing record lookup for %s...", criteria)
+        filters, values = cls._criteria_filters(criteria)
+        return select(*cls.record_columns()).where(*filters).params(values)
+
+    @classmethod
+    def record_columns(cls) -> list:
+        """Returns the columns of a RecommendationRecord in order"""
+        return [getattr(cls, name) for name in RecommendationRecord.__slots__]
+
+    @staticmethod
+    def records(result) -> list:
+        """Returns the rows of a result as RecommendationRecords"""
+        return [RecommendationRecord(*row) for row in result]
+
+    @classmethod
+    def paginate(
+        cls,
+        statement,
+        limit: int,
+        after: tuple = None,
+        sort: str = "rec_id",
+        descending: bool = False,
+    ) -> tuple:
+        """Returns one page of a query using keyset pagination
+
+        Rows are ordered by the sort key and then by rec_id, so every row has
+        a unique position to continue after.
+
+        Args:
+            statement: the select_records() to page through
+            limit (int): the most Recommendations to return
+            after (tuple): the (sort value, rec_id) the previous page ended with
+            sort (string): one of SORT_KEYS
+            descending (bool): True to return the largest values first
+
+        Returns:
+            tuple: the RecommendationRecords on the page and the (sort value, rec_id)
+            to pass as ``after`` for the next page, which is None on the last page
+        """
+        statement = cls.page_statement(statement, limit, after, sort, descending)
+        return cls.page_of(cls.records(db.session.execute(statement)), limit, sort)
+
+    @classmethod
+    def page_statement(
+        cls,
+        statement,
+        limit: int,
+        after: tuple = None,
+        sort: str = "rec_id",
+        descending: bool = False,
+    ):
+        """Returns the SELECT of one page for paginate(), with one row to spare"""
+        key = cls.sort_key(sort)
+        if sort == "rec_id":
+            position, ordering = cls.rec_id, (cls.rec_id,)
+            after = after[1] if after is not None else None
+        else:
+            position, ordering = tuple_(key, cls.rec_id), (key, cls.rec_id)
+        if after is not None:
+            statement = statement.where(position < after if descending else position > after)
+        if descending:
+            ordering = tuple(expression.desc() for expression in ordering)
+        return statement.order_by(*ordering).limit(limit + 1)
+
+    @staticmethod
+    def page_of(recommendations: list, limit: int, sort: str = "rec_id") -> tuple:
+        """Splits the records of a page_statement() into the page and where it ended"""
+        if len(recommendations) <= limit:
+            return recommendations, None
+        last = recommendations[limit - 1]
+        return recommendations[:limit], (getattr(last, sort) or 0, last.rec_id)
+
+    @classmethod
+    def stream(cls, statement, chunk_size: int = 1000):
+        """Iterates over records in rec_id order through a server-side cursor
+
+        Args:
+            statement: the select_records() to stream
+            chunk_size (int): the number of rows fetched from the cursor at once
+        """
+        logger.info("Streaming Recommendations in chunks of %d", chunk_size)
+        result = db.session.execute(
+            statement.order_by(cls.rec_id).execution_options(yield_per=chunk_size)
+        )
+        for rows in result.partitions():
+            yield from cls.records(rows)
+
     @classmethod
     def find(cls, rec_id):
         """Finds a Recommendation by it's ID"""
         logger.info("Processing lookup for id %d ...", rec_id)
         return cls.query.get(rec_id)
 
+    @classmethod
+    def find_for_update(cls, rec_id):
+        """Finds a Recommendation by its ID and locks it until the next commit"""
+        logger.info("Processing locked lookup for id %s ...", rec_id)
+        return db.session.get(
+            cls, rec_id, with_for_update=True, populate_existing=True
+        )
+
+    @classmethod
+    def find_serialized(cls, rec_id):
+        """Returns a serialized Recommendation by its ID, from the cache if it can
+
+        Returns:
+            tuple: the serialized Recommendation and its version,
+            or None if it does not exist
+        """
+        try:
+            rec_id = int(rec_id)
+        except (TypeError, ValueError):
+            return None
+        if not rec_cache.enabled:
+            return cls._load_serialized(rec_id)
+        cached = rec_cache.get(rec_id)
+        if cached is None:
+            change_bus.start()  # evictions from other workers must arrive first
+            token = rec_cache.token()
+            # a lagging replica could put an old row back into the cache, so fill it from the primary
+            cached = cls._load_serialized(rec_id, db.engine)
+            if cached is None:
+                return None
+            rec_cache.set(rec_id, cached, token)
+        data, version = cached
+        return dict(data), version
+
+    @classmethod
+    def _load_serialized(cls, rec_id: int, bind=None):
+        """Reads a Recommendation and returns it serialized with its version, or None"""
+        recommendations = cls.records(
+            db.session.execute(
+                cls.select_records().where(cls.rec_id == rec_id),
+                bind_arguments={"bind": bind},
+            )
+        )
+        if not recommendations:
+            return None
+        return recommendations[0].serialize(), recommendations[0].version
+
+    @staticmethod
+    def page_tag(recommendations, cursor: str = None) -> str:
+        """Returns the weak entity tag of a page of Recommendations
+
+        It is derived from the ids and versions of the rows the page holds
+        and the cursor of the next one, so answering If-None-Match costs no
+        query beyond the page itself. Versions come from one sequence, so
+        any write to a row of the page gives it a new tag.
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        for recommendation in recommendations:
+            digest.update(f"{recommendation.rec_id}:{recommendation.version},".encode())
+        if cursor is not None:
+            digest.update(cursor.encode())
+        return f"{len(recommendations)}-{digest.hexdigest()}"
+
+    @classmethod
+    def find_by_criteria(cls, **criteria):
+        """Returns the Recommendations matching all of the criteria given
+
+        Args:
+            name (string): the name of the associated product
+            source_pid (integer): the id of the associated product
+            recommendation_name (string): the name of the Recommendation
+            type (RecommendationType): the type of the Recommendation
+            min_likes, max_likes (integer): inclusive range of number_of_likes
+            min_dislikes, max_dislikes (integer): inclusive range of number_of_dislikes
+        """
+        logger.info("Processing lookup for %s...", criteria)
+        filters, values = cls._criteria_filters(criteria)
+        return cls.query.filter(*filters).params(values)
+
+    @classmethod
+    def _criteria_filters(cls, criteria: dict) -> tuple:
+        """Returns the prebuilt WHERE clauses for the criteria of find_by_criteria() and their parameters"""
+        values = {
+            name: value
+            for name, value in criteria.items()
+            if name in LOOKUP_CRITERIA and value is not None
+        }
+        return [LOOKUP_CRITERIA[name] for name in values], values
+
+    @classmethod
+    def find_top(cls, source_pid, limit: int = 10, rec_type: RecommendationType = None):
+        """Returns the best ranked Recommendations for a product
+
+        Served by one range scan of the (source_pid, score DESC, rec_id) index
+
+        Args:
+            source_pid (integer): the id of the product
+            limit (integer): the number of Recommendations to return
+            rec_type (RecommendationType): only return Recommendations of this type
+
+        Returns:
+            list: RecommendationRecords, best first
+        """
+        logger.info("Processing top %d lookup for source_pid %d...", limit, source_pid)
+        return cls.records(db.session.execute(cls.top_statement(source_pid, limit, rec_type)))
+
+    @classmethod
+    def top_statement(cls, source_pid, limit: int = 10, rec_type: RecommendationType = None):
+        """Returns the SELECT of find_top()"""
+        statement = cls.select_records(source_pid=source_pid, type=rec_type)
+        return statement.order_by(cls.score.desc(), cls.rec_id).limit(limit)
+
+    ######################################################################
+    # PRODUCT SNAPSHOTS
+    ######################################################################
+
+    @classmethod
+    def snapshot_documents(cls, source_pids):
+        """Returns a SELECT of (source_pid, document) built by the database
+
+        Each document is the JSON text of every Recommendation of a product
+        grouped by type, best ranked first, with the fields of serialize().
+        """
+        row = func.json_build_object(
+            *chain.from_iterable(
+                (literal_column(f"'{name}'"), getattr(cls, name))
+                for name in (
+                    "rec_id",
+                    "source_pid",
+                    "name",
+                    "recommendation_name",
+                    "type",
+                    "number_of_likes",
+                    "number_of_dislikes",
+                )
+            )
+        )
+        groups = func.json_build_object(
+            *chain.from_iterable(
+                (
+                    literal_column(f"'{rec_type.name}'"),
+                    func.coalesce(
+                        func.json_agg(aggregate_order_by(row, cls.score.desc(), cls.rec_id))
+                        .filter(cls.type == rec_type),
+                        literal_column("'[]'::json"),
+                    ),
+                )
+                for rec_type in RecommendationType
+            )
+        )
+        document = func.json_build_object(
+            literal_column("'source_pid'"),
+            cls.source_pid,
+            literal_column("'recommendations'"),
+            groups,
+        )
+        return (
+            select(cls.source_pid, cast(document, Text))
+            .where(cls.source_pid.in_(list(source_pids)))
+            .group_by(cls.source_pid)
+        )
+
+    @classmethod
+    def find_snapshot(cls, source_pid) -> str:
+        """Returns the JSON document of every Recommendation of a product
+
+        This is one primary key fetch of the stored snapshot, which may miss
+        the writes of the last SNAPSHOT_REFRESH_INTERVAL until the background
+        refresher stores them. Only a product that was never refreshed has
+        its document built on the spot.
+        """
+        logger.info("Processing snapshot lookup for source_pid %d...", source_pid)
+        document = db.session.execute(FIND_SNAPSHOT, {"source_pid": source_pid}).scalar()
+        if document is None:
+            built = db.session.execute(cls.snapshot_documents([source_pid])).first()
+            if built is None:
+                return cls.empty_snapshot(source_pid)
+            document = built[1]
+        return document
+
+    @staticmethod
+    def empty_snapshot(source_pid) -> str:
+        """Returns the snapshot document of a product without Recommendations"""
+        return json.dumps(
+            {
+                "source_pid": source_pid,
+                "recommendations": {rec_type.name: [] for rec_type in RecommendationType},
+            }
+        )
+
+    @classmethod
+    def refresh_snapshots(cls, limit: int = 10000) -> int:
+        """Rebuilds the snapshots of the products written since their last refresh
+
+        Only one worker refreshes at a time; the others return right away.
+
+        Args:
+            limit (int): the most queued writes to take in one refresh
+
+        Returns:
+            int: the number of products refreshed
+        """
+        locked = db.session.execute(select(func.pg_try_advisory_xact_lock(SNAPSHOT_LOCK_KEY))).scalar()
+        if not locked:
+            db.session.rollback()
+            return 0
+        batch = select(snapshot_queue.c.id).order_by(snapshot_queue.c.id).limit(limit)
+        source_pids = set(
+            db.session.execute(
+                delete(snapshot_queue)
+                .where(snapshot_queue.c.id.in_(batch))
+                .returning(snapshot_queue.c.source_pid)
+            ).scalars()
+        )
+        if source_pids:
+            logger.info("Refreshing the snapshots of %d products", len(source_pids))
+            upsert = pg_insert(snapshot_table).from_select(
+                ["source_pid", "document"], cls.snapshot_documents(source_pids)
+            )
+            db.session.execute(
+                upsert.on_conflict_do_update(
+                    index_elements=[snapshot_table.c.source_pid],
+                    set_={"document": upsert.excluded.document, "refreshed_at": func.now()},
+                )
+            )
+            # products that have no Recommendations left
+            db.session.execute(
+                delete(snapshot_table).where(
+                    snapshot_table.c.source_pid.in_(list(source_pids)),
+                    ~exists().where(cls.source_pid == snapshot_table.c.source_pid),
+                )
+            )
+        db.session.commit()
+        return len(source_pids)
+
     @classmethod
     def find_by_name(cls, name) -> list:
         """Returns all Recommendations with the name of an associated product
@@ -148,7 +982,7 @@ class Recommendation(db.Model):
             name (string): the name of the Recommendations you want to match
         """
         logger.info("Processing lookup for name %s...", name)
-        return cls.query.filter(cls.name == name)
+        return cls.query.filter(LOOKUP_CRITERIA["name"]).params(name=name)
 
     @classmethod
     def find_by_rec_name(cls, recommendation_name) -> list:
@@ -158,7 +992,9 @@ class Recommendation(db.Model):
             name (string): the name of the Recommendations you want to match
         """
         logger.info("Processing lookup for name %s...", recommendation_name)
-        return cls.query.filter(cls.recommendation_name == recommendation_name)
+        return cls.query.filter(LOOKUP_CRITERIA["recommendation_name"]).params(
+            recommendation_name=recommendation_name
+        )
 
     @classmethod
     def find_by_source_pid(cls, source_pid) -> list:
@@ -167,7 +1003,7 @@ class Recommendation(db.Model):
             source_pid (integer): the source_pid of the Recommendations you want to match
         """
         logger.info("Processing lookup for source_pid %d...", source_pid)
-        return cls.query.filter(cls.source_pid == source_pid)
+        return cls.query.filter(LOOKUP_CRITERIA["source_pid"]).params(source_pid=source_pid)
 
     @classmethod
     def find_by_type(
@@ -183,4 +1019,31 @@ class Recommendation(db.Model):
 
         """
         logger.info("Processing lookup for type %s...", rec_type.name)
-        return cls.query.filter(cls.type == rec_type)
+        return cls.query.filter(LOOKUP_CRITERIA["type"]).params(type=rec_type)
+
+
+######################################################################
+# PREBUILT LOOKUPS
+#
+# The WHERE clause of every lookup criterion, built once with a bound
+# parameter named after it. find_by_*(), find_by_criteria() and
+# select_records() combine them and bind the values, so the same
+# criteria always give the same statement and compiled form, and psycopg
+# prepares them on the server after DB_PREPARE_THRESHOLD executions on a
+# connection
+######################################################################
+LOOKUP_CRITERIA = {
+    "name": Recommendation.name == bindparam("name"),
+    "source_pid": Recommendation.source_pid == bindparam("source_pid"),
+    "recommendation_name": Recommendation.recommendation_name == bindparam("recommendation_name"),
+    "type": Recommendation.type == bindparam("type"),
+    "min_likes": Recommendation.number_of_likes >= bindparam("min_likes"),
+    "max_likes": Recommendation.number_of_likes <= bindparam("max_likes"),
+    "min_dislikes": Recommendation.number_of_dislikes >= bindparam("min_dislikes"),
+    "max_dislikes": Recommendation.number_of_dislikes <= bindparam("max_dislikes"),
+}
+
+# The stored snapshot of a product
+FIND_SNAPSHOT = select(snapshot_table.c.document).where(
+    snapshot_table.c.source_pid == bindparam("source_pid")
+)
@@ -5,18 +5,103 @@ a recommendation for a product.
 """
 
 # Import Flask application
-from flask import jsonify, abort, make_response
+import base64
+import binascii
+import json
+import time
+import orjson
+from flask import (
+    Response,
+    abort,
+    g,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
 from flask_restx import (
     Resource,
     fields,
+    inputs,
+    marshal,
     reqparse,
 )
-from flask_sqlalchemy import SQLAlchemy
+from werkzeug.http import quote_etag
+from service.common import metrics
 from service.common import status  # HTTP Status Codes
-from service.models import Recommendation, RecommendationType
+from service.common.api_spec import CACHE_CONTROL, ApiSpec
+from service.common.periodic import PeriodicTask
+from service.common.pool import pool_stats
+from service.common.traffic_capture import TrafficCapture
+from service.common.vote_buffer import VoteBuffer
+from service.models import (
+    SORT_KEYS,
+    DataValidationError,
+    Recommendation,
+    RecommendationType,
+    db,
+    rec_cache,
+    replicas,
+    statement_stats,
+)
 from . import app, api
 
-db = SQLAlchemy()
+# Cookie holding the time until which a client that wrote reads from the primary
+PRIMARY_COOKIE = "read_primary_until"
+
+
+def flush_votes(votes):
+    """Writes a batch of buffered votes to the database"""
+    with app.app_context():
+        Recommendation.apply_votes(votes)
+
+
+# Per-worker buffer used for votes when VOTE_BUFFER_ENABLED is set
+vote_buffer = VoteBuffer(
+    flush_votes,
+    interval=app.config["VOTE_BUFFER_FLUSH_INTERVAL"],
+    max_pending=app.config["VOTE_BUFFER_MAX_PENDING"],
+    max_retries=app.config["VOTE_BUFFER_MAX_RETRIES"],
+)
+
+
+def refresh_snapshots():
+    """Stores the snapshots of the products written since their last refresh"""
+    with app.app_context():
+        Recommendation.refresh_snapshots(app.config["SNAPSHOT_REFRESH_BATCH"])
+
+
+# Per-worker thread that keeps the product snapshots fresh
+snapshot_refresher = PeriodicTask(
+    refresh_snapshots,
+    interval=app.config["SNAPSHOT_REFRESH_INTERVAL"],
+    name="snapshot-refresher",
+)
+
+
+def refresh_metrics():
+    """Copies this worker's pool and cache statistics into the metrics"""
+    metrics.update(pool_stats(db.engine), rec_cache.stats())
+
+
+# Per-worker thread that keeps the pool and cache metrics current
+metrics_refresher = PeriodicTask(
+    refresh_metrics,
+    interval=app.config["METRICS_REFRESH_INTERVAL"],
+    name="metrics-refresher",
+)
+
+# Per-worker writer of the sampled requests when CAPTURE_DIR is set
+traffic_capture = TrafficCapture(
+    app.config["CAPTURE_DIR"],
+    sample_rate=app.config["CAPTURE_SAMPLE_RATE"],
+    max_bytes=app.config["CAPTURE_MAX_BYTES"],
+    backup_count=app.config["CAPTURE_BACKUP_COUNT"],
+    max_body=app.config["CAPTURE_MAX_BODY"],
+)
+
+# swagger.json, serialized and compressed once on the first request for it
+api_spec = ApiSpec(api)
 
 
 ######################################################################
@@ -28,6 +113,171 @@ def healthcheck():
     return make_response(jsonify(status=200, message="OK"), status.HTTP_200_OK)
 
 
+######################################################################
+# GET STATISTICS
+######################################################################
+@app.route("/stats")
+def stats():
+    """Reports the counters of this worker's caches, connection pool and replicas"""
+    return make_response(
+        jsonify(
+            cache=rec_cache.stats(),
+            pool=pool_stats(db.engine),
+            replicas=replicas.stats(),
+            statements=statement_stats.stats(),
+        ),
+        status.HTTP_200_OK,
+    )
+
+
+######################################################################
+# GET PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics")
+def prometheus_metrics():
+    """Reports the request, pool and cache metrics of every worker to Prometheus"""
+    refresh_metrics()
+    body, content_type = metrics.render()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
+######################################################################
+# GET THE OPENAPI DOCUMENT
+######################################################################
+def openapi_document():
+    """Returns swagger.json as it was built, gzipped if the client accepts it"""
+    gzipped = "gzip" in request.accept_encodings
+    body, etag = api_spec.document(gzipped)
+    if request.if_none_match.contains(etag):
+        response = not_modified(etag)
+    else:
+        response = make_response(body, status.HTTP_200_OK)
+        response.mimetype = "application/json"
+        response.set_etag(etag)
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# Serve it in place of flask-restx's view, which rebuilds the JSON on every request
+app.view_functions["specs"] = openapi_document
+
+
+######################################################################
+# BACKGROUND TASKS
+######################################################################
+@app.before_request
+def start_background_tasks():
+    """Starts the snapshot and metrics refreshers and the replica checks in this worker if they are not running yet"""
+    # tests refresh the snapshots and check the replicas themselves
+    if not app.testing:
+        snapshot_refresher.start()
+        metrics_refresher.start()
+        replicas.start()
+
+
+######################################################################
+# REQUEST METRICS
+######################################################################
+# Metric label of every endpoint: the class name of flask-restx Resources
+resource_labels = {}
+
+
+def resource_label() -> str:
+    """Returns the label the metrics of the current request are recorded under"""
+    endpoint = request.endpoint
+    label = resource_labels.get(endpoint)
+    if label is None:
+        view_class = getattr(app.view_functions.get(endpoint), "view_class", None)
+        # requests for unknown URLs share one label so they cannot create new series
+        label = view_class.__name__ if view_class else endpoint or "unmatched"
+        resource_labels[endpoint] = label
+    return label
+
+
+@app.before_request
+def start_metrics():
+    """Counts the request as in progress and notes when it arrived"""
+    g.metrics_labels = (request.method, resource_label())
+    g.metrics_started = time.perf_counter()
+    metrics.IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+
+@app.after_request
+def record_metrics(response):
+    """Records the status and time taken of the request"""
+    labels = g.pop("metrics_labels", None)
+    if labels is not None:
+        metrics.IN_PROGRESS.labels(*labels).dec()
+        metrics.LATENCY.labels(*labels).observe(time.perf_counter() - g.pop("metrics_started"))
+        metrics.REQUESTS.labels(*labels, response.status_code).inc()
+    return response
+
+
+######################################################################
+# TRAFFIC CAPTURE
+######################################################################
+@app.before_request
+def start_capture():
+    """Notes when a request arrived if it is one of the sampled ones"""
+    if traffic_capture.sampled():
+        g.capture_started = (time.time(), time.perf_counter())
+
+
+@app.after_request
+def capture_request(response):
+    """Writes a sampled request with its status and how long it took"""
+    started = g.pop("capture_started", None)
+    if started is not None:
+        traffic_capture.record(
+            started[0],
+            request.method,
+            request.path,
+            request.query_string.decode("latin-1"),
+            request.content_type,
+            request.get_data(cache=True),
+            response.status_code,
+            time.perf_counter() - started[1],
+        )
+    return response
+
+
+######################################################################
+# READ REPLICA ROUTING
+######################################################################
+@app.before_request
+def route_reads():
+    """Lets requests that only read use a replica, unless the client just wrote"""
+    if request.method not in ("GET", "HEAD"):
+        return
+    try:
+        read_primary_until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+    except ValueError:
+        read_primary_until = 0
+    if read_primary_until < time.time():
+        g.read_replica = replicas.choose()
+
+
+@app.after_request
+def stick_to_primary(response):
+    """Keeps a client that wrote on the primary so it reads its own writes"""
+    sticky = app.config["REPLICA_STICKY_SECONDS"]
+    if (
+        replicas.replicas
+        and request.method not in ("GET", "HEAD", "OPTIONS")
+        and response.status_code < 400
+    ):
+        response.set_cookie(
+            PRIMARY_COOKIE,
+            f"{time.time() + sticky:.3f}",
+            max_age=max(int(sticky), 1),
+            httponly=True,
+        )
+    return response
+
+
 ######################################################################
 # Configure the Root route before OpenAPI
 ######################################################################
@@ -37,6 +287,9 @@ def index():
     return app.send_static_file("index.html")
 
 
+# Media type of the streamed export of the collection
+NDJSON = "application/x-ndjson"
+
 # Define the model so that the docs reflect what can be sent
 create_model = api.model(
     "Recommendation",
@@ -74,35 +327,138 @@ rec_model = api.inherit(
     },
 )
 
-# query string arguments
-rec_args = reqparse.RequestParser()
-rec_args.add_argument(
+ranked_model = api.inherit(
+    "RankedRecommendationModel",
+    rec_model,
+    {
+        "score": fields.Float(
+            readOnly=True,
+            description="The ranking score (Wilson lower bound of likes vs dislikes)",
+        ),
+    },
+)
+
+snapshot_model = api.model(
+    "ProductSnapshotModel",
+    {
+        "source_pid": fields.Integer(description="The id of the product"),
+        "recommendations": fields.Nested(
+            api.model(
+                "SnapshotGroupsModel",
+                {
+                    rec_type.name: fields.List(fields.Nested(rec_model))
+                    for rec_type in RecommendationType
+                },
+            ),
+            description="The Recommendations of the product by type, best ranked first",
+        ),
+    },
+)
+
+# query string arguments that select Recommendations
+filter_args = reqparse.RequestParser()
+filter_args.add_argument(
     "name",
     type=str,
     location="args",
     required=False,
-    help="List Recommendations by their source product name",
+    help="Filter Recommendations by their source product name",
 )
-rec_args.add_argument(
+filter_args.add_argument(
     "source_pid",
     type=int,
     location="args",
     required=False,
-    help="List Recommendations by their source product id",
+    help="Filter Recommendations by their source product id",
 )
-rec_args.add_argument(
+filter_args.add_argument(
     "recommendation_name",
     type=str,
     location="args",
     required=False,
-    help="List Recommendations by its name",
+    help="Filter Recommendations by its name",
+)
+filter_args.add_argument(
+    "type",
+    type=str,
+    location="args",
+    required=False,
+    help="Filter Recommendations by its type",
+)
+
+# query string arguments for listing Recommendations
+rec_args = filter_args.copy()
+for counter in ("likes", "dislikes"):
+    rec_args.add_argument(
+        f"min_{counter}",
+        type=int,
+        location="args",
+        required=False,
+        help=f"List Recommendations with at least this number of {counter}",
+    )
+    rec_args.add_argument(
+        f"max_{counter}",
+        type=int,
+        location="args",
+        required=False,
+        help=f"List Recommendations with at most this number of {counter}",
+    )
+rec_args.add_argument(
+    "sort",
+    type=str,
+    location="args",
+    required=False,
+    default="rec_id",
+    choices=SORT_KEYS,
+    help="The field to order Recommendations by",
+)
+rec_args.add_argument(
+    "order",
+    type=str,
+    location="args",
+    required=False,
+    default="asc",
+    choices=("asc", "desc"),
+    help="The direction to order Recommendations in",
+)
+rec_args.add_argument(
+    "limit",
+    type=int,
+    location="args",
+    required=False,
+    help="The most Recommendations to return on one page",
 )
 rec_args.add_argument(
+    "cursor",
+    type=str,
+    location="args",
+    required=False,
+    help="The cursor of the page to return, taken from the previous page",
+)
+rec_args.add_argument(
+    "stream",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    help="Stream every matching Recommendation as NDJSON instead of one page",
+)
+
+# query string arguments for the best Recommendations of a product
+top_args = reqparse.RequestParser()
+top_args.add_argument(
+    "k",
+    type=int,
+    location="args",
+    required=False,
+    default=10,
+    help="The number of Recommendations to return",
+)
+top_args.add_argument(
     "type",
     type=str,
     location="args",
     required=False,
-    help="List Recommendations by its type",
+    help="Only return Recommendations of this type",
 )
 
 
@@ -127,23 +483,32 @@ class RecommendationResource(Resource):
     # RETRIEVE A RECOMMENDATION
     # ------------------------------------------------------------------
     @api.doc("get_recs")
+    @api.response(200, "Success", rec_model)
+    @api.response(304, "Recommendation not modified since the If-None-Match ETag")
     @api.response(404, "Recommendation not found")
-    @api.marshal_with(rec_model)
     def get(self, rec_id):
         """This will retrieve a single recommendation based on its id"""
         app.logger.info("Request for recommendation with id [%s]", rec_id)
-        recommendation = Recommendation.find(rec_id)
-        if not recommendation:
+        found = Recommendation.find_serialized(rec_id)
+        if not found:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Recommendation with id '{rec_id}' was not found.",
             )
+        recommendation, version = found
+        etag = str(version)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
 
         app.logger.info(
-            "Returning recommendation: %s", recommendation.recommendation_name
+            "Returning recommendation: %s", recommendation["recommendation_name"]
         )
 
-        return recommendation.serialize(), status.HTTP_200_OK
+        return (
+            marshal(recommendation, rec_model),
+            status.HTTP_200_OK,
+            {"ETag": quote_etag(etag)},
+        )
 
     # ------------------------------------------------------------------
     # UPDATE A RECOMMENDATION
@@ -151,23 +516,37 @@ class RecommendationResource(Resource):
     @api.doc("update_recs")
     @api.response(404, "Recommendation not found")
     @api.response(400, "The posted Recommendation data was not valid")
+    @api.response(412, "Recommendation changed since the If-Match ETag")
     @api.expect(rec_model)
     @api.marshal_with(rec_model)
     def put(self, rec_id):
         """This will update a recommendation given a recommendation id"""
         app.logger.info("Update a recommendation with id: %s", rec_id)
-        recommendation = Recommendation.find(rec_id)
+        if request.if_match:
+            # lock the row so nobody can change it between the check and the update
+            recommendation = Recommendation.find_for_update(rec_id)
+        else:
+            recommendation = Recommendation.find(rec_id)
         if recommendation is None:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Recommendation with id '{rec_id}' does not exist",
             )
+        if request.if_match and not request.if_match.contains(str(recommendation.version)):
+            abort(
+                status.HTTP_412_PRECONDITION_FAILED,
+                f"Recommendation with id '{rec_id}' was changed by someone else",
+            )
         app.logger.debug("Payload = %s", api.payload)
         data = api.payload
         recommendation.deserialize(data)
         recommendation.rec_id = rec_id
         recommendation.update()
-        return recommendation.serialize(), status.HTTP_200_OK
+        return (
+            recommendation.serialize(),
+            status.HTTP_200_OK,
+            {"ETag": quote_etag(str(recommendation.version))},
+        )
 
     # ------------------------------------------------------------------
     # DELETE A RECOMMENDATION
@@ -200,42 +579,83 @@ class RecommendationCollection(Resource):
     # LIST ALL RECOMMENDATIONS
     # ------------------------------------------------------------------
     @api.doc("list_recs")
+    @api.response(200, "Success", [rec_model])
+    @api.response(304, "Recommendations not modified since the If-None-Match ETag")
+    @api.response(400, "The cursor or limit was not valid")
+    @api.produces(["application/json", NDJSON])
     @api.expect(rec_args, validate=True)
-    @api.marshal_list_with(rec_model)
     def get(self):  # this was list_all
         """This will list all recommendations in the database.
         Returns: a list of recommendations
         """
         app.logger.info("Request to list all recommendations...")
 
-        recommendations = []
         args = rec_args.parse_args()
+        recommendations = find_recommendations(args)
+
+        if args["stream"] or wants_ndjson():
+            return stream_recommendations(recommendations)
+
+        limit = args["limit"]
+        if limit is None:
+            limit = app.config["DEFAULT_PAGE_SIZE"]
+        limit = min(limit, app.config["MAX_PAGE_SIZE"])
+        if limit < 1:
+            abort(status.HTTP_400_BAD_REQUEST, "limit must be a positive number")
+        descending = args["order"] == "desc"
+        recommendations, last = Recommendation.paginate(
+            recommendations,
+            limit,
+            after=decode_cursor(args["cursor"], args["sort"], descending),
+            sort=args["sort"],
+            descending=descending,
+        )
+        next_cursor = None if last is None else encode_cursor(last, args["sort"], descending)
+        etag = Recommendation.page_tag(recommendations, next_cursor)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag, weak=True)
+        results = [recommendation.serialize() for recommendation in recommendations]
 
-        if args["name"]:
-            app.logger.info("Find by source product name: %s", args["name"])
-            recommendations = Recommendation.find_by_name(args["name"])
-        elif args["source_pid"]:
-            app.logger.info("Find by source product id: %s", args["source_pid"])
-            recommendations = Recommendation.find_by_source_pid(args["source_pid"])
-        elif args["recommendation_name"]:
-            app.logger.info(
-                "Find by recommendation name: %s", args["recommendation_name"]
-            )
-            recommendations = Recommendation.find_by_rec_name(
-                args["recommendation_name"]
+        headers = {"ETag": quote_etag(etag, weak=True)}
+        if next_cursor is not None:
+            query = dict(request.args, cursor=next_cursor)
+            next_url = api.url_for(RecommendationCollection, _external=True, **query)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+            headers["X-Next-Cursor"] = next_cursor
+
+        if app.config["FAST_JSON"]:
+            # serialize() already has exactly the fields of rec_model
+            return Response(
+                orjson.dumps(results),
+                status=status.HTTP_200_OK,
+                headers=headers,
+                mimetype="application/json",
             )
-        elif args["type"]:
-            app.logger.info("Find by type: %s", args["type"])
-            # create enum from string
-            type_value = getattr(RecommendationType, args["type"].upper())
-            recommendations = Recommendation.find_by_type(type_value)
-        else:
-            app.logger.info("Find all")
-            recommendations = Recommendation.all()
+        return marshal(results, rec_model), status.HTTP_200_OK, headers
 
-        results = [recommendation.serialize() for recommendation in recommendations]
+    # ------------------------------------------------------------------
+    # DELETE ALL MATCHING RECOMMENDATIONS
+    # ------------------------------------------------------------------
+    @api.doc("delete_matching_recs")
+    @api.response(200, "Matching Recommendations deleted")
+    @api.response(400, "No filter or a bad filter was given")
+    @api.expect(filter_args, validate=True)
+    def delete(self):
+        """This deletes every recommendation matching all of the filters given"""
+        app.logger.info("Request to delete matching recommendations...")
+        args = filter_args.parse_args()
+        criteria = {key: value for key, value in args.items() if value is not None}
+        if not criteria:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "At least one filter is required to delete recommendations",
+            )
+        if "type" in criteria:
+            criteria["type"] = parse_type(criteria["type"])
 
-        return results, status.HTTP_200_OK
+        deleted = Recommendation.delete_matching(**criteria)
+        app.logger.info("%d recommendations matching %s deleted", deleted, criteria)
+        return {"deleted": deleted}, status.HTTP_200_OK
 
     # ------------------------------------------------------------------
     # CREATE A NEW RECOMMENDATION
@@ -265,6 +685,100 @@ class RecommendationCollection(Resource):
         )
 
 
+######################################################################
+#  PATH: /recommendations/bulk
+######################################################################
+@api.route("/recommendations/bulk")
+class BulkRecommendationCollection(Resource):
+    """Handles creating many Recommendations in one request"""
+
+    # ------------------------------------------------------------------
+    # CREATE MANY RECOMMENDATIONS
+    # ------------------------------------------------------------------
+    @api.doc("bulk_create_recs")
+    @api.response(201, "Recommendations created")
+    @api.response(400, "None of the posted Recommendations were valid")
+    @api.response(415, "The body was not a JSON array or NDJSON")
+    @api.expect([create_model])
+    def post(self):
+        """This creates many recommendations from a JSON array or NDJSON body"""
+        app.logger.info("Request to Bulk Create Recommendations...")
+        recommendations, errors = deserialize_bulk(read_bulk_payload())
+
+        if errors and not recommendations:
+            return {"rec_ids": [], "errors": errors}, status.HTTP_400_BAD_REQUEST
+
+        rec_ids = Recommendation.create_many(
+            recommendations, app.config["BULK_BATCH_SIZE"]
+        )
+        app.logger.info(
+            "%d Recommendations created, %d rejected", len(rec_ids), len(errors)
+        )
+        return {"rec_ids": rec_ids, "errors": errors}, status.HTTP_201_CREATED
+
+
+######################################################################
+#  PATH: /products/{source_pid}/top
+######################################################################
+@api.route("/products/<int:source_pid>/top")
+@api.param("source_pid", "The product identifier")
+class TopRecommendationCollection(Resource):
+    """The best ranked Recommendations of a product"""
+
+    @api.doc("top_recs")
+    @api.response(200, "Success", [ranked_model])
+    @api.response(304, "Recommendations not modified since the If-None-Match ETag")
+    @api.response(400, "k or type was not valid")
+    @api.expect(top_args, validate=True)
+    def get(self, source_pid):
+        """This returns the k highest scored recommendations for a product"""
+        app.logger.info("Request for the top recommendations of product %s", source_pid)
+        args = top_args.parse_args()
+        limit = min(args["k"], app.config["MAX_PAGE_SIZE"])
+        if limit < 1:
+            abort(status.HTTP_400_BAD_REQUEST, "k must be a positive number")
+        rec_type = parse_type(args["type"]) if args["type"] else None
+
+        recommendations = Recommendation.find_top(source_pid, limit, rec_type)
+        etag = Recommendation.page_tag(recommendations)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag, weak=True)
+        results = [
+            dict(recommendation.serialize(), score=recommendation.score)
+            for recommendation in recommendations
+        ]
+        return (
+            marshal(results, ranked_model),
+            status.HTTP_200_OK,
+            {"ETag": quote_etag(etag, weak=True)},
+        )
+
+
+######################################################################
+#  PATH: /products/{source_pid}/recommendations
+######################################################################
+@api.route("/products/<int:source_pid>/recommendations")
+@api.param("source_pid", "The product identifier")
+class ProductSnapshotResource(Resource):
+    """Every Recommendation of a product in one pre-serialized document"""
+
+    @api.doc("product_snapshot")
+    @api.response(200, "Success", snapshot_model)
+    def get(self, source_pid):
+        """
+        Retrieve every Recommendation of a product
+
+        The document is kept serialized in the database, so it is returned
+        without building a Recommendation for any of the rows
+        """
+        app.logger.info("Request for the snapshot of product %s", source_pid)
+        return Response(
+            Recommendation.find_snapshot(source_pid),
+            status=status.HTTP_200_OK,
+            mimetype="application/json",
+        )
+
+
 ######################################################################
 #  PATH: /recommendations/{id}/like
 ######################################################################
@@ -275,22 +789,27 @@ class LikeResource(Resource):
 
     @api.doc("like_recommendations")
     @api.response(200, "Action recorded")
+    @api.response(202, "Action buffered and pending")
     @api.response(404, "Recommendation not found")
     def put(self, rec_id):
         """Liking a Recommendation increments its like count"""
         app.logger.info("Request to Like a Recommendation")
-        recommendation = Recommendation.find(rec_id)
+        if app.config["VOTE_BUFFER_ENABLED"]:
+            return buffer_vote(rec_id, likes=1)
+        recommendation = Recommendation.like(rec_id)
         if not recommendation:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"recommendation with id '{rec_id}' was not found.",
             )
-        recommendation.number_of_likes += 1
-        recommendation.update()
         app.logger.info(
             "Recommendation with id [%s] has been liked!", recommendation.rec_id
         )
-        return recommendation.serialize(), status.HTTP_200_OK
+        return (
+            recommendation.serialize(),
+            status.HTTP_200_OK,
+            {"ETag": quote_etag(str(recommendation.version))},
+        )
 
 
 ######################################################################
@@ -303,19 +822,189 @@ class DislikeResource(Resource):
 
     @api.doc("dislike_recommendations")
     @api.response(200, "Action recorded")
+    @api.response(202, "Action buffered and pending")
     @api.response(404, "Recommendation not found")
     def put(self, rec_id):
         """Disliking a Recommendation decrements its like count"""
         app.logger.info("Request to Dislike a Recommendation")
-        recommendation = Recommendation.find(rec_id)
+        if app.config["VOTE_BUFFER_ENABLED"]:
+            return buffer_vote(rec_id, dislikes=1)
+        recommendation = Recommendation.dislike(rec_id)
         if not recommendation:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"recommendation with id '{rec_id}' was not found.",
             )
-        recommendation.number_of_dislikes += 1
-        recommendation.update()
         app.logger.info(
             "Recommendation with id [%s] has been disliked!", recommendation.rec_id
         )
-        return recommendation.serialize(), status.HTTP_200_OK
+        return (
+            recommendation.serialize(),
+            status.HTTP_200_OK,
+            {"ETag": quote_etag(str(recommendation.version))},
+        )
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def buffer_vote(rec_id, likes=0, dislikes=0):
+    """Adds a vote to the vote buffer and reports what is still pending
+
+    The Recommendation is not read: votes for one that does not exist are
+    dropped when the buffer is flushed.
+    """
+    try:
+        rec_id = int(rec_id)
+    except ValueError:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"recommendation with id '{rec_id}' was not found.",
+        )
+    pending_likes, pending_dislikes = vote_buffer.add(rec_id, likes=likes, dislikes=dislikes)
+    app.logger.info("Vote for Recommendation with id [%s] buffered", rec_id)
+    return (
+        {"rec_id": rec_id, "pending_likes": pending_likes, "pending_dislikes": pending_dislikes},
+        status.HTTP_202_ACCEPTED,
+    )
+
+
+def find_recommendations(args):
+    """Returns the select_records() for the Recommendations matching all of the list filters"""
+    criteria = {
+        name: args[name]
+        for name in (
+            "name",
+            "source_pid",
+            "recommendation_name",
+            "min_likes",
+            "max_likes",
+            "min_dislikes",
+            "max_dislikes",
+        )
+        if args.get(name) is not None
+    }
+    if args.get("type"):
+        criteria["type"] = parse_type(args["type"])
+    app.logger.info("Find by %s", criteria or "nothing (all)")
+    return Recommendation.select_records(**criteria)
+
+
+def parse_type(value: str) -> RecommendationType:
+    """Turns a type name from the query string into a RecommendationType"""
+    try:
+        return RecommendationType[value.upper()]
+    except KeyError:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid Recommendation type: {value}")
+    return None
+
+
+def not_modified(etag: str, weak: bool = False) -> Response:
+    """Returns an empty 304 Not Modified response for an entity tag"""
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag, weak)
+    return response
+
+
+def wants_ndjson() -> bool:
+    """Checks if the client asked for NDJSON in its Accept header"""
+    return request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+
+
+def stream_recommendations(statement):
+    """Streams the Recommendations of a query as one JSON document per line
+
+    Rows are read from a server-side cursor in chunks of STREAM_CHUNK_SIZE
+    so memory use does not grow with the size of the result.
+    """
+    app.logger.info("Streaming recommendations as NDJSON")
+    chunk_size = app.config["STREAM_CHUNK_SIZE"]
+
+    fast = app.config["FAST_JSON"]
+
+    def generate():
+        for recommendation in Recommendation.stream(statement, chunk_size):
+            if fast:
+                yield orjson.dumps(recommendation.serialize(), option=orjson.OPT_APPEND_NEWLINE)
+            else:
+                yield json.dumps(recommendation.serialize()) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+
+def read_bulk_payload() -> list:
+    """Returns the items of a JSON array or NDJSON request body"""
+    return parse_bulk_payload(request.mimetype, request.get_data())
+
+
+def parse_bulk_payload(mimetype: str, body: bytes) -> list:
+    """Returns the items of a JSON array or NDJSON body
+
+    NDJSON lines that are not valid JSON come back as None so they are
+    reported as errors against their own index
+    """
+    if mimetype == NDJSON:
+        items = []
+        for line in body.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+    if mimetype == "application/json":
+        try:
+            items = json.loads(body)
+        except ValueError:
+            items = None
+        if not isinstance(items, list):
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "Bulk create expects a JSON array of Recommendations",
+            )
+        return items
+    abort(
+        status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        f"Content-Type must be application/json or {NDJSON}",
+    )
+    return []
+
+
+def deserialize_bulk(items: list) -> tuple:
+    """Deserializes the items of a bulk create
+
+    Returns:
+        tuple: the valid Recommendations and an error for each invalid item
+    """
+    recommendations = []
+    errors = []
+    for index, data in enumerate(items):
+        try:
+            recommendations.append(Recommendation().deserialize(data).validate())
+        except DataValidationError as error:
+            errors.append({"index": index, "message": str(error)})
+    return recommendations, errors
+
+
+def encode_cursor(last: tuple, sort: str, descending: bool) -> str:
+    """Turns the position of the last row of a page into an opaque cursor"""
+    key, rec_id = last
+    data = {"sort": sort, "desc": descending, "key": key, "rec_id": rec_id}
+    encoded = json.dumps(data).encode("utf-8")
+    return base64.urlsafe_b64encode(encoded).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, descending: bool):
+    """Turns a cursor back into the (sort value, rec_id) to continue after"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if data["sort"] != sort or data["desc"] != descending:
+            raise ValueError("the cursor belongs to a different sort order")
+        return int(data["key"]), int(data["rec_id"])
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError) as error:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid cursor: {error}")
+    return None
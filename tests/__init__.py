@@ -0,0 +1,9 @@
+"""
+Tests for the Recommendation service
+
+The test database is migrated by the app itself when it is imported, as
+no "flask db-upgrade" runs before the tests.
+"""
+import os
+
+os.environ.setdefault("DB_UPGRADE_ON_STARTUP", "true")
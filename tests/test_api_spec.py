@@ -0,0 +1,62 @@
+"""
+Test cases for the cached OpenAPI document
+"""
+import gzip
+import json
+from unittest import TestCase
+from flask import Flask
+from flask_restx import Api, Resource
+from service.common.api_spec import ApiSpec
+
+
+def make_api(title: str) -> Api:
+    """Returns an Api with one resource"""
+    api = Api(Flask(__name__), title=title, doc=False, prefix="/api")
+
+    @api.route("/things")
+    class Things(Resource):  # pylint: disable=unused-variable
+        """A resource to document"""
+
+        def get(self):
+            """Lists the things"""
+            return []
+
+    return api
+
+
+class TestApiSpec(TestCase):
+    """OpenAPI Document Tests"""
+
+    def setUp(self):
+        self.api_spec = ApiSpec(make_api("Things"))
+
+    def test_document(self):
+        """It should serialize the schema of the Api"""
+        body, etag = self.api_spec.document()
+        schema = json.loads(body)
+        self.assertEqual(schema["info"]["title"], "Things")
+        self.assertEqual(schema["basePath"], "/api")
+        self.assertIn("/things", schema["paths"])
+        self.assertTrue(etag)
+
+    def test_gzipped_document(self):
+        """It should compress the same body under a tag of its own"""
+        body, etag = self.api_spec.document()
+        compressed, gzip_etag = self.api_spec.document(gzipped=True)
+        self.assertEqual(gzip.decompress(compressed), body)
+        self.assertLess(len(compressed), len(body))
+        self.assertNotEqual(gzip_etag, etag)
+
+    def test_built_once(self):
+        """It should return the same document every time"""
+        body, etag = self.api_spec.document()
+        self.assertIs(self.api_spec.document()[0], body)
+        self.assertEqual(ApiSpec(make_api("Things")).document(), (body, etag))
+
+    def test_configure(self):
+        """It should build the document of a new Api"""
+        _, etag = self.api_spec.document()
+        self.api_spec.configure(make_api("Other things"))
+        body, new_etag = self.api_spec.document()
+        self.assertEqual(json.loads(body)["info"]["title"], "Other things")
+        self.assertNotEqual(new_etag, etag)
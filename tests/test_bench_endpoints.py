@@ -0,0 +1,55 @@
+"""
+Test cases for the regression gate of the endpoint benchmark
+"""
+from unittest import TestCase
+from benchmarks.bench_endpoints import compare
+
+
+def results(rps: float, p95_ms: float, errors: int = 0, scenario: str = "get", concurrency: str = "8") -> dict:
+    """Returns the results of a run with one scenario at one concurrency level"""
+    level = {"rps": rps, "p50_ms": p95_ms / 2, "p95_ms": p95_ms, "p99_ms": p95_ms * 2, "errors": errors}
+    return {"scenarios": {scenario: {concurrency: level}}}
+
+
+class TestCompare(TestCase):
+    """Endpoint Benchmark Regression Gate Tests"""
+
+    def setUp(self):
+        self.baseline = results(rps=1000, p95_ms=10)
+
+    def test_within_tolerance(self):
+        """It should pass changes within the tolerance and any improvement"""
+        for current in [
+            results(rps=1000, p95_ms=10),
+            results(rps=910, p95_ms=10.9),
+            results(rps=2000, p95_ms=5),
+        ]:
+            self.assertEqual(compare(self.baseline, current, tolerance=0.1), [])
+
+    def test_lower_throughput(self):
+        """It should fail when the throughput drops past the tolerance"""
+        regressions = compare(self.baseline, results(rps=850, p95_ms=10), tolerance=0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("get x8: rps 850.0, was 1000.0 (-15%)", regressions[0])
+
+    def test_slower_p95(self):
+        """It should fail when the p95 latency grows past the tolerance"""
+        regressions = compare(self.baseline, results(rps=1000, p95_ms=12), tolerance=0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("p95_ms", regressions[0])
+        self.assertEqual(compare(self.baseline, results(rps=1000, p95_ms=12), tolerance=0.25), [])
+
+    def test_new_errors(self):
+        """It should fail on errors the baseline did not have"""
+        regressions = compare(self.baseline, results(rps=1000, p95_ms=10, errors=3))
+        self.assertEqual(regressions, ["get x8: 3 errors, was none"])
+        baseline = results(rps=1000, p95_ms=10, errors=1)
+        self.assertEqual(compare(baseline, results(rps=1000, p95_ms=10, errors=3)), [])
+
+    def test_unmatched_results(self):
+        """It should skip scenarios and levels missing from the baseline, and fields without a value"""
+        self.assertEqual(compare(self.baseline, results(rps=1, p95_ms=100, scenario="list")), [])
+        self.assertEqual(compare(self.baseline, results(rps=1, p95_ms=100, concurrency="32")), [])
+        current = results(rps=1000, p95_ms=10)
+        current["scenarios"]["get"]["8"]["p95_ms"] = None
+        self.assertEqual(compare(self.baseline, current), [])
@@ -0,0 +1,80 @@
+"""
+Test cases for the LRU Cache
+"""
+import time
+from unittest import TestCase
+from service.common.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    """LRU Cache Tests"""
+
+    def setUp(self):
+        self.cache = LRUCache(maxsize=2, ttl=60)
+
+    def test_get_and_set(self):
+        """It should return what was cached and count hits and misses"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, {"rec_id": 1})
+        self.assertEqual(self.cache.get(1), {"rec_id": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.get(1)
+        self.cache.set(3, "three")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertEqual(self.cache.get(3), "three")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expires_entries(self):
+        """It should not return entries older than the time to live"""
+        self.cache.configure(maxsize=2, ttl=0.01)
+        self.cache.set(1, "one")
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_invalidate(self):
+        """It should drop invalidated entries"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.invalidate(1, 3)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "two")
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+
+    def test_stale_set_is_dropped(self):
+        """It should not cache a value loaded before the key was invalidated"""
+        token = self.cache.token()
+        self.cache.invalidate(1)
+        self.cache.set(1, "stale", token)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(2, "fresh", token)
+        self.assertEqual(self.cache.get(2), "fresh")
+        token = self.cache.token()
+        self.cache.set(1, "fresh", token)
+        self.assertEqual(self.cache.get(1), "fresh")
+
+    def test_forgotten_invalidation_is_stale(self):
+        """It should drop values when it can no longer tell if they are stale"""
+        token = self.cache.token()
+        self.cache.invalidate(1)
+        self.cache.invalidate(2)
+        self.cache.invalidate(3)
+        self.cache.set(1, "maybe stale", token)
+        self.assertIsNone(self.cache.get(1))
+
+    def test_disabled(self):
+        """It should not cache anything when its size is 0"""
+        self.cache.configure(maxsize=0, ttl=60)
+        self.cache.set(1, "one")
+        self.assertIsNone(self.cache.get(1))
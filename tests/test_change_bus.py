@@ -0,0 +1,81 @@
+"""
+Test cases for cross-worker cache invalidation over the Change Bus
+"""
+import queue
+from unittest import TestCase
+from service.common.change_bus import MAX_PAYLOAD, ChangeBus, decode, encode
+from service.models import Recommendation, db, rec_cache
+from tests.factories import RecommendationFactory
+
+
+class TestChangeBus(TestCase):
+    """Change Bus Tests"""
+
+    def setUp(self):
+        self.changes = queue.Queue()
+        self.bus = ChangeBus(poll_interval=0.05)
+        self.bus.subscribe(self.changes.put)
+
+    def tearDown(self):
+        self.bus.stop()
+        db.session.rollback()
+
+    def _next_change(self):
+        """Returns the next rec_ids delivered to the subscriber"""
+        return self.changes.get(timeout=5)
+
+    def test_encode_splits_payloads(self):
+        """It should pack rec_ids into payloads Postgres will accept"""
+        rec_ids = list(range(1000000, 1005000))
+        payloads = encode(rec_ids)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload) <= MAX_PAYLOAD for payload in payloads))
+        decoded = [rec_id for payload in payloads for rec_id in decode(payload)]
+        self.assertEqual(decoded, rec_ids)
+        self.assertIsNone(decode("1,two"))
+
+    def test_local_bus(self):
+        """It should hand changes straight to the subscribers without an engine"""
+        self.bus.publish(db.session, [1, 2])
+        self.assertEqual(self._next_change(), [1, 2])
+        self.bus.publish(db.session, [])
+        self.assertTrue(self.changes.empty())
+
+    def test_postgres_bus(self):
+        """It should deliver committed changes to listeners in other workers"""
+        self.bus.configure(db.engine, "test_recommendation_changes")
+        self.bus.start()
+        # a fresh listener may have missed earlier changes
+        self.assertIsNone(self._next_change())
+
+        self.bus.publish(db.session, [7])
+        db.session.rollback()
+        self.bus.publish(db.session, [8, 9])
+        db.session.commit()
+        self.assertEqual(self._next_change(), [8, 9])
+        self.assertTrue(self.changes.empty())
+
+    def test_writes_evict_in_other_workers(self):
+        """It should evict a Recommendation from other workers when it changes"""
+        other_cache = {}
+        self.bus.configure(db.engine, Recommendation.app.config["CACHE_INVALIDATION_CHANNEL"])
+        self.bus.subscribe(lambda rec_ids: [other_cache.pop(rec_id, None) for rec_id in rec_ids or []])
+        self.bus.start()
+        self.assertIsNone(self._next_change())
+
+        recommendation = RecommendationFactory()
+        recommendation.create()
+        self.assertEqual(self._next_change(), [recommendation.rec_id])
+        other_cache[recommendation.rec_id] = recommendation.serialize()
+        rec_cache.set(recommendation.rec_id, recommendation.serialize())
+
+        Recommendation.like(recommendation.rec_id)
+        self.assertEqual(self._next_change(), [recommendation.rec_id])
+        self.assertNotIn(recommendation.rec_id, other_cache)
+        self.assertIsNone(rec_cache.get(recommendation.rec_id))
+
+        Recommendation.apply_votes({recommendation.rec_id: (1, 0)})
+        self.assertEqual(self._next_change(), [recommendation.rec_id])
+        recommendation = Recommendation.find(recommendation.rec_id)
+        recommendation.delete()
+        self.assertEqual(self._next_change(), [recommendation.rec_id])
@@ -5,7 +5,7 @@ import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service.common.cli_commands import db_create, db_upgrade, replay
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +21,40 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.migrations')
+    def test_db_upgrade(self, migrations_mock):
+        """It should apply the pending migrations with the db-upgrade command"""
+        migrations_mock.upgrade.return_value = [4, 5]
+        result = self.runner.invoke(db_upgrade)
+        self.assertEqual(result.exit_code, 0)
+        migrations_mock.upgrade.assert_called_once()
+        self.assertIn("Applied schema versions 004, 005", result.output)
+
+    @patch('service.common.cli_commands.migrations')
+    def test_db_upgrade_up_to_date(self, migrations_mock):
+        """It should say when the schema is already up to date"""
+        migrations_mock.upgrade.return_value = []
+        migrations_mock.latest_version.return_value = 5
+        result = self.runner.invoke(db_upgrade)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("up to date at version 005", result.output)
+
+    @patch('service.common.cli_commands.traffic_capture.replay')
+    @patch('service.common.cli_commands.traffic_capture.read_captures')
+    def test_replay(self, read_mock, replay_mock):
+        """It should replay a capture and report the change in latency"""
+        read_mock.return_value = [
+            {"ts": 1.0, "method": "GET"},
+            {"ts": 2.0, "method": "DELETE"},
+        ]
+        replay_mock.return_value = [
+            {"captured_status": 200, "captured_ms": 10.0, "status": 200, "ms": 15.0, "error": None},
+        ]
+        result = self.runner.invoke(
+            replay, ["captures", "--target", "http://service:8080", "--speed", "0", "--read-only"]
+        )
+        self.assertEqual(result.exit_code, 0)
+        replay_mock.assert_called_once_with([{"ts": 1.0, "method": "GET"}], "http://service:8080", 0.0, 8)
+        self.assertIn("1 requests, 0 errors", result.output)
+        self.assertIn("+50%", result.output)
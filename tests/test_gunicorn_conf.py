@@ -0,0 +1,110 @@
+"""
+Test cases for the Gunicorn configuration
+"""
+import importlib.util
+import os
+import tempfile
+from unittest import TestCase, mock
+from service.models import db
+
+CONF_PATH = os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py")
+
+
+def load_conf():
+    """Loads gunicorn.conf.py like gunicorn does, with a metrics directory of its own"""
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF_PATH)
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": tempfile.mkdtemp()}):
+        spec.loader.exec_module(module)
+    return module
+
+
+class TestGunicornConf(TestCase):
+    """Gunicorn Configuration Tests"""
+
+    def setUp(self):
+        self.conf = load_conf()
+        self.cpus = len(os.sched_getaffinity(0))
+
+    def _cgroup(self, files: dict) -> str:
+        """Returns a directory with cgroup files in it"""
+        root = tempfile.mkdtemp()
+        for name, content in files.items():
+            path = os.path.join(root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="ascii") as file:
+                file.write(content)
+        return root
+
+    def test_cpu_limit_cgroup_v2(self):
+        """It should read the CPU quota of cgroup v2"""
+        root = self._cgroup({"cpu.max": "50000 100000\n"})
+        self.assertEqual(self.conf.cpu_limit(root), min(0.5, self.cpus))
+        root = self._cgroup({"cpu.max": "max 100000\n"})
+        self.assertEqual(self.conf.cpu_limit(root), self.cpus)
+
+    def test_cpu_limit_cgroup_v1(self):
+        """It should read the CPU quota of cgroup v1"""
+        root = self._cgroup({"cpu/cpu.cfs_quota_us": "25000\n", "cpu/cpu.cfs_period_us": "100000\n"})
+        self.assertEqual(self.conf.cpu_limit(root), min(0.25, self.cpus))
+        root = self._cgroup({"cpu/cpu.cfs_quota_us": "-1\n", "cpu/cpu.cfs_period_us": "100000\n"})
+        self.assertEqual(self.conf.cpu_limit(root), self.cpus)
+
+    def test_cpu_limit_without_cgroup(self):
+        """It should use the CPUs it can run on without a cgroup limit"""
+        self.assertEqual(self.conf.cpu_limit(tempfile.mkdtemp()), self.cpus)
+
+    @mock.patch.dict(os.environ, {"GUNICORN_WORKER_CLASS": "", "WEB_CONCURRENCY": "", "GUNICORN_THREADS": ""})
+    def test_worker_settings(self):
+        """It should pick the worker class and count from the CPUs"""
+        self.assertEqual(self.conf.worker_settings(0.5), ("gthread", 1, 4))
+        self.assertEqual(self.conf.worker_settings(1.5), ("gthread", 1, 4))
+        self.assertEqual(self.conf.worker_settings(4), ("sync", 9, 1))
+
+    @mock.patch.dict(os.environ, {"GUNICORN_WORKER_CLASS": "sync", "WEB_CONCURRENCY": "3", "GUNICORN_THREADS": ""})
+    def test_worker_settings_from_env(self):
+        """It should let the environment override the worker settings"""
+        self.assertEqual(self.conf.worker_settings(0.5), ("sync", 3, 1))
+
+    def test_fork_hooks(self):
+        """It should empty the connection pools around the fork"""
+        server, worker = mock.Mock(), mock.Mock(pid=1)
+        self.conf.preload_app = True
+        with db.engine.connect():
+            pass
+        self.assertGreater(db.engine.pool.checkedin(), 0)
+        self.conf.when_ready(server)
+        self.assertEqual(db.engine.pool.checkedin(), 0)
+        with db.engine.connect():
+            pass
+        self.conf.post_fork(server, worker)
+        self.assertEqual(db.engine.pool.checkedin(), 0)
+
+    def test_metrics_dir(self):
+        """It should empty the metrics directory of an earlier run"""
+        path = tempfile.mkdtemp()
+        for name in ("counter_1.db", "gauge_livesum_1.db", "notes.txt"):
+            with open(os.path.join(path, name), "w", encoding="ascii"):
+                pass
+        with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": path}):
+            self.assertEqual(self.conf.metrics_dir(), path)
+        self.assertEqual(os.listdir(path), ["notes.txt"])
+
+    def test_child_exit(self):
+        """It should drop the live gauges of a worker that exited"""
+        path = tempfile.mkdtemp()
+        for name in ("counter_7.db", "gauge_livesum_7.db"):
+            with open(os.path.join(path, name), "w", encoding="ascii"):
+                pass
+        with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": path}):
+            self.conf.child_exit(mock.Mock(), mock.Mock(pid=7))
+        self.assertEqual(os.listdir(path), ["counter_7.db"])
+
+    def test_on_exit(self):
+        """It should remove the metrics directory when gunicorn stops"""
+        path = tempfile.mkdtemp()
+        with open(os.path.join(path, "counter_7.db"), "w", encoding="ascii"):
+            pass
+        with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": path}):
+            self.conf.on_exit(mock.Mock())
+        self.assertFalse(os.path.exists(path))
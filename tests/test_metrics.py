@@ -0,0 +1,80 @@
+"""
+Test cases for the Prometheus metrics
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from prometheus_client import REGISTRY
+from service.common import metrics
+
+POOL = {"checked_in": 2, "checked_out": 1, "overflow": 0, "checkouts": 10, "timeouts": 1, "wait_max_ms": 20.0}
+CACHE = {"size": 3, "hits": 5, "misses": 2, "evictions": 0, "expirations": 0, "invalidations": 1}
+
+# Two processes record a request each; the parent scrapes before and after marking the child dead
+MULTIPROCESS_SCRIPT = """
+import os
+from prometheus_client import multiprocess
+from service.common import metrics
+pid = os.fork()
+metrics.REQUESTS.labels("PUT", "LikeResource", 200).inc()
+metrics.IN_PROGRESS.labels("PUT", "LikeResource").inc()
+if pid == 0:
+    os._exit(0)
+os.waitpid(pid, 0)
+print(metrics.render()[0].decode())
+print("----")
+multiprocess.mark_process_dead(pid)
+print(metrics.render()[0].decode())
+"""
+
+
+def sample(name: str, **labels) -> float:
+    """Returns the value of a sample in this process"""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(TestCase):
+    """Metrics Tests"""
+
+    def test_update(self):
+        """It should copy the pool and cache statistics into the metrics"""
+        metrics.update(POOL, CACHE)
+        self.assertEqual(sample("db_pool_connections", state="checked_out"), 1)
+        self.assertEqual(sample("db_pool_wait_max_seconds"), 0.02)
+        self.assertEqual(sample("cache_entries"), 3)
+        checkouts = sample("db_pool_checkouts_total")
+        hits = sample("cache_events_total", event="hits")
+        metrics.update(dict(POOL, checkouts=15), dict(CACHE, hits=9))
+        self.assertEqual(sample("db_pool_checkouts_total"), checkouts + 5)
+        self.assertEqual(sample("cache_events_total", event="hits"), hits + 4)
+
+    def test_update_after_reset(self):
+        """It should count all of a worker counter that started over"""
+        metrics.update(dict(POOL, timeouts=4), CACHE)
+        timeouts = sample("db_pool_timeouts_total")
+        metrics.update(dict(POOL, timeouts=1), CACHE)
+        self.assertEqual(sample("db_pool_timeouts_total"), timeouts + 1)
+
+    def test_render(self):
+        """It should render the metrics of this process without a multiprocess directory"""
+        body, content_type = metrics.render()
+        self.assertTrue(content_type.startswith("text/plain"))
+        self.assertIn(b"# TYPE http_requests_total counter", body)
+
+    def test_multiprocess(self):
+        """It should add up the metrics of every process"""
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [sys.executable, "-c", MULTIPROCESS_SCRIPT],
+                env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory),
+                capture_output=True, text=True, check=True, timeout=60,
+            ).stdout
+        both, after_exit = output.split("----")
+        requests = 'http_requests_total{method="PUT",resource="LikeResource",status="200"}'
+        in_progress = 'http_requests_in_progress{method="PUT",resource="LikeResource"}'
+        self.assertIn(f"{requests} 2.0", both)
+        self.assertIn(f"{in_progress} 2.0", both)
+        self.assertIn(f"{requests} 2.0", after_exit)
+        self.assertIn(f"{in_progress} 1.0", after_exit)
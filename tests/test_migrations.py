@@ -0,0 +1,201 @@
+"""
+Test cases for the versioned schema migrations
+"""
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import text
+from service import app, migrations
+from service.migrations import v002_lookup_indexes, v003_ranking_score
+from service.models import db, wilson_score
+
+
+class TestMigrations(TestCase):
+    """Schema Migration Tests"""
+
+    def test_available_migrations(self):
+        """It should list the migrations in version order"""
+        versions = [version for version, _ in migrations.available()]
+        self.assertEqual(versions, sorted(versions))
+        self.assertEqual(versions[0], 1)
+        self.assertEqual(migrations.latest_version(), versions[-1])
+        for _, migration in migrations.available():
+            self.assertTrue(migration.DESCRIPTION)
+            self.assertTrue(callable(migration.upgrade))
+
+    def test_upgrade_records_versions(self):
+        """It should record every applied version"""
+        migrations.upgrade(db.engine)
+        with db.engine.connect() as connection:
+            applied = migrations.applied_versions(connection)
+        self.assertEqual(applied, {version for version, _ in migrations.available()})
+
+    def test_upgrade_is_idempotent(self):
+        """It should not apply a migration twice"""
+        migrations.upgrade(db.engine)
+        self.assertEqual(migrations.upgrade(db.engine), [])
+
+    def test_upgrade_reapplies_missing_version(self):
+        """It should apply a version that is not recorded yet"""
+        latest = migrations.latest_version()
+        with db.engine.begin() as connection:
+            connection.execute(
+                text("DELETE FROM schema_version WHERE version = :version"),
+                {"version": latest},
+            )
+        self.assertEqual(migrations.upgrade(db.engine), [latest])
+
+    def test_upgrade_commits_each_version(self):
+        """It should keep the versions applied before a migration that fails"""
+        latest = migrations.latest_version()
+        with db.engine.begin() as connection:
+            connection.execute(
+                text("DELETE FROM schema_version WHERE version = :version"),
+                {"version": latest},
+            )
+
+        def fail(connection):
+            raise RuntimeError("broken migration")
+
+        broken = SimpleNamespace(DESCRIPTION="broken", upgrade=fail)
+        with patch.object(migrations, "available", return_value=migrations.available() + [(latest + 1, broken)]):
+            self.assertRaises(RuntimeError, migrations.upgrade, db.engine)
+        self.assertEqual(migrations.pending(db.engine), [])
+
+    def test_upgrade_without_statement_timeout(self):
+        """It should run every step of a migration without the statement timeout of requests"""
+        timeouts = []
+
+        def show(connection):
+            timeouts.append(connection.execute(text("SHOW statement_timeout")).scalar())
+
+        latest = migrations.latest_version()
+        slow = SimpleNamespace(DESCRIPTION="slow", upgrade=show, upgrade_online=show)
+        with patch.object(migrations, "available", return_value=migrations.available() + [(latest + 1, slow)]):
+            try:
+                self.assertEqual(migrations.upgrade(db.engine), [latest + 1])
+            finally:
+                with db.engine.begin() as connection:
+                    connection.execute(text("DELETE FROM schema_version WHERE version = :version"), {"version": latest + 1})
+        self.assertEqual(timeouts, ["0", "0"])
+        with db.engine.connect() as connection:
+            timeout = connection.execute(text("SHOW statement_timeout")).scalar()
+        self.assertEqual(timeout, f"{app.config['DB_STATEMENT_TIMEOUT'] // 1000}s")
+
+    def test_lookup_indexes_built_online(self):
+        """It should build the lookup indexes concurrently, and no index on source_pid alone"""
+        with db.engine.begin() as connection:
+            connection.execute(text("DELETE FROM schema_version WHERE version = 2"))
+            connection.execute(text("DROP INDEX IF EXISTS ix_recommendation_name"))
+        self.assertTrue(callable(v002_lookup_indexes.upgrade_online))
+        self.assertEqual(migrations.upgrade(db.engine), [2])
+        with db.engine.connect() as connection:
+            indexes = dict(
+                connection.execute(
+                    text(
+                        "SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                        "WHERE i.indrelid = 'recommendation'::regclass"
+                    )
+                ).all()
+            )
+        for name, _ in v002_lookup_indexes.INDEXES:
+            self.assertTrue(indexes[name])
+        self.assertNotIn("ix_recommendation_source_pid", indexes)
+
+    def test_reapply_row_version(self):
+        """It should run the online steps of a migration again without harm"""
+        with db.engine.begin() as connection:
+            connection.execute(text("DELETE FROM schema_version WHERE version = 4"))
+        self.assertEqual(migrations.upgrade(db.engine), [4])
+        with db.engine.connect() as connection:
+            nullable = connection.execute(
+                text(
+                    "SELECT is_nullable FROM information_schema.columns "
+                    "WHERE table_name = 'recommendation' AND column_name = 'version'"
+                )
+            ).scalar()
+            constraints = connection.execute(
+                text("SELECT count(*) FROM pg_constraint WHERE conname = 'recommendation_version_not_null'")
+            ).scalar()
+        self.assertEqual((nullable, constraints), ("NO", 0))
+
+    def test_pending_after_upgrade(self):
+        """It should have no pending versions once upgraded"""
+        migrations.upgrade(db.engine)
+        self.assertEqual(migrations.pending(db.engine), [])
+
+    def test_pending_missing_version(self):
+        """It should report a version that is not recorded yet"""
+        latest = migrations.latest_version()
+        with db.engine.begin() as connection:
+            connection.execute(
+                text("DELETE FROM schema_version WHERE version = :version"),
+                {"version": latest},
+            )
+        self.assertEqual(migrations.pending(db.engine), [latest])
+        migrations.upgrade(db.engine)
+
+    def test_pending_without_version_table(self):
+        """It should report every version when nothing was ever applied"""
+        with db.engine.begin() as connection:
+            connection.execute(text("ALTER TABLE schema_version RENAME TO schema_version_saved"))
+        try:
+            versions = [version for version, _ in migrations.available()]
+            self.assertEqual(migrations.pending(db.engine), versions)
+        finally:
+            with db.engine.begin() as connection:
+                connection.execute(text("ALTER TABLE schema_version_saved RENAME TO schema_version"))
+
+    def test_backfill_in_batches(self):
+        """It should fill in the score of existing rows one batch at a time"""
+        votes = [(0, 0), (3, 1), (1, 4), (9, 0), (None, 2)]
+        with db.engine.begin() as connection:
+            for likes, dislikes in votes:
+                connection.execute(
+                    text(
+                        "INSERT INTO recommendation (source_pid, number_of_likes, number_of_dislikes, score) "
+                        "VALUES (765470, :likes, :dislikes, 0)"
+                    ),
+                    {"likes": likes, "dislikes": dislikes},
+                )
+        try:
+            with db.engine.connect() as connection:
+                connection.execution_options(isolation_level="AUTOCOMMIT")
+                updated = migrations.backfill(connection, v003_ranking_score.BACKFILL, batch_size=2)
+                rows = connection.execute(
+                    text(
+                        "SELECT number_of_likes, number_of_dislikes, score FROM recommendation "
+                        "WHERE source_pid = 765470"
+                    )
+                ).all()
+            self.assertGreaterEqual(updated, 4)
+            for likes, dislikes, score in rows:
+                self.assertAlmostEqual(score, wilson_score(likes, dislikes))
+        finally:
+            with db.engine.begin() as connection:
+                connection.execute(text("DELETE FROM recommendation WHERE source_pid = 765470"))
+
+    def test_create_index_concurrently(self):
+        """It should build an index outside a transaction, and build it again if it is invalid"""
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT")
+            try:
+                for _ in range(2):
+                    migrations.create_index_concurrently(
+                        connection, "ix_recommendation_migration_test", "ON recommendation (number_of_likes)"
+                    )
+                connection.execute(
+                    text(
+                        "UPDATE pg_index SET indisvalid = false "
+                        "WHERE indexrelid = 'ix_recommendation_migration_test'::regclass"
+                    )
+                )
+                migrations.create_index_concurrently(
+                    connection, "ix_recommendation_migration_test", "ON recommendation (number_of_likes)"
+                )
+                valid = connection.execute(
+                    text("SELECT indisvalid FROM pg_index WHERE indexrelid = 'ix_recommendation_migration_test'::regclass")
+                ).scalar()
+                self.assertTrue(valid)
+            finally:
+                connection.execute(text("DROP INDEX IF EXISTS ix_recommendation_migration_test"))
@@ -2,8 +2,24 @@
 Test cases for Recommendations Model
 
 """
+import json
 import unittest
-from service.models import DataValidationError, Recommendation, RecommendationType
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from sqlalchemy import text
+from service import app, migrations
+from service.models import (
+    DataValidationError,
+    Recommendation,
+    RecommendationRecord,
+    RecommendationType,
+    db,
+    snapshot_queue,
+    snapshot_table,
+    statement_stats,
+    wilson_score,
+    wilson_score_expression,
+)
 from tests.factories import RecommendationFactory
 
 
@@ -81,6 +97,22 @@ class TestRecommendationModel(unittest.TestCase):
         recommendation = Recommendation()
         self.assertRaises(DataValidationError, recommendation.deserialize, data)
 
+    def test_validate(self):
+        """It should not validate values that do not fit their columns"""
+        data = RecommendationFactory().serialize()
+        recommendation = Recommendation().deserialize(data)
+        self.assertIs(recommendation.validate(), recommendation)
+        for name, value in [
+            ("name", "x" * 64),
+            ("recommendation_name", 42),
+            ("source_pid", "not a number"),
+            ("number_of_likes", 2 ** 31),
+            ("number_of_dislikes", True),
+        ]:
+            recommendation = Recommendation().deserialize(dict(data, **{name: value}))
+            with self.assertRaisesRegex(DataValidationError, name):
+                recommendation.validate()
+
     def test_find(self):
         """It should find a recommendation by its id"""
         target = RecommendationFactory()
@@ -100,3 +132,310 @@ class TestRecommendationModel(unittest.TestCase):
 
         fetched_target = Recommendation.find(target.rec_id)
         self.assertEqual(fetched_target.source_pid, new_source_pid)
+
+    def test_writes_bump_version(self):
+        """It should give a recommendation a new version on every write"""
+        target = RecommendationFactory()
+        target.create()
+        versions = [target.version]
+        target.name = "Changed"
+        target.update()
+        versions.append(target.version)
+        versions.append(Recommendation.like(target.rec_id).version)
+        Recommendation.apply_votes({target.rec_id: (1, 1)})
+        versions.append(Recommendation.find(target.rec_id).version)
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_page_tag(self):
+        """It should tag a page by the ids and versions of its rows and the next cursor"""
+        target = RecommendationFactory()
+        target.create()
+        records = Recommendation.records(
+            db.session.execute(Recommendation.select_records().where(Recommendation.rec_id == target.rec_id))
+        )
+        etag = Recommendation.page_tag(records)
+        self.assertTrue(etag.startswith("1-"))
+        self.assertEqual(Recommendation.page_tag(records), etag)
+        self.assertNotEqual(Recommendation.page_tag(records, "next"), etag)
+        self.assertNotEqual(Recommendation.page_tag([]), etag)
+        Recommendation.like(target.rec_id)
+        records = Recommendation.records(
+            db.session.execute(Recommendation.select_records().where(Recommendation.rec_id == target.rec_id))
+        )
+        self.assertNotEqual(Recommendation.page_tag(records), etag)
+
+    def test_like(self):
+        """It should atomically increment the likes of a recommendation"""
+        target = RecommendationFactory()
+        target.create()
+        liked = Recommendation.like(target.rec_id)
+        self.assertEqual(liked.rec_id, target.rec_id)
+        self.assertEqual(liked.number_of_likes, 1)
+        self.assertEqual(liked.number_of_dislikes, 0)
+
+    def test_dislike(self):
+        """It should atomically increment the dislikes of a recommendation"""
+        target = RecommendationFactory()
+        target.create()
+        disliked = Recommendation.dislike(target.rec_id)
+        self.assertEqual(disliked.number_of_likes, 0)
+        self.assertEqual(disliked.number_of_dislikes, 1)
+
+    def test_like_not_found(self):
+        """It should return None when liking a recommendation that does not exist"""
+        self.assertIsNone(Recommendation.like(0))
+        self.assertIsNone(Recommendation.dislike(0))
+
+    def test_concurrent_votes(self):
+        """It should not lose any votes cast in parallel"""
+        target = RecommendationFactory()
+        target.create()
+        rec_id = target.rec_id
+        votes = 2000
+
+        def vote(number):
+            with app.app_context():
+                if number % 2:
+                    Recommendation.dislike(rec_id)
+                else:
+                    Recommendation.like(rec_id)
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            list(executor.map(vote, range(votes)))
+
+        with app.app_context():
+            fetched_target = Recommendation.find(rec_id)
+        self.assertEqual(fetched_target.number_of_likes, votes // 2)
+        self.assertEqual(fetched_target.number_of_dislikes, votes // 2)
+
+    def test_apply_votes(self):
+        """It should apply a batch of votes to several recommendations"""
+        first = RecommendationFactory()
+        first.create()
+        second = RecommendationFactory()
+        second.create()
+        with self.assertLogs("flask.app", level="WARNING") as logs:
+            updated = Recommendation.apply_votes(
+                {first.rec_id: (3, 1), second.rec_id: (0, 2), 0: (1, 1)}
+            )
+        self.assertEqual(updated, 2)
+        self.assertIn("Dropped the votes for 1 unknown Recommendations: [0]", logs.output[-1])
+        with app.app_context():
+            fetched_first = Recommendation.find(first.rec_id)
+            fetched_second = Recommendation.find(second.rec_id)
+        self.assertEqual(fetched_first.number_of_likes, 3)
+        self.assertEqual(fetched_first.number_of_dislikes, 1)
+        self.assertEqual(fetched_second.number_of_likes, 0)
+        self.assertEqual(fetched_second.number_of_dislikes, 2)
+
+    def _query_plan(self, query) -> str:
+        """Returns the EXPLAIN output for a query with sequential scans disabled"""
+        statement = getattr(query, "statement", query)
+        sql = statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = db.session.execute(text(f"EXPLAIN {sql}")).scalars().all()
+        db.session.rollback()
+        return "\n".join(plan)
+
+    def test_lookups_use_indexes(self):
+        """It should use an index for every find_by_* lookup"""
+        top_query = (
+            Recommendation.query.filter(Recommendation.source_pid == 1)
+            .order_by(Recommendation.score.desc(), Recommendation.rec_id)
+            .limit(10)
+        )
+        lookups = [
+            ("ix_recommendation_source_pid_score", Recommendation.find_by_source_pid(1)),
+            ("ix_recommendation_name", Recommendation.find_by_name("chips")),
+            (
+                "ix_recommendation_recommendation_name",
+                Recommendation.find_by_rec_name("salsa"),
+            ),
+            (
+                "ix_recommendation_type_source_pid",
+                Recommendation.find_by_type(RecommendationType.UPSELL),
+            ),
+            ("ix_recommendation_source_pid_score", top_query),
+        ]
+        for index, query in lookups:
+            plan = self._query_plan(query)
+            self.assertIn(index, plan)
+            self.assertNotIn("Seq Scan", plan)
+
+    def test_vote_sorts_use_indexes(self):
+        """It should page through the vote counters with an index"""
+        for sort, index in [
+            ("number_of_likes", "ix_recommendation_likes_rec_id"),
+            ("number_of_dislikes", "ix_recommendation_dislikes_rec_id"),
+        ]:
+            for descending in (False, True):
+                statement = Recommendation.page_statement(
+                    Recommendation.select_records(), 10, (3, 42), sort, descending
+                )
+                plan = self._query_plan(statement)
+                self.assertIn(index, plan)
+                self.assertNotIn("Seq Scan", plan)
+
+    def test_lookups_reuse_statements(self):
+        """It should reuse the compiled lookups and prepare them on the server"""
+        before = statement_stats.stats()
+        for source_pid in range(10):
+            Recommendation.find_by_source_pid(source_pid).order_by(Recommendation.rec_id).all()
+            Recommendation.records(
+                db.session.execute(Recommendation.select_records(source_pid=source_pid, min_likes=1))
+            )
+        after = statement_stats.stats()
+        self.assertGreaterEqual(after["hits"] - before["hits"], 18)
+        statement = Recommendation.select_records(source_pid=1, type=RecommendationType.UPSELL)
+        self.assertIn("source_pid = %(source_pid)s", str(statement.compile(dialect=db.engine.dialect)))
+        prepared = db.session.execute(
+            text("SELECT count(*) FROM pg_prepared_statements WHERE statement LIKE '%source_pid = $1%'")
+        ).scalar()
+        self.assertGreaterEqual(prepared, 1)
+        db.session.rollback()
+
+    def test_delete_matching(self):
+        """It should delete the recommendations matching all criteria"""
+        for rec_type in (RecommendationType.UPSELL, RecommendationType.ACCESSORY):
+            RecommendationFactory(source_pid=987654, type=rec_type).create()
+        deleted = Recommendation.delete_matching(
+            source_pid=987654, type=RecommendationType.UPSELL
+        )
+        self.assertEqual(deleted, 1)
+        remaining = Recommendation.find_by_source_pid(987654).all()
+        self.assertEqual(len(remaining), 1)
+        self.assertEqual(remaining[0].type, RecommendationType.ACCESSORY)
+        Recommendation.delete_matching(source_pid=987654)
+
+    def test_select_records(self):
+        """It should read Recommendations as records without ORM state"""
+        for likes in (3, 1, 2):
+            RecommendationFactory(source_pid=765432, number_of_likes=likes).create()
+        statement = Recommendation.select_records(source_pid=765432, min_likes=2)
+        records, last = Recommendation.paginate(statement, 1, sort="number_of_likes")
+        self.assertIsInstance(records[0], RecommendationRecord)
+        self.assertFalse(hasattr(records[0], "__dict__"))
+        self.assertEqual(records[0].number_of_likes, 2)
+        self.assertEqual(records[0].serialize(), Recommendation.find(records[0].rec_id).serialize())
+        records, last = Recommendation.paginate(statement, 1, after=last, sort="number_of_likes")
+        self.assertEqual([record.number_of_likes for record in records], [3])
+        self.assertIsNone(last)
+        streamed = list(Recommendation.stream(statement, chunk_size=1))
+        self.assertEqual(len(streamed), 2)
+        Recommendation.delete_matching(source_pid=765432)
+
+    def test_wilson_score(self):
+        """It should rank confident likes above few likes"""
+        self.assertEqual(wilson_score(0, 0), 0.0)
+        self.assertEqual(wilson_score(None, None), 0.0)
+        self.assertGreater(wilson_score(90, 10), wilson_score(1, 0))
+        self.assertGreater(wilson_score(10, 0), wilson_score(10, 5))
+        for likes, dislikes in ((0, 0), (1, 0), (0, 3), (90, 10), (7, 7)):
+            in_sql = db.session.execute(
+                db.select(wilson_score_expression(likes, dislikes))
+            ).scalar()
+            self.assertAlmostEqual(in_sql, wilson_score(likes, dislikes))
+
+    def test_votes_update_score(self):
+        """It should keep the score current on every vote"""
+        target = RecommendationFactory(number_of_likes=4, number_of_dislikes=1)
+        target.create()
+        self.assertAlmostEqual(target.score, wilson_score(4, 1))
+        liked = Recommendation.like(target.rec_id)
+        self.assertAlmostEqual(liked.score, wilson_score(5, 1))
+        disliked = Recommendation.dislike(target.rec_id)
+        self.assertAlmostEqual(disliked.score, wilson_score(5, 2))
+        Recommendation.apply_votes({target.rec_id: (10, 0)})
+        with app.app_context():
+            fetched_target = Recommendation.find(target.rec_id)
+        self.assertAlmostEqual(fetched_target.score, wilson_score(15, 2))
+
+    def test_find_top(self):
+        """It should return the best scored recommendations of a product"""
+        votes = [(1, 0), (50, 2), (0, 5), (20, 1), (50, 2)]
+        for index, (likes, dislikes) in enumerate(votes):
+            RecommendationFactory(
+                source_pid=876543,
+                number_of_likes=likes,
+                number_of_dislikes=dislikes,
+                type=RecommendationType.UPSELL if index else RecommendationType.ACCESSORY,
+            ).create()
+        top = Recommendation.find_top(876543, 3)
+        self.assertEqual(
+            [(rec.number_of_likes, rec.number_of_dislikes) for rec in top],
+            [(50, 2), (50, 2), (20, 1)],
+        )
+        self.assertLess(top[0].rec_id, top[1].rec_id)
+        top = Recommendation.find_top(876543, 10, RecommendationType.ACCESSORY)
+        self.assertEqual(len(top), 1)
+        Recommendation.delete_matching(source_pid=876543)
+
+    def test_product_snapshot(self):
+        """It should store the serialized Recommendations of a product"""
+        for likes in (1, 30, 10):
+            RecommendationFactory(
+                source_pid=765450, number_of_likes=likes, number_of_dislikes=0,
+                type=RecommendationType.UPSELL,
+            ).create()
+        queued = db.session.execute(
+            db.select(db.func.count()).where(snapshot_queue.c.source_pid == 765450)
+        ).scalar()
+        self.assertEqual(queued, 3)
+        self.assertGreaterEqual(Recommendation.refresh_snapshots(), 1)
+        stored = db.session.execute(
+            db.select(snapshot_table.c.document).where(snapshot_table.c.source_pid == 765450)
+        ).scalar()
+        self.assertEqual(json.loads(stored), json.loads(Recommendation.find_snapshot(765450)))
+        document = json.loads(stored)
+        self.assertEqual(document["source_pid"], 765450)
+        self.assertEqual(document["recommendations"]["CROSSSELL"], [])
+        expected = [rec.serialize() for rec in Recommendation.find_top(765450, 10)]
+        self.assertEqual(document["recommendations"]["UPSELL"], expected)
+        self.assertEqual([rec["number_of_likes"] for rec in expected], [30, 10, 1])
+        Recommendation.delete_matching(source_pid=765450)
+
+    def test_stale_snapshot_until_refresh(self):
+        """It should serve the stored snapshot of a product until the next refresh"""
+        recommendation = RecommendationFactory(source_pid=765441, type=RecommendationType.ACCESSORY)
+        recommendation.create()
+        document = json.loads(Recommendation.find_snapshot(765441))
+        self.assertEqual(len(document["recommendations"]["ACCESSORY"]), 1)
+        Recommendation.refresh_snapshots()
+        name = recommendation.name
+        recommendation.name = "renamed"
+        recommendation.update()
+        document = json.loads(Recommendation.find_snapshot(765441))
+        self.assertEqual(document["recommendations"]["ACCESSORY"][0]["name"], name)
+        Recommendation.refresh_snapshots()
+        document = json.loads(Recommendation.find_snapshot(765441))
+        self.assertEqual(document["recommendations"]["ACCESSORY"][0]["name"], "renamed")
+        Recommendation.delete_matching(source_pid=765441)
+        Recommendation.refresh_snapshots()
+        stored = db.session.execute(
+            db.select(snapshot_table.c.document).where(snapshot_table.c.source_pid == 765441)
+        ).scalar()
+        self.assertIsNone(stored)
+
+    def test_snapshot_of_unknown_product(self):
+        """It should return an empty snapshot for a product without Recommendations"""
+        document = json.loads(Recommendation.find_snapshot(765442))
+        self.assertEqual(document["source_pid"], 765442)
+        self.assertEqual(
+            document["recommendations"], {rec_type.name: [] for rec_type in RecommendationType}
+        )
+
+    def test_check_schema_behind(self):
+        """It should only log a schema that is behind when not upgrading on startup"""
+        latest = migrations.latest_version()
+        db.session.execute(text("DELETE FROM schema_version WHERE version = :version"), {"version": latest})
+        db.session.commit()
+        with patch.dict(app.config, {"DB_UPGRADE_ON_STARTUP": False}):
+            with self.assertLogs("flask.app", "ERROR") as logs:
+                Recommendation.check_schema(app)
+        self.assertIn("flask db-upgrade", logs.output[0])
+        self.assertEqual(migrations.pending(db.engine), [latest])
+        with patch.dict(app.config, {"DB_UPGRADE_ON_STARTUP": True}):
+            Recommendation.check_schema(app)
+        self.assertEqual(migrations.pending(db.engine), [])
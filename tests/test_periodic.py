@@ -0,0 +1,40 @@
+"""
+Test cases for the Periodic Task
+"""
+import threading
+from unittest import TestCase
+from service.common.periodic import PeriodicTask
+
+
+class TestPeriodicTask(TestCase):
+    """Periodic Task Tests"""
+
+    def test_runs_on_every_interval(self):
+        """It should call the function repeatedly until stopped"""
+        calls = threading.Semaphore(0)
+        task = PeriodicTask(calls.release, interval=0.01, name="test-task")
+        task.start()
+        task.start()
+        for _ in range(3):
+            self.assertTrue(calls.acquire(timeout=2))
+        task.stop()
+
+    def test_survives_errors(self):
+        """It should keep running after the function raises"""
+        calls = threading.Semaphore(0)
+
+        def failing():
+            calls.release()
+            raise RuntimeError("boom")
+
+        task = PeriodicTask(failing, interval=0.01, name="test-task")
+        task.start()
+        for _ in range(2):
+            self.assertTrue(calls.acquire(timeout=2))
+        task.stop()
+
+    def test_disabled(self):
+        """It should not start a thread when the interval is not positive"""
+        task = PeriodicTask(lambda: None, interval=0, name="test-task")
+        task.start()
+        self.assertIsNone(task._thread)  # pylint: disable=protected-access
@@ -0,0 +1,49 @@
+"""
+Test cases for the timed connection pool and statement timeouts
+"""
+from unittest import TestCase
+from sqlalchemy import create_engine, exc, text
+from service.common import pool
+from service.models import db
+
+
+class TestPool(TestCase):
+    """Connection Pool Tests"""
+
+    def setUp(self):
+        self.engine = create_engine(
+            db.engine.url,
+            poolclass=pool.TimedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.1,
+        )
+        pool.listen(self.engine, 200)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_statement_timeout(self):
+        """It should set the statement timeout on checked out connections"""
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.execute(text("SHOW statement_timeout")).scalar(), "200ms")
+            connection.rollback()
+        with self.engine.connect() as connection:
+            # the rollback must not have undone it
+            self.assertEqual(connection.execute(text("SHOW statement_timeout")).scalar(), "200ms")
+            with self.assertRaises(exc.OperationalError):
+                connection.execute(text("SELECT pg_sleep(1)"))
+
+    def test_pool_stats(self):
+        """It should count checkouts and the ones that timed out"""
+        with self.engine.connect():
+            stats = pool.pool_stats(self.engine)
+            self.assertEqual(stats["checked_out"], 1)
+            with self.assertRaises(exc.TimeoutError):
+                self.engine.connect()
+        stats = pool.pool_stats(self.engine)
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["wait_max_ms"], 100)
@@ -0,0 +1,173 @@
+"""
+Test cases for the traffic capture and replay
+"""
+import glob
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from starlette.testclient import TestClient
+from service import app, asgi
+from service.common import status
+from service.common.traffic_capture import TrafficCapture, read_captures, replay, summarize
+from service.models import Recommendation
+from service.routes import traffic_capture
+
+ENTRY = {
+    "method": "GET",
+    "path": "/api/recommendations",
+    "query": "limit=1",
+    "content_type": None,
+    "body": None,
+    "status": 200,
+    "duration_ms": 5.0,
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every request with 200 and remembers what it got"""
+
+    received = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers a GET"""
+        self.received.append((self.command, self.path, None))
+        self._ok()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answers a POST"""
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.received.append((self.command, self.path, body))
+        self._ok()
+
+    def _ok(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keeps the test output quiet"""
+
+
+class TestTrafficCapture(TestCase):
+    """Traffic Capture Tests"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.capture = TrafficCapture(self.directory.name, sample_rate=1.0, max_body=8)
+
+    def tearDown(self):
+        self.capture.close()
+        self.directory.cleanup()
+
+    def test_disabled(self):
+        """It should not sample without a directory or a sample rate"""
+        self.assertFalse(TrafficCapture().sampled())
+        self.assertFalse(TrafficCapture(self.directory.name, sample_rate=0).sampled())
+        self.assertTrue(self.capture.sampled())
+
+    def test_record(self):
+        """It should write every request as a line of JSON"""
+        self.capture.record(100.0, "GET", "/health", "", None, b"", 200, 0.002)
+        self.capture.record(101.0, "POST", "/api/recommendations", "", "application/json", b'{"a": 123456}', 201, 0.01)
+        entries = read_captures([self.directory.name])
+        self.assertEqual([entry["path"] for entry in entries], ["/health", "/api/recommendations"])
+        self.assertEqual(entries[0]["duration_ms"], 2.0)
+        self.assertIsNone(entries[0]["body"])
+        self.assertEqual(entries[1]["body"], '{"a": 12')
+        self.assertTrue(entries[1]["truncated"])
+        self.assertEqual(entries[1]["status"], 201)
+
+    def test_rotation(self):
+        """It should rotate the file at max_bytes"""
+        self.capture.configure(self.directory.name, 1.0, max_bytes=300, backup_count=2, max_body=8)
+        for number in range(10):
+            self.capture.record(float(number), "GET", "/health", "", None, b"", 200, 0.001)
+        files = glob.glob(os.path.join(self.directory.name, "capture-*.jsonl*"))
+        self.assertEqual(len(files), 3)
+        kept = [entry["ts"] for entry in read_captures(files)]
+        self.assertEqual(kept[-1], 9.0)
+        self.assertNotIn(0.0, kept)
+
+    def test_capture_requests(self):
+        """It should capture the requests the service handles"""
+        traffic_capture.configure(self.directory.name, 1.0, 2 ** 20, 1, 2 ** 10)
+        try:
+            client = app.test_client()
+            client.get("/health?verbose=1")
+            client.post(
+                "/api/recommendations",
+                json={
+                    "source_pid": 765460,
+                    "name": "captured",
+                    "recommendation_name": "captured",
+                    "type": "UPSELL",
+                    "number_of_likes": 0,
+                    "number_of_dislikes": 0,
+                },
+            )
+        finally:
+            traffic_capture.configure("", 0.0, 2 ** 20, 1, 2 ** 10)
+            Recommendation.delete_matching(source_pid=765460)
+        health, created = read_captures([self.directory.name])
+        self.assertEqual((health["method"], health["path"], health["query"]), ("GET", "/health", "verbose=1"))
+        self.assertEqual(health["status"], status.HTTP_200_OK)
+        self.assertEqual(created["status"], status.HTTP_201_CREATED)
+        self.assertEqual(created["content_type"], "application/json")
+        self.assertIn('"captured"', created["body"])
+
+    def test_capture_asgi_requests(self):
+        """It should capture the requests the ASGI entry point handles the same way"""
+        traffic_capture.configure(self.directory.name, 1.0, 2 ** 20, 1, 8)
+        try:
+            with TestClient(asgi.app) as client:
+                client.get("/health?verbose=1")
+                client.post("/api/recommendations", json={"name": "too long to keep"})
+        finally:
+            traffic_capture.configure("", 0.0, 2 ** 20, 1, 2 ** 10)
+        health, rejected = read_captures([self.directory.name])
+        self.assertEqual((health["method"], health["path"], health["query"]), ("GET", "/health", "verbose=1"))
+        self.assertEqual(health["status"], status.HTTP_200_OK)
+        self.assertEqual(rejected["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(rejected["content_type"], "application/json")
+        self.assertEqual(rejected["body"], '{"name":')
+        self.assertTrue(rejected["truncated"])
+
+    def test_replay(self):
+        """It should send the captured requests again and compare their latency"""
+        StubHandler.received = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            entries = [
+                dict(ENTRY, ts=1.0),
+                dict(ENTRY, ts=1.05, method="POST", query="", content_type="application/json", body='{"a": 1}'),
+                dict(ENTRY, ts=1.1, status=404),
+            ]
+            results = replay(entries, f"http://127.0.0.1:{server.server_address[1]}", speed=1.0, parallel=2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(
+            StubHandler.received,
+            [
+                ("GET", "/api/recommendations?limit=1", None),
+                ("POST", "/api/recommendations", b'{"a": 1}'),
+                ("GET", "/api/recommendations?limit=1", None),
+            ],
+        )
+        summary = summarize(results)
+        self.assertEqual(summary["requests"], 3)
+        self.assertEqual(summary["errors"], 0)
+        self.assertEqual(summary["status_changed"], 1)
+        self.assertEqual(summary["captured"]["p50"], 5.0)
+        self.assertIsNotNone(summary["replayed"]["p99"])
+
+    def test_replay_unreachable(self):
+        """It should count requests that could not be sent as errors"""
+        results = replay([dict(ENTRY, ts=1.0)], "http://127.0.0.1:9", speed=0)
+        summary = summarize(results)
+        self.assertEqual(summary["errors"], 1)
+        self.assertIsNone(summary["replayed"]["p50"])
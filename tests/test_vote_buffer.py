@@ -0,0 +1,112 @@
+"""
+Test cases for the write-behind Vote Buffer
+"""
+import time
+from unittest import TestCase
+from service.common.vote_buffer import VoteBuffer
+
+
+class TestVoteBuffer(TestCase):
+    """Vote Buffer Tests"""
+
+    def setUp(self):
+        self.batches = []
+        self.buffer = VoteBuffer(self.batches.append, interval=60, max_pending=100)
+
+    def tearDown(self):
+        self.buffer.stop()
+
+    def _wait_for_flush(self, timeout=2.0):
+        """Waits for the background thread to flush a batch"""
+        deadline = time.monotonic() + timeout
+        while not self.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_add_aggregates_votes(self):
+        """It should add up votes by rec_id"""
+        self.assertEqual(self.buffer.add(1, likes=1), (1, 0))
+        self.assertEqual(self.buffer.add(1, likes=1), (2, 0))
+        self.assertEqual(self.buffer.add(1, dislikes=1), (2, 1))
+        self.assertEqual(self.buffer.add(2, dislikes=1), (0, 1))
+        self.assertEqual(self.buffer.pending(1), (2, 1))
+        self.assertEqual(self.buffer.pending(3), (0, 0))
+
+    def test_flush_writes_one_batch(self):
+        """It should flush all pending votes in a single batch"""
+        self.buffer.add(1, likes=1)
+        self.buffer.add(2, dislikes=1)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.batches, [{1: (1, 0), 2: (0, 1)}])
+        self.assertEqual(self.buffer.pending(1), (0, 0))
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.batches), 1)
+
+    def test_flush_when_full(self):
+        """It should flush early once max_pending votes are waiting"""
+        for _ in range(100):
+            self.buffer.add(1, likes=1)
+        self._wait_for_flush()
+        self.assertTrue(self.batches)
+        self.assertEqual(sum(batch[1][0] for batch in self.batches), 100)
+
+    def test_flush_on_interval(self):
+        """It should flush on its own after the interval"""
+        buffer = VoteBuffer(self.batches.append, interval=0.05)
+        buffer.add(1, likes=1)
+        self._wait_for_flush()
+        buffer.stop()
+        self.assertEqual(self.batches, [{1: (1, 0)}])
+
+    def test_flush_failure_keeps_votes(self):
+        """It should keep the votes when a flush fails"""
+
+        def broken_flush(_votes):
+            raise ConnectionError("database is down")
+
+        buffer = VoteBuffer(broken_flush, interval=60)
+        buffer.add(1, likes=2)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending(1), (2, 0))
+        buffer.flush_func = self.batches.append
+        buffer.stop()
+        self.assertEqual(self.batches, [{1: (2, 0)}])
+
+    def test_flush_failure_retries_are_capped(self):
+        """It should drop the votes once max_retries flushes in a row have failed"""
+
+        def broken_flush(_votes):
+            raise ConnectionError("database is down")
+
+        buffer = VoteBuffer(broken_flush, interval=60, max_retries=3)
+        buffer.add(1, likes=2)
+        with self.assertLogs("flask.app", level="ERROR") as logs:
+            for _ in range(3):
+                self.assertEqual(buffer.flush(), 0)
+        self.assertIn("dropping the votes for 1 recommendations", logs.output[-1])
+        self.assertEqual(buffer.pending(1), (0, 0))
+        buffer.add(1, likes=1)
+        buffer.flush_func = self.batches.append
+        buffer.stop()
+        self.assertEqual(self.batches, [{1: (1, 0)}])
+
+    def test_flush_failure_backlog_is_capped(self):
+        """It should not put back more than max_backlog votes after a failed flush"""
+
+        def broken_flush(_votes):
+            raise ConnectionError("database is down")
+
+        buffer = VoteBuffer(broken_flush, interval=60, max_pending=100, max_backlog=5)
+        buffer.add(1, likes=3)
+        buffer.add(2, likes=4)
+        with self.assertLogs("flask.app", level="ERROR") as logs:
+            buffer.flush()
+        self.assertIn("Vote buffer is over 5 votes", logs.output[-1])
+        self.assertEqual((buffer.pending(1), buffer.pending(2)), ((3, 0), (0, 0)))
+        buffer.flush_func = self.batches.append
+        buffer.stop()
+
+    def test_stop_flushes(self):
+        """It should flush pending votes when stopped"""
+        self.buffer.add(7, likes=3)
+        self.buffer.stop()
+        self.assertEqual(self.batches, [{7: (3, 0)}])